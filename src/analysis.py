@@ -0,0 +1,154 @@
+"""
+analysis.py
+    This script runs the whole analysis of a set of games: it fits the models, computes
+    the SHAP values and renders the figures. The rendered figures are returned together
+    with the results they depict, so the app can cache both in a single entry.
+"""
+
+import pandas as pd
+from modeling import (
+    FEATURES,
+    LogitModel,
+    prepare_data,
+    fit_logit,
+    log_reg_results,
+    shap_values_results,
+)
+from plots import coefficients_plot, contrasts_plot, shap_values_plot
+from resampling import (
+    bootstrap_results,
+    contrast_permutation_test,
+    season_cross_validation,
+)
+
+# Options of the default analysis
+DEFAULT_OPTIONS = {
+    "penalty": "none",
+    "n_bootstrap": 0,
+    "permutation_test": False,
+    "cross_validation": False,
+}
+
+
+def run_analysis(
+    games_starters: pd.DataFrame,
+    penalty: str = "none",
+    n_bootstrap: int = 0,
+    permutation_test: bool = False,
+    cross_validation: bool = False,
+    model: LogitModel | None = None,
+) -> dict:
+    """
+    This function runs the logistic regression and SHAP values analyses and renders
+    their plots. Both analyses take their results from a single fit of the model.
+
+    Args:
+        games_starters: pd.DataFrame that contains the team's games data from games
+            where Jokic and Murray were starters.
+        penalty: str with the penalty of the logistic regression, either 'none' or
+            'l2' (see fit_logit()).
+        n_bootstrap: int with the number of bootstrap replicates used to compute the
+            confidence intervals of the coefficients and SHAP values. If it's 0, the
+            intervals aren't computed.
+        permutation_test: bool that indicates whether to run a permutation test of the
+            difference between Jokic and Murray regression coefficients.
+        cross_validation: bool that indicates whether to evaluate the model out of
+            sample with season-blocked cross-validation.
+        model: LogitModel already fitted to the games with the given penalty (e.g.,
+            the model of the persisted state, see model_state.py). By default, the
+            model is fitted.
+
+    Returns:
+        results: dict with the results of the analysis:
+            jokic: list with Jokic's assists coefficient, probability equivalent and
+                its p-value.
+            murray: list with Murray's points coefficient, probability equivalent and
+                its p-value.
+            diff_test: list with results from test evaluating differences between
+                Jokic and Murray regression coefficients.
+            jokic_shap: list with Jokic's assists SHAP value and its probability
+                equivalent.
+            murray_shap: list with Murray's points SHAP value and its probability
+                equivalent.
+            coef_plot: bytes with the PNG bar plot of the regression coefficients.
+            shap_plot: bytes with the PNG bar plot of the SHAP values.
+            contrasts_plot: bytes with the PNG heatmap of the differences between all
+                pairs of coefficients.
+            bootstrap: pd.DataFrame with the bootstrap confidence intervals of the
+                coefficients and SHAP values, or None if they aren't computed.
+            permutation_test: dict with the results of the permutation test of the
+                difference between Jokic and Murray regression coefficients, or None
+                if it isn't run.
+            cross_validation: tuple with the metrics of each fold and the calibration
+                table of the season-blocked cross-validation (see
+                season_cross_validation()), or None if it isn't run.
+            coef: np.ndarray with the standardized coefficients (intercept last).
+            cov: np.ndarray with the covariance matrix of the coefficients.
+            scaler_mean: np.ndarray with the mean of each predictor.
+            scaler_scale: np.ndarray with the standard deviation of each predictor.
+            shap_values: np.ndarray with the SHAP values of each game.
+    """
+
+    # Split data into standardized independent variables and dependent variable
+    x_train, y_train = prepare_data(games_starters)
+
+    # Fit a logistic regression once (unless it's given) and extract the coefficients
+    # from it
+    if model is None:
+        model = fit_logit(x_train=x_train, y_train=y_train, penalty=penalty)
+    jokic, murray, diff_test, coef_summary = log_reg_results(model=model)
+
+    # Compute the SHAP values from the same model
+    (
+        shap_values,
+        jokic_shap_value,
+        jokic_prob,
+        murray_shap_value,
+        murray_prob,
+    ) = shap_values_results(model=model, x_train=x_train)
+
+    results = {
+        "jokic": jokic,
+        "murray": murray,
+        "diff_test": diff_test,
+        "jokic_shap": [jokic_shap_value, jokic_prob],
+        "murray_shap": [murray_shap_value, murray_prob],
+        "coef_plot": coefficients_plot(coef_summary),
+        "shap_plot": shap_values_plot(shap_values=shap_values, x_train=x_train),
+        "contrasts_plot": contrasts_plot(
+            contrast_z=model.contrast_z, contrast_p=model.contrast_p
+        ),
+        "bootstrap": (
+            bootstrap_results(
+                x_train=x_train,
+                y_train=y_train,
+                n_replicates=n_bootstrap,
+                penalty=penalty,
+            )
+            if n_bootstrap > 0
+            else None
+        ),
+        "permutation_test": (
+            contrast_permutation_test(x_train=x_train, y_train=y_train, penalty=penalty)
+            if permutation_test
+            else None
+        ),
+        "cross_validation": (
+            season_cross_validation(
+                x_train=x_train,
+                y_train=y_train,
+                season_ids=games_starters["season_id"],
+                penalty=penalty,
+            )
+            if cross_validation
+            else None
+        ),
+        "coef": model.coef.to_numpy(),
+        "cov": model.cov.to_numpy(),
+        # Parameters of the standardization of the predictors (see prepare_data())
+        "scaler_mean": games_starters[FEATURES].mean().to_numpy(dtype=float),
+        "scaler_scale": games_starters[FEATURES].std(ddof=0).to_numpy(dtype=float),
+        "shap_values": shap_values,
+    }
+
+    return results
@@ -0,0 +1,279 @@
+"""
+artifact_store.py
+    This script contains the local store of the analysis artifacts: the fitted model,
+    the scaler parameters, the SHAP values, the test results and the rendered figures.
+    Each artifact is keyed by a fingerprint of the input games, the date range and the
+    options of the analysis, so the app and the batch jobs load an existing artifact
+    instead of running the analysis again.
+"""
+
+import io
+import os
+import json
+import time
+import hashlib
+import numpy as np
+import pandas as pd
+from analysis import run_analysis
+from modeling import LogitModel
+from utils import data_fingerprint
+
+# Directory where the artifacts are stored
+ARTIFACT_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "data", "artifacts"
+)
+
+# Version of the artifacts' layout. Artifacts written with another version are
+# ignored, so changes to the analysis invalidate them
+ARTIFACT_VERSION = 1
+
+# Limits of the store enforced by the garbage collection
+MAX_AGE_DAYS = 30
+MAX_SIZE_MB = 200
+
+
+def artifact_key(games_starters: pd.DataFrame, date_range: tuple, options: dict) -> str:
+    """
+    This function builds the key of an artifact.
+
+    Args:
+        games_starters: pd.DataFrame that contains the team's games data from games
+            where Jokic and Murray were starters.
+        date_range: tuple that contains the start and end date of the analysis.
+        options: dict with the options of the analysis (see run_analysis()).
+
+    Returns:
+        str with the hexadecimal SHA-256 digest of the fingerprint of the games, the
+            date range, the options and the artifacts' version.
+    """
+
+    config = {
+        "version": ARTIFACT_VERSION,
+        "data": data_fingerprint(games_starters),
+        "date_range": [str(date) for date in date_range],
+        "options": options,
+    }
+    return hashlib.sha256(json.dumps(config, sort_keys=True).encode()).hexdigest()
+
+
+def _encode(name: str, value, arrays: dict) -> dict:
+    """
+    This function encodes a value of an artifact. Binary values (arrays and figures)
+    are added to the arrays that are stored compressed, while the rest of the values
+    are described in the returned JSON-serializable entry.
+
+    Args:
+        name: str with the name of the value.
+        value: value to encode.
+        arrays: dict with the arrays to store, updated in place.
+
+    Returns:
+        dict with the entry that describes the value.
+    """
+
+    if isinstance(value, bytes):
+        arrays[name] = np.frombuffer(value, dtype=np.uint8)
+        return {"type": "bytes"}
+    if isinstance(value, np.ndarray):
+        arrays[name] = value
+        return {"type": "array"}
+    if isinstance(value, pd.DataFrame):
+        return {
+            "type": "frame",
+            "data": value.to_json(orient="split", double_precision=15),
+            "dtypes": value.dtypes.astype(str).to_dict(),
+            "index_name": value.index.name,
+            "attrs": value.attrs,
+        }
+    if isinstance(value, tuple):
+        return {
+            "type": "tuple",
+            "items": [
+                _encode(name + "." + str(i), item, arrays)
+                for i, item in enumerate(value)
+            ],
+        }
+    return {"type": "json", "data": value}
+
+
+def _decode(name: str, entry: dict, arrays) -> object:
+    """
+    This function decodes a value of an artifact (see _encode()).
+
+    Args:
+        name: str with the name of the value.
+        entry: dict with the entry that describes the value.
+        arrays: NpzFile with the stored arrays.
+
+    Returns:
+        decoded value.
+    """
+
+    if entry["type"] == "bytes":
+        return arrays[name].tobytes()
+    if entry["type"] == "array":
+        return arrays[name]
+    if entry["type"] == "frame":
+        frame = pd.read_json(io.StringIO(entry["data"]), orient="split")
+        frame = frame.astype(entry["dtypes"])
+        frame.index.name = entry["index_name"]
+        frame.attrs = entry["attrs"]
+        return frame
+    if entry["type"] == "tuple":
+        return tuple(
+            _decode(name + "." + str(i), item, arrays)
+            for i, item in enumerate(entry["items"])
+        )
+    return entry["data"]
+
+
+def _json_default(value) -> object:
+    """
+    This function converts the numpy scalars of the results to Python scalars when
+    they are serialized to JSON.
+    """
+
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError("Object of type " + type(value).__name__ + " isn't serializable.")
+
+
+def save_artifact(key: str, results: dict, artifact_dir: str = ARTIFACT_DIR) -> None:
+    """
+    This function stores the results of an analysis as a compressed artifact. The
+    artifact is written to a temporary file first, so readers never see a partially
+    written artifact.
+
+    Args:
+        key: str with the key of the artifact (see artifact_key()).
+        results: dict with the results of the analysis (see run_analysis()).
+        artifact_dir: str with the directory of the store.
+    """
+
+    os.makedirs(artifact_dir, exist_ok=True)
+    arrays = {}
+    entries = {name: _encode(name, value, arrays) for name, value in results.items()}
+    metadata = json.dumps(entries, default=_json_default)
+
+    path = os.path.join(artifact_dir, key + ".npz")
+    temp_path = path + "." + str(os.getpid()) + ".tmp"
+    with open(temp_path, "wb") as artifact_file:
+        np.savez_compressed(artifact_file, __metadata__=np.array(metadata), **arrays)
+    os.replace(temp_path, path)
+
+
+def load_artifact(key: str, artifact_dir: str = ARTIFACT_DIR) -> dict | None:
+    """
+    This function loads the results of an analysis from the store. Loading an artifact
+    refreshes its modification time, so the garbage collection removes the least
+    recently used artifacts first.
+
+    Args:
+        key: str with the key of the artifact (see artifact_key()).
+        artifact_dir: str with the directory of the store.
+
+    Returns:
+        dict with the results of the analysis, or None if the artifact doesn't exist or
+            can't be read.
+    """
+
+    path = os.path.join(artifact_dir, key + ".npz")
+    try:
+        with np.load(path) as arrays:
+            entries = json.loads(str(arrays["__metadata__"]))
+            results = {
+                name: _decode(name, entry, arrays) for name, entry in entries.items()
+            }
+        os.utime(path)
+    except (OSError, ValueError, KeyError):
+        return None
+
+    return results
+
+
+def collect_garbage(
+    artifact_dir: str = ARTIFACT_DIR,
+    max_age_days: float = MAX_AGE_DAYS,
+    max_size_mb: float = MAX_SIZE_MB,
+) -> int:
+    """
+    This function removes the artifacts that weren't used in the last max_age_days
+    days and then the least recently used artifacts until the store's size is within
+    max_size_mb megabytes. Orphaned temporary files are removed, too.
+
+    Args:
+        artifact_dir: str with the directory of the store.
+        max_age_days: float with the maximum age (since last use) of an artifact.
+        max_size_mb: float with the maximum size of the store.
+
+    Returns:
+        int with the number of files removed.
+    """
+
+    if not os.path.isdir(artifact_dir):
+        return 0
+
+    now = time.time()
+    artifacts = []
+    for entry in os.scandir(artifact_dir):
+        if entry.is_file():
+            stat = entry.stat()
+            artifacts.append((stat.st_mtime, stat.st_size, entry.path))
+
+    # We remove the oldest artifacts first
+    artifacts.sort()
+    total_size = sum(size for _, size, _ in artifacts)
+    removed = 0
+    for mtime, size, path in artifacts:
+        if path.endswith(".tmp"):
+            # Temporary files are only removed once their writer is surely gone
+            remove = now - mtime > 3600
+        else:
+            remove = (
+                now - mtime > max_age_days * 86400 or total_size > max_size_mb * 1024**2
+            )
+        if not remove:
+            continue
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total_size -= size
+        removed += 1
+
+    return removed
+
+
+def load_or_run_analysis(
+    games_starters: pd.DataFrame,
+    date_range: tuple,
+    options: dict,
+    model: LogitModel | None = None,
+) -> dict:
+    """
+    This function loads the results of an analysis from the store, or runs the
+    analysis and stores its results if they aren't stored yet.
+
+    Args:
+        games_starters: pd.DataFrame that contains the team's games data from games
+            where Jokic and Murray were starters.
+        date_range: tuple that contains the start and end date of the analysis.
+        options: dict with the options of the analysis (see run_analysis()).
+        model: LogitModel already fitted to the games, if any (see run_analysis()).
+
+    Returns:
+        results: dict with the results of the analysis (see run_analysis()).
+    """
+
+    key = artifact_key(games_starters, date_range, options)
+    results = load_artifact(key)
+    if results is None:
+        results = run_analysis(games_starters=games_starters, model=model, **options)
+        # The store is only a cache, so failing to write to it isn't an error
+        try:
+            save_artifact(key, results)
+            collect_garbage()
+        except OSError:
+            pass
+
+    return results
@@ -0,0 +1,367 @@
+"""
+benchmark_fetch.py
+    This script contains the benchmark of the box score fetches against the replay
+    server (see replay_server.py). The recorded box scores are fetched through the
+    ingestion scripts' own fetch paths, append_players_stats() of the cron job and
+    pull_finished_games() of the ingestion daemon, under the latency, rate limit and
+    injected errors of the server. Like the scripts, the benchmark doesn't retry a
+    failed call: the game is dead-lettered, and each later pass retries the
+    dead-lettered games, like the dead-letter queue does (without its delays). The
+    games can be split across several workers, each fetching its share through the
+    fetch path and waiting a delay after each call, to sweep the concurrency and the
+    throttling against the server's rate limit. The throughput, the latency
+    percentiles and the games dead-lettered by each path, number of workers and delay
+    are written to a JSON file.
+
+    Usage (from the folder src, after recording some box scores):
+        python benchmark_fetch.py --latency 0.2 --jitter 0.1
+        python benchmark_fetch.py --paths cron --error-rate 0.1 --passes 3
+        python benchmark_fetch.py --rate-limit 5 --workers 1 2 4 8 --delay 0 0.5 1
+"""
+
+import os
+import json
+import time
+import argparse
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timezone
+import numpy as np
+import pandas as pd
+from nba_api.stats.endpoints import boxscoretraditionalv2
+import fetch_data_cron
+import ingest_daemon
+from fetch_data_cron import PLAYERS, append_players_stats
+from ingest_daemon import FINAL_STATUS, SCHEDULE_COLUMNS, pull_finished_games
+from replay_server import REPLAY_DIR, load_recordings, start_server
+from utils import NBA_STATS_BASE_URL_ENV, configure_nba_api, season_id_from_game_id
+
+# File of the benchmark results
+RESULTS_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "benchmarks", "fetch_results.json"
+)
+
+# Port of the replay server started by the benchmark
+PORT = 8766
+
+
+@contextmanager
+def offline_fetch(delay: float = 0.0):
+    """
+    Run the fetch paths without side effects: the raw box scores and schedule entries
+    aren't written to the lake and the dead-letter queue isn't read nor updated. The
+    games that would be dead-lettered and the time of every box score call are
+    collected instead.
+
+    Args:
+        delay: float with the wait (seconds) after each box score call, which isn't
+            part of the call's time.
+
+    Yields:
+        dict with the errors of the dead-lettered games, keyed by game id, and a list
+            with the time (seconds) of each box score call.
+    """
+
+    probe = {"dead_letters": {}, "calls": []}
+    box_score_class = boxscoretraditionalv2.BoxScoreTraditionalV2
+
+    class TimedBoxScore(box_score_class):
+        """
+        BoxScoreTraditionalV2 endpoint that records the time of its call and waits
+        the delay after it.
+        """
+
+        def __init__(self, *args, **kwargs):
+            start = time.perf_counter()
+            try:
+                super().__init__(*args, **kwargs)
+            finally:
+                probe["calls"].append(time.perf_counter() - start)
+                time.sleep(delay)
+
+    def record_dead_letters(failed, errors, succeeded):
+        probe["dead_letters"].update(errors)
+
+    patches = [
+        (boxscoretraditionalv2, "BoxScoreTraditionalV2", TimedBoxScore),
+        (fetch_data_cron, "write_box_score", lambda box_score, game_id: None),
+        (fetch_data_cron, "load_dead_letters", lambda: {}),
+        (fetch_data_cron, "update_dead_letters", record_dead_letters),
+        (ingest_daemon, "write_partition", lambda **kwargs: None),
+        (ingest_daemon, "update_dead_letters", record_dead_letters),
+    ]
+    originals = [(module, name, getattr(module, name)) for module, name, _ in patches]
+    for module, name, value in patches:
+        setattr(module, name, value)
+    try:
+        yield probe
+    finally:
+        for module, name, value in originals:
+            setattr(module, name, value)
+
+
+def fetch_cron(game_ids: list) -> list:
+    """
+    This function fetches the box scores of the given games the way the cron job does,
+    appending the tracked players' stats to the games.
+
+    Args:
+        game_ids: list with the games' ids.
+
+    Returns:
+        list with the ids of the games whose box score was fetched.
+    """
+
+    team_games = pd.DataFrame({"GAME_ID": game_ids})
+    games_data = append_players_stats(players_list=PLAYERS, team_games=team_games)
+
+    return games_data["GAME_ID"].tolist()
+
+
+def fetch_daemon(game_ids: list) -> list:
+    """
+    This function fetches the box scores of the given games the way the ingestion
+    daemon does, building the team's games data from them. The games' dates aren't
+    needed, since nothing is written.
+
+    Args:
+        game_ids: list with the games' ids.
+
+    Returns:
+        list with the ids of the games whose box score was fetched.
+    """
+
+    games = pd.DataFrame(
+        {
+            "game_id": game_ids,
+            "season_id": [season_id_from_game_id(game_id) for game_id in game_ids],
+            "playoffs": [int(game_id[2] == "4") for game_id in game_ids],
+            "status": FINAL_STATUS,
+        },
+        columns=SCHEDULE_COLUMNS,
+    )
+    team_games, _ = pull_finished_games(games)
+
+    return team_games["GAME_ID"].tolist()
+
+
+# Fetch paths of the ingestion scripts
+FETCH_PATHS = {"cron": fetch_cron, "daemon": fetch_daemon}
+
+
+def run_fetch_benchmark(
+    path: str,
+    game_ids: list,
+    passes: int,
+    server_options: dict,
+    workers: int = 1,
+    delay: float = 0.0,
+) -> dict:
+    """
+    This function fetches the box scores of the given games through a fetch path from
+    a fresh replay server. The first pass fetches all the games and each later pass
+    retries the games dead-lettered by the previous one. In each pass, the games are
+    split across the workers, which call the fetch path concurrently.
+
+    Args:
+        path: str with the fetch path, either 'cron' or 'daemon'.
+        game_ids: list with the games' ids.
+        passes: int with the maximum number of passes.
+        server_options: dict with the options of the replay server (see
+            replay_server.ReplayServer).
+        workers: int with the number of workers.
+        delay: float with the wait (seconds) of each worker after each call.
+
+    Returns:
+        dict with the results of the run.
+    """
+
+    server = start_server(address=("127.0.0.1", PORT), **server_options)
+    os.environ[NBA_STATS_BASE_URL_ENV] = "http://127.0.0.1:" + str(PORT) + "/stats"
+    configure_nba_api()
+
+    errors = {}
+    runs = []
+    try:
+        with offline_fetch(delay=delay) as probe, ThreadPoolExecutor(
+            max_workers=workers
+        ) as executor:
+            pending = list(game_ids)
+            start = time.perf_counter()
+            while pending and len(runs) < passes:
+                probe["dead_letters"].clear()
+                pass_start = time.perf_counter()
+                # Each worker fetches every n-th pending game
+                shares = [pending[i::workers] for i in range(workers)]
+                fetched = [
+                    game_id
+                    for share_fetched in executor.map(
+                        FETCH_PATHS[path], [share for share in shares if share]
+                    )
+                    for game_id in share_fetched
+                ]
+                runs.append(
+                    {
+                        "games": len(pending),
+                        "fetched": len(fetched),
+                        "dead_lettered": len(probe["dead_letters"]),
+                        "wall_s": round(time.perf_counter() - pass_start, 4),
+                    }
+                )
+                for error in probe["dead_letters"].values():
+                    error_type = error.split(":")[0]
+                    errors[error_type] = errors.get(error_type, 0) + 1
+                pending = [
+                    game_id for game_id in pending if game_id in probe["dead_letters"]
+                ]
+            wall_s = time.perf_counter() - start
+            calls = np.array(probe["calls"])
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    fetched = sum(run["fetched"] for run in runs)
+
+    return {
+        "path": path,
+        "workers": workers,
+        "delay": delay,
+        "games": len(game_ids),
+        "fetched": fetched,
+        "dead_lettered": len(pending),
+        "calls": len(calls),
+        "errors": errors,
+        "wall_s": round(wall_s, 4),
+        "games_per_s": round(fetched / wall_s, 3),
+        "p50_s": round(float(np.percentile(calls, 50)), 4),
+        "p95_s": round(float(np.percentile(calls, 95)), 4),
+        "passes": runs,
+        "server": dict(server.counters),
+    }
+
+
+def main() -> None:
+    """
+    This function parses the command-line arguments, runs the benchmark for each fetch
+    path and writes the results.
+    """
+
+    parser = argparse.ArgumentParser(
+        description="Benchmark the box score fetches against the replay server."
+    )
+    parser.add_argument(
+        "--paths",
+        nargs="+",
+        choices=list(FETCH_PATHS),
+        default=list(FETCH_PATHS),
+        help="fetch paths benchmarked (default: cron daemon)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        nargs="+",
+        default=[1],
+        help="numbers of concurrent workers swept (default: 1)",
+    )
+    parser.add_argument(
+        "--delay",
+        type=float,
+        nargs="+",
+        default=[0.0],
+        help="waits (seconds) of each worker after each call swept (default: 0)",
+    )
+    parser.add_argument(
+        "--passes",
+        type=int,
+        default=3,
+        help="maximum number of passes, each retrying the dead-lettered games",
+    )
+    parser.add_argument(
+        "--games", type=int, default=None, help="number of recorded games fetched"
+    )
+    parser.add_argument(
+        "--replay-dir", default=REPLAY_DIR, help="directory of the recordings"
+    )
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--jitter", type=float, default=0.1)
+    parser.add_argument("--rate-limit", type=float, default=None)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--stall-rate", type=float, default=0.0)
+    parser.add_argument("--stall-time", type=float, default=5.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--output", default=RESULTS_PATH, help="path of the results' JSON file"
+    )
+    args = parser.parse_args()
+
+    game_ids = [
+        recording["params"]["GameID"]
+        for recording in load_recordings("boxscoretraditionalv2", args.replay_dir)
+    ][: args.games]
+    if not game_ids:
+        print(
+            "There are no recorded box scores. Record some with the replay server's "
+            + "record mode first."
+        )
+        return
+
+    server_options = {
+        "replay_dir": args.replay_dir,
+        "latency": args.latency,
+        "jitter": args.jitter,
+        "rate_limit": args.rate_limit,
+        "error_rate": args.error_rate,
+        "stall_rate": args.stall_rate,
+        "stall_time": args.stall_time,
+        "seed": args.seed,
+    }
+
+    runs = []
+    for path, workers, delay in itertools.product(args.paths, args.workers, args.delay):
+        run = run_fetch_benchmark(
+            path, game_ids, args.passes, server_options, workers=workers, delay=delay
+        )
+        runs.append(run)
+        print(
+            path
+            + " ("
+            + str(workers)
+            + " workers, "
+            + str(delay)
+            + " s delay): "
+            + str(run["fetched"])
+            + "/"
+            + str(run["games"])
+            + " box scores in "
+            + str(run["wall_s"])
+            + " s ("
+            + str(run["games_per_s"])
+            + " games/s, p95 "
+            + str(run["p95_s"])
+            + " s), "
+            + str(len(run["passes"]))
+            + " passes, "
+            + str(run["dead_lettered"])
+            + " still dead-lettered, "
+            + str(run["server"]["rate_limited"])
+            + " rate limited."
+        )
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w") as results_file:
+        json.dump(
+            {
+                "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+                "server": server_options,
+                "passes": args.passes,
+                "runs": runs,
+            },
+            results_file,
+            indent=2,
+        )
+
+
+if __name__ == "__main__":
+
+    main()
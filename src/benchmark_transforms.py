@@ -0,0 +1,587 @@
+"""
+benchmark_transforms.py
+    This script contains the benchmark of the data transforms of the ingest pipeline.
+    Synthetic LeagueGameFinder and box score data are generated at several multiples
+    of the team's game history and for several numbers of tracked players. Each
+    transform is timed on its own and its peak memory is traced. The results are
+    written to a JSON file and compared against a stored baseline, so regressions are
+    flagged. The wall times are normalized by the time of a calibration loop, so a
+    baseline recorded on another machine can be used, as long as it was recorded with
+    the same versions of Python, pandas and numpy.
+
+    Usage (from the folder src):
+        python benchmark_transforms.py
+        python benchmark_transforms.py --scales 1 10 --players 2 --repeat 5
+        python benchmark_transforms.py --save-baseline
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime, timezone
+import numpy as np
+import pandas as pd
+import fetch_data_cron
+from data import final_preparation, pull_games_starters, stats_to_int, teammates_stats
+from fetch_data_cron import PLAYERS, compile_column_plan, prepare_games
+
+# Directory of the benchmark results and the stored baseline
+BENCHMARK_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "benchmarks"
+)
+RESULTS_PATH = os.path.join(BENCHMARK_DIR, "results.json")
+BASELINE_PATH = os.path.join(BENCHMARK_DIR, "baseline.json")
+
+# Number of games in the team's current history (scale 1)
+BASE_GAMES = 372
+
+# A result is flagged as a regression when its wall time or peak memory exceed the
+# baseline's by more than these fractions. The wall time must also exceed it by more
+# than TIME_FLOOR seconds, since the fastest transforms take 1-2 ms and a fraction of
+# that is noise
+TIME_TOLERANCE = 0.25
+MEMORY_TOLERANCE = 0.10
+TIME_FLOOR = 0.005
+
+# Slow transforms are timed fewer times, until they've run for this many seconds
+MIN_TIME = 2.0
+
+# Nuggets' team id, an opponent's team id and the number of players in each roster
+TEAM_ID = 1610612743
+OPPONENT_ID = 1610612744
+ROSTER_SIZE = 13
+
+# Columns of the synthetic LeagueGameFinder games and box scores (the columns of the
+# actual result sets that the transforms read, and a few more)
+GAME_COLUMNS = [
+    "SEASON_ID",
+    "TEAM_ID",
+    "TEAM_ABBREVIATION",
+    "GAME_ID",
+    "GAME_DATE",
+    "MATCHUP",
+    "WL",
+    "MIN",
+    "PTS",
+    "REB",
+    "AST",
+    "PLUS_MINUS",
+    "PLAYOFFS",
+]
+BOX_SCORE_COLUMNS = [
+    "GAME_ID",
+    "TEAM_ID",
+    "PLAYER_ID",
+    "START_POSITION",
+    "MIN",
+    "PTS",
+    "REB",
+    "AST",
+    "PLUS_MINUS",
+]
+
+
+class SyntheticResultSet:
+    """
+    Result set of a synthetic box score, read from the rows of a single game of the
+    box scores of all games.
+    """
+
+    def __init__(self, rows: pd.DataFrame, start: int, stop: int):
+        self.rows = rows
+        self.start = start
+        self.stop = stop
+
+    def get_data_frame(self) -> pd.DataFrame:
+        """
+        Build the result set's DataFrame, as nba_api does from the response.
+
+        Returns:
+            pd.DataFrame with the result set.
+        """
+
+        return self.rows.iloc[self.start : self.stop].reset_index(drop=True)
+
+
+class SyntheticBoxScore:
+    """
+    Synthetic BoxScoreTraditionalV2 response of a game.
+    """
+
+    def __init__(self, rows: pd.DataFrame, start: int, stop: int):
+        self.player_stats = SyntheticResultSet(rows, start, stop)
+
+
+def tracked_players(n_players: int) -> list:
+    """
+    This function lists the ids of the tracked players: Jokic and Murray, followed by
+    other players with distinct last names (the players' stats columns are named after
+    them).
+
+    Args:
+        n_players: int with the number of players.
+
+    Returns:
+        list with the players' ids.
+    """
+
+    nba_players = pd.read_csv("../data/nba_players.csv")
+    nba_players["last_name"] = nba_players["last_name"].str.upper()
+    taken = nba_players.set_index("id").loc[PLAYERS, "last_name"].tolist()
+    others = nba_players[~nba_players["last_name"].isin(taken)].drop_duplicates(
+        "last_name"
+    )
+
+    return (PLAYERS + others["id"].tolist())[:n_players]
+
+
+def synthetic_games(
+    n_games: int, players: list, seed: int = 0
+) -> tuple[pd.DataFrame, dict]:
+    """
+    This function generates a team's synthetic games and box scores. Each tracked
+    player takes part in most games and some stats are missing, as in actual box
+    scores.
+
+    Args:
+        n_games: int with the number of games.
+        players: list with the ids of the tracked players.
+        seed: int with the seed of the random numbers.
+
+    Returns:
+        team_games: pd.DataFrame with the team's games in the format returned by
+            LeagueGameFinder (plus the column PLAYOFFS).
+        box_scores: dict with the games' box scores, keyed by game id.
+    """
+
+    rng = np.random.default_rng(seed)
+    roster_size = max(ROSTER_SIZE, len(players) + 3)
+    rows_per_game = 2 * roster_size
+
+    # Players' rows of all box scores: the team's roster, with the tracked players
+    # first (unless they didn't play the game), and the opponent's roster
+    player_ids = np.tile(np.arange(rows_per_game, dtype=np.int64) + 10**6, (n_games, 1))
+    played = rng.random((n_games, len(players))) < 0.9
+    player_ids[:, : len(players)] = np.where(
+        played, np.array(players), player_ids[:, : len(players)]
+    )
+    starter = rng.random((n_games, rows_per_game)) < 5 / roster_size
+    pts = rng.integers(0, 35, (n_games, rows_per_game)).astype(float)
+    reb = rng.integers(0, 15, (n_games, rows_per_game)).astype(float)
+    ast = rng.integers(0, 12, (n_games, rows_per_game)).astype(float)
+    # Players that didn't play have missing stats
+    dnp = rng.random((n_games, rows_per_game)) < 0.03
+    for stats in [pts, reb, ast]:
+        stats[dnp] = np.nan
+
+    game_ids = np.array(["002" + str(i).zfill(7) for i in range(n_games)])
+    team_ids = np.tile(
+        np.repeat([TEAM_ID, OPPONENT_ID], roster_size), (n_games, 1)
+    ).ravel()
+    rows = pd.DataFrame(
+        {
+            "GAME_ID": np.repeat(game_ids, rows_per_game),
+            "TEAM_ID": team_ids,
+            "PLAYER_ID": player_ids.ravel(),
+            "START_POSITION": np.where(starter.ravel(), "F", ""),
+            "MIN": np.where(dnp.ravel(), None, "24:00"),
+            "PTS": pts.ravel(),
+            "REB": reb.ravel(),
+            "AST": ast.ravel(),
+            "PLUS_MINUS": rng.integers(-20, 20, n_games * rows_per_game).astype(float),
+        },
+        columns=BOX_SCORE_COLUMNS,
+    )
+    box_scores = {
+        game_id: SyntheticBoxScore(rows, i * rows_per_game, (i + 1) * rows_per_game)
+        for i, game_id in enumerate(game_ids)
+    }
+
+    # The team's totals are the sums of its players' stats
+    team_pts = np.nansum(pts[:, :roster_size], axis=1)
+    opponent_pts = np.nansum(pts[:, roster_size:], axis=1)
+    dates = pd.Timestamp("1950-10-01") + pd.to_timedelta(np.arange(n_games), "D")
+    team_games = pd.DataFrame(
+        {
+            "SEASON_ID": ["2" + str(1950 + i // 82) for i in range(n_games)],
+            "TEAM_ID": TEAM_ID,
+            "TEAM_ABBREVIATION": "DEN",
+            "GAME_ID": game_ids,
+            "GAME_DATE": dates.strftime("%Y-%m-%d"),
+            "MATCHUP": "DEN vs. GSW",
+            "WL": np.where(team_pts > opponent_pts, "W", "L"),
+            "MIN": 240,
+            "PTS": team_pts.astype(int),
+            "REB": np.nansum(reb[:, :roster_size], axis=1).astype(int),
+            "AST": np.nansum(ast[:, :roster_size], axis=1).astype(int),
+            "PLUS_MINUS": team_pts - opponent_pts,
+            "PLAYOFFS": (np.arange(n_games) % 82 >= 78).astype(int),
+        },
+        columns=GAME_COLUMNS,
+    )
+
+    return team_games, box_scores
+
+
+@contextmanager
+def offline_pipeline():
+    """
+    Run the pipeline's transforms without side effects: the raw box scores aren't
+    written to the lake and the dead-letter queue isn't read nor updated.
+    """
+
+    write_box_score = fetch_data_cron.write_box_score
+    load_dead_letters = fetch_data_cron.load_dead_letters
+    fetch_data_cron.write_box_score = lambda box_score, game_id: None
+    fetch_data_cron.load_dead_letters = lambda: {}
+    try:
+        yield
+    finally:
+        fetch_data_cron.write_box_score = write_box_score
+        fetch_data_cron.load_dead_letters = load_dead_letters
+
+
+def calibrate(repeat: int = 5) -> float:
+    """
+    This function times a fixed workload of the kind of the transforms: a loop over
+    small slices of a DataFrame, like the extraction of the players' stats from each
+    box score, and a few vectorized operations on the whole DataFrame. The wall times
+    of the baseline are scaled by the ratio of the calibration times, so results
+    recorded on a faster or slower machine can be compared.
+
+    Args:
+        repeat: int with the number of timed runs.
+
+    Returns:
+        float with the fastest wall time (seconds) of the workload.
+    """
+
+    rng = np.random.default_rng(0)
+    frame = pd.DataFrame(
+        rng.integers(0, 100, size=(100_000, 4)), columns=["a", "b", "c", "d"]
+    )
+
+    walls = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for i in range(200):
+            rows = frame.iloc[i * 13 : (i + 1) * 13]
+            rows.loc[rows["a"] > 50, ["b", "c"]].sum()
+        frame.groupby("a")[["b", "c", "d"]].sum()
+        frame.merge(frame[["a"]].drop_duplicates(), on="a")
+        frame.astype(float).round().astype(int)
+        walls.append(time.perf_counter() - start)
+
+    return min(walls)
+
+
+def measure(function, make_args, repeat: int) -> tuple[dict, object]:
+    """
+    This function measures a transform. The wall time is the fastest of several runs
+    (slow transforms are run fewer times, until they've run for MIN_TIME seconds), and
+    the peak memory is traced in a separate run, since tracing slows the transform
+    down.
+
+    Args:
+        function: function with the transform.
+        make_args: function that builds a fresh copy of the transform's arguments (some
+            transforms modify their input).
+        repeat: int with the maximum number of timed runs.
+
+    Returns:
+        result: dict with the wall time (seconds) and the peak memory (MB) of the
+            transform.
+        output: output of the transform.
+    """
+
+    walls = []
+    while len(walls) < repeat and (not walls or sum(walls) < MIN_TIME):
+        kwargs = make_args()
+        start = time.perf_counter()
+        output = function(**kwargs)
+        walls.append(time.perf_counter() - start)
+
+    kwargs = make_args()
+    tracemalloc.start()
+    function(**kwargs)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    result = {"wall_s": round(min(walls), 6), "peak_mb": round(peak / 1024**2, 3)}
+    return result, output
+
+
+def run_benchmark(scales: list, players_counts: list, repeat: int) -> list:
+    """
+    This function runs the benchmark of every transform for every scale and number of
+    tracked players. The input of each transform is the output of the previous one in
+    the pipeline.
+
+    Args:
+        scales: list with the multiples of the team's game history.
+        players_counts: list with the numbers of tracked players.
+        repeat: int with the maximum number of timed runs of each transform.
+
+    Returns:
+        list with a dict per transform, scale and number of players.
+    """
+
+    results = []
+
+    def record(stage: str, config: dict, function, make_args) -> object:
+        # We measure a transform, keep its result and return its output
+        result, output = measure(function, make_args, repeat)
+        results.append(dict(stage=stage, **config, **result))
+        print(
+            stage
+            + " (x"
+            + str(config["scale"])
+            + ", "
+            + str(config["players"])
+            + " players): "
+            + str(result["wall_s"])
+            + " s, "
+            + str(result["peak_mb"])
+            + " MB"
+        )
+        return output
+
+    for n_players in players_counts:
+        players = tracked_players(n_players)
+        plan = compile_column_plan(tuple(players))
+        for scale in scales:
+            n_games = int(BASE_GAMES * scale)
+            config = {"scale": scale, "players": n_players, "games": n_games}
+            team_games, box_scores = synthetic_games(n_games, players)
+
+            with offline_pipeline():
+                games_stats = record(
+                    "append_players_stats",
+                    config,
+                    fetch_data_cron.append_players_stats,
+                    lambda: {
+                        "players_list": players,
+                        "team_games": team_games.copy(),
+                        "box_scores": box_scores,
+                    },
+                )
+            with_teammates = record(
+                "teammates_stats",
+                config,
+                teammates_stats,
+                lambda: {"team_games": games_stats.copy()},
+            )
+            as_int = record(
+                "stats_to_int",
+                config,
+                stats_to_int,
+                lambda: {"team_games": with_teammates.copy()},
+            )
+            prepared = record(
+                "final_preparation",
+                config,
+                final_preparation,
+                lambda: {"team_games": as_int.copy()},
+            )
+            record(
+                "prepare_games",
+                config,
+                prepare_games,
+                lambda: {"team_games": games_stats.copy(), "plan": plan},
+            )
+            record(
+                "pull_games_starters",
+                config,
+                pull_games_starters,
+                lambda: {
+                    "team_games": prepared.copy(),
+                    "date_range": (
+                        prepared["game_date"].min(),
+                        prepared["game_date"].max(),
+                    ),
+                },
+            )
+
+    return results
+
+
+def compare_to_baseline(
+    results: list,
+    baseline: list,
+    time_scale: float = 1.0,
+    time_tolerance: float = TIME_TOLERANCE,
+    memory_tolerance: float = MEMORY_TOLERANCE,
+    time_floor: float = TIME_FLOOR,
+) -> list:
+    """
+    This function compares the results against the baseline.
+
+    Args:
+        results: list with the results (see run_benchmark()).
+        baseline: list with the results of the baseline.
+        time_scale: float with the ratio of the calibration times of the results and
+            the baseline (see calibrate()), which scales the baseline's wall times.
+        time_tolerance: float with the tolerated increase of the wall time.
+        memory_tolerance: float with the tolerated increase of the peak memory.
+        time_floor: float with the tolerated increase of the wall time (seconds)
+            regardless of the fraction.
+
+    Returns:
+        list with the regressions: the results whose wall time or peak memory exceed
+            the baseline's beyond the tolerance, with the ratios to the baseline.
+    """
+
+    baseline = {
+        (result["stage"], result["scale"], result["players"]): result
+        for result in baseline
+    }
+    regressions = []
+    for result in results:
+        reference = baseline.get((result["stage"], result["scale"], result["players"]))
+        if reference is None:
+            continue
+        expected_wall = reference["wall_s"] * time_scale
+        time_ratio = result["wall_s"] / max(expected_wall, 1e-9)
+        memory_ratio = result["peak_mb"] / max(reference["peak_mb"], 1e-9)
+        slower = (
+            time_ratio > 1 + time_tolerance
+            and result["wall_s"] - expected_wall > time_floor
+        )
+        if slower or memory_ratio > 1 + memory_tolerance:
+            regressions.append(
+                dict(
+                    result,
+                    time_ratio=round(time_ratio, 3),
+                    memory_ratio=round(memory_ratio, 3),
+                )
+            )
+
+    return regressions
+
+
+def main() -> None:
+    """
+    This function parses the command-line arguments, runs the benchmark, writes the
+    results and compares them against the baseline, if it was recorded with the same
+    versions of Python, pandas and numpy. It exits with an error status if any
+    regression is found.
+    """
+
+    parser = argparse.ArgumentParser(
+        description="Benchmark the data transforms with synthetic data."
+    )
+    parser.add_argument(
+        "--scales",
+        type=float,
+        nargs="+",
+        default=[1, 10, 100],
+        help="multiples of the team's game history (default: 1 10 100)",
+    )
+    parser.add_argument(
+        "--players",
+        type=int,
+        nargs="+",
+        default=[2, 10],
+        help="numbers of tracked players (default: 2 10)",
+    )
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=5,
+        help="maximum number of timed runs of each transform",
+    )
+    parser.add_argument(
+        "--output", default=RESULTS_PATH, help="path of the results' JSON file"
+    )
+    parser.add_argument(
+        "--baseline", default=BASELINE_PATH, help="path of the baseline's JSON file"
+    )
+    parser.add_argument(
+        "--save-baseline",
+        action="store_true",
+        help="store the results as the new baseline",
+    )
+    args = parser.parse_args()
+
+    report = {
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "machine": {
+            "platform": platform.platform(),
+            "processor": platform.machine(),
+            "python": platform.python_version(),
+            "pandas": pd.__version__,
+            "numpy": np.__version__,
+        },
+        "calibration_s": round(calibrate(), 6),
+        "results": run_benchmark(
+            scales=[int(s) if float(s).is_integer() else s for s in args.scales],
+            players_counts=args.players,
+            repeat=args.repeat,
+        ),
+    }
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w") as results_file:
+        json.dump(report, results_file, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, "w") as baseline_file:
+            json.dump(report, baseline_file, indent=2)
+        print("Baseline stored in " + args.baseline + ".")
+        return
+
+    try:
+        with open(args.baseline, "r") as baseline_file:
+            baseline = json.load(baseline_file)
+    except FileNotFoundError:
+        print("There is no baseline to compare against.")
+        return
+    # The calibration makes up for the speed of the machine, but other versions of
+    # Python, pandas or numpy change the transforms' times and memory by themselves
+    versions = ["python", "pandas", "numpy"]
+    baseline_versions = [baseline["machine"][key] for key in versions]
+    if baseline_versions != [report["machine"][key] for key in versions]:
+        print(
+            "Warning: the baseline was recorded with other versions of Python, pandas "
+            + "and numpy ("
+            + ", ".join(baseline_versions)
+            + "), so the results aren't compared against it. Store a baseline with "
+            + "--save-baseline first."
+        )
+        return
+
+    time_scale = report["calibration_s"] / baseline["calibration_s"]
+    print(
+        "This machine runs the calibration loop x"
+        + str(round(time_scale, 2))
+        + " the time of the baseline's."
+    )
+    regressions = compare_to_baseline(
+        report["results"], baseline["results"], time_scale=time_scale
+    )
+    for regression in regressions:
+        print(
+            "Regression in "
+            + regression["stage"]
+            + " (x"
+            + str(regression["scale"])
+            + ", "
+            + str(regression["players"])
+            + " players): wall time x"
+            + str(regression["time_ratio"])
+            + ", peak memory x"
+            + str(regression["memory_ratio"])
+            + " the baseline's."
+        )
+    if regressions:
+        sys.exit(1)
+    print("No regressions against the baseline.")
+
+
+if __name__ == "__main__":
+
+    main()
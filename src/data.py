@@ -8,13 +8,16 @@ import time
 import hsfs
 import numpy as np
 import pandas as pd
+from hsfs.feature_group import FeatureGroup
 from streamlit.delta_generator import DeltaGenerator
-from nba_api.stats.endpoints import boxscoretraditionalv2, leaguegamefinder
+from nba_api.stats.endpoints import boxscoretraditionalv2
 from feature_store import (
     feature_group_connection_r1,
     get_feature_store_data_r1,
     get_feature_store_data_r2,
 )
+from game_discovery import discover_games, ingested_games
+from single_flight import file_lock, pull_key, single_flight
 
 # from feature_store import (
 #     feature_view_connection,
@@ -43,8 +46,8 @@ def pull_team_games(team_id: int, season_init: int, season_end: int) -> pd.DataF
         pd.DataFrame that contains the games info from the given team and seasons.
     """
 
-    # We create a list to store DataFrames, each containing a team's either regular
-    # season or playoff games info from individual seasons
+    # We create a list to store DataFrames, each containing a team's regular season
+    # and playoff games info from individual seasons
     seasons_list = []
 
     # We loop through each season
@@ -53,31 +56,10 @@ def pull_team_games(team_id: int, season_init: int, season_end: int) -> pd.DataF
         # 'yyyy-yy'. For example, the 2022-2023 season id is '2022-23'
         season = str(i) + "-" + str(i + 1)[-2:]
 
-        # We pull regular season games by calling the nba_api
-        games = leaguegamefinder.LeagueGameFinder(
-            team_id_nullable=team_id,
-            season_nullable=season,
-            season_type_nullable="Regular Season",
-        ).get_data_frames()[0]
-        # We add a column to identify regular season games
-        games["PLAYOFFS"] = 0
-        seasons_list.append(games)
-
-        # We pull playoff games by calling the nba_api
-        games = leaguegamefinder.LeagueGameFinder(
-            team_id_nullable=team_id,
-            season_nullable=season,
-            season_type_nullable="Playoffs",
-        ).get_data_frames()[0]
-        # We add a column to identify playoff games
-        games["PLAYOFFS"] = 1
-
-        # We update the list
-        seasons_list.append(games)
-
-    # We prepare the DataFrames to concatenate them
-    for games in seasons_list:
-        games.reset_index(drop=True, inplace=True)
+        # We pull all the season's games with a single call to the nba_api and keep
+        # regular season and playoff games, identified by their game id
+        games = discover_games(team_id=team_id, season=season)
+        seasons_list.append(ingested_games(games))
 
     # We concatenate the DataFrames vertically and then sort the resulting DataFrame by
     # the games dates
@@ -353,6 +335,53 @@ def final_preparation(team_games: pd.DataFrame) -> pd.DataFrame:
     return team_games
 
 
+def pull_seasons_to_feature_store(
+    feature_group: FeatureGroup,
+    team_id: int,
+    season_init: int,
+    season_end: int,
+    status_message: DeltaGenerator,
+) -> pd.DataFrame:
+    """
+    This function pulls all regular season and playoff games info from a given team and
+    seasons together with its main player stats, and pushes it into the feature store.
+
+    Args:
+        feature_group: FeatureGroup where the games info is pushed.
+        team_id: int that contains the team id.
+        season_init: int that contains the starting season from which the games info
+            will be pulled.
+        season_end: int that contains the ending season from which the games info will
+            be pulled.
+        status_message: DeltaGenerator where the status of the process is shown.
+
+    Returns:
+        pd.DataFrame that contains the games info pushed into the feature store.
+    """
+
+    games = pull_team_games(
+        team_id=team_id, season_init=season_init, season_end=season_end
+    )
+    # Prepare games data
+    games = append_players_stats(players_list=[203999, 1627750], team_games=games)
+    games = teammates_stats(team_games=games)
+    games = stats_to_int(team_games=games)
+    games = final_preparation(team_games=games)
+
+    message = "Data pulling and preparation finished!" + "\n"
+    message += "Updating the feature store with new data..."
+    status_message.text(message)
+    time.sleep(2)
+
+    # Update feature store. Inserts from concurrent runs go one at a time
+    with file_lock("feature_group_insert"):
+        feature_group.insert(games, write_options={"start_offline_backfill": False})
+    status_message.text("Feature store updated!")
+    time.sleep(2)
+
+    return games
+
+
 def pull_data(
     team_id: int, season_init: int, season_end: int, status_message
 ) -> tuple[pd.DataFrame, int, int]:
@@ -467,24 +496,31 @@ def pull_data(
         #     (games["SEASON_ID"].str[1:] >= season_init_range)
         #     & (games["SEASON_ID"].str[1:] <= season_end_range)
         # ].copy()
-        games = pull_team_games(
-            team_id=team_id, season_init=season_init_range, season_end=season_end_range
+        # Concurrent sessions (or the cron job, when pulling the current season) pulling
+        # the seasons up to the same one wait for the one in flight and share its result
+        games, shared = single_flight(
+            pull_key(team_id=team_id, season_end=season_end_range),
+            pull_seasons_to_feature_store,
+            feature_group=feature_group,
+            team_id=team_id,
+            season_init=season_init_range,
+            season_end=season_end_range,
+            status_message=status_message,
         )
-        # Prepare games data
-        games = append_players_stats(players_list=[203999, 1627750], team_games=games)
-        games = teammates_stats(team_games=games)
-        games = stats_to_int(team_games=games)
-        games = final_preparation(team_games=games)
-
-        message = "Data pulling and preparation finished!" + "\n"
-        message += "Updating the feature store with new data..."
-        status_message.text(message)
-        time.sleep(2)
-
-        # Update feature store
-        feature_group.insert(games, write_options={"start_offline_backfill": False})
-        status_message.text("Feature store updated!")
-        time.sleep(2)
+        if shared:
+            # The run we waited for may have pulled other seasons (e.g., the cron job
+            # pulls the games after the most recent one in the feature store) or no
+            # games at all
+            if len(games) > 0:
+                seasons_pulled = games["season_id"].str[1:].astype(int)
+                games = games[
+                    (seasons_pulled >= season_init_range)
+                    & (seasons_pulled <= season_end_range)
+                ].copy()
+            else:
+                games = pd.DataFrame()
+            status_message.text("Data pulled and pushed by another session!")
+            time.sleep(2)
 
         rows_nba = games.shape[0]
 
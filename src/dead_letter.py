@@ -0,0 +1,137 @@
+"""
+dead_letter.py
+    This script contains the dead-letter queue of the games whose box score couldn't be
+    pulled. Instead of aborting the whole batch, a failed game is recorded in a JSON
+    file together with its games data, the error and the number of attempts, and the
+    rest of the games are pushed into the feature store. Later runs retry the queued
+    games with exponential backoff.
+"""
+
+import os
+import json
+import time
+import pandas as pd
+from single_flight import file_lock
+
+# File of the queue
+DEAD_LETTER_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "data", "dead_letter.json"
+)
+
+# Backoff of the retries: the delay doubles with every failed attempt, up to a week.
+# Games that fail too many times are kept in the queue, but aren't retried anymore
+BASE_DELAY = 3600
+MAX_DELAY = 7 * 86400
+MAX_ATTEMPTS = 10
+
+# Columns of the team's games data kept in the queue, so a game can be retried without
+# discovering it again
+GAME_COLUMNS = [
+    "SEASON_ID",
+    "GAME_ID",
+    "GAME_DATE",
+    "WL",
+    "PTS",
+    "REB",
+    "AST",
+    "PLAYOFFS",
+]
+
+
+def load_dead_letters(path: str = DEAD_LETTER_PATH) -> dict:
+    """
+    This function loads the queue.
+
+    Args:
+        path: str with the path of the queue's file.
+
+    Returns:
+        dict with the queued games, keyed by game id. Each entry contains the games
+            data of the game ('game'), the last error ('error'), the number of failed
+            attempts ('attempts') and the times (seconds since the epoch) of the first
+            and last failures and of the next retry ('first_failed', 'last_failed' and
+            'next_attempt').
+    """
+
+    try:
+        with open(path, "r") as queue_file:
+            return json.load(queue_file)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def update_dead_letters(
+    failed: pd.DataFrame,
+    errors: dict,
+    succeeded: list,
+    path: str = DEAD_LETTER_PATH,
+) -> dict:
+    """
+    This function records the games that failed in the queue and removes the ones that
+    succeeded. The queue is updated under a lock, since the cron job and the ingestion
+    daemon may update it at the same time.
+
+    Args:
+        failed: pd.DataFrame that contains the team's games data of the failed games.
+        errors: dict with the error of each failed game, keyed by game id.
+        succeeded: list with the ids of the games that succeeded.
+        path: str with the path of the queue's file.
+
+    Returns:
+        dict with the updated queue (see load_dead_letters()).
+    """
+
+    now = time.time()
+    games = json.loads(
+        failed[[col for col in GAME_COLUMNS if col in failed.columns]].to_json(
+            orient="records"
+        )
+    )
+
+    with file_lock("dead_letter"):
+        queue = load_dead_letters(path)
+        for game_id in succeeded:
+            queue.pop(game_id, None)
+        for game in games:
+            entry = queue.get(game["GAME_ID"], {"attempts": 0, "first_failed": now})
+            entry["game"] = game
+            entry["error"] = errors[game["GAME_ID"]]
+            entry["attempts"] += 1
+            entry["last_failed"] = now
+            entry["next_attempt"] = now + min(
+                BASE_DELAY * 2 ** (entry["attempts"] - 1), MAX_DELAY
+            )
+            queue[game["GAME_ID"]] = entry
+
+        # The queue is written to a temporary file first, so it's never left partially
+        # written
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = path + "." + str(os.getpid()) + ".tmp"
+        with open(temp_path, "w") as queue_file:
+            json.dump(queue, queue_file, indent=2)
+        os.replace(temp_path, path)
+
+    return queue
+
+
+def due_games(now: float | None = None, path: str = DEAD_LETTER_PATH) -> pd.DataFrame:
+    """
+    This function returns the queued games due for a retry.
+
+    Args:
+        now: float with the current time (seconds since the epoch).
+        path: str with the path of the queue's file.
+
+    Returns:
+        pd.DataFrame that contains the team's games data of the games due for a retry,
+            in the format of the data discovered by the cron job.
+    """
+
+    now = time.time() if now is None else now
+    games = [
+        entry["game"]
+        for entry in load_dead_letters(path).values()
+        if entry["next_attempt"] <= now and entry["attempts"] < MAX_ATTEMPTS
+    ]
+
+    return pd.DataFrame(games, columns=GAME_COLUMNS)
@@ -0,0 +1,518 @@
+"""
+duo_leaderboard.py
+    This script contains the batch job that builds the league-wide leaderboard of duos:
+    for every team and season, the pairs of starters whose stats matter the most in the
+    standardized win model (see pair_analysis.py). The teams' seasons are fitted across
+    a process pool, each from its per-player game table, which is cached and extended
+    with the new games only. The teams' seasons whose games didn't change since the
+    last run keep their rows, so new games don't require recomputing the whole league.
+    The leaderboard is stored as a compact Parquet file, which is the source of the next
+    runs, and pushed into the feature store, where the app reads it to filter and sort.
+
+    Usage (from the folder src):
+        python duo_leaderboard.py --seasons 2015 2024 --push
+        python duo_leaderboard.py --seasons 2024 2024 --fetch --push
+"""
+
+import os
+import json
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+import requests
+from nba_api.stats.endpoints import boxscoretraditionalv2
+from feature_store import feature_group_connection_r3, get_feature_group_data
+from game_discovery import discover_games, ingested_games
+from instrumentation import PipelineRun
+from pair_analysis import player_game_table, rank_pairs
+from raw_lake import partition_path, scan, write_box_score, write_league_game_finder
+from recompute_features import season_ids
+from utils import configure_nba_api, data_fingerprint, season_id_from_game_id
+
+# Directory of the job's files: the cached per-player game tables (one per team and
+# season), the leaderboard and the manifest with the fingerprint of the games and the
+# options each team's season was fitted with
+DUOS_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "data", "duos"
+)
+TABLES_DIR = os.path.join(DUOS_DIR, "tables")
+LEADERBOARD_PATH = os.path.join(DUOS_DIR, "leaderboard.parquet")
+MANIFEST_PATH = os.path.join(DUOS_DIR, "manifest.json")
+
+# Feature group where the leaderboard is pushed, so the app can read it
+LEADERBOARD_FEATURE_GROUP = "duo_leaderboard"
+
+# Options of the fits: the number of duos kept per team and season, the fewest games
+# where both players were starters (a season has 82 games, so fewer than the 90 of the
+# whole-history ranking), and the inverse of the L2 regularization strength, which
+# keeps the fits of a single season stable
+DEFAULT_OPTIONS = {"top": 3, "min_games": 30, "c_value": 1.0}
+
+# Wait (seconds) between calls to the nba_api when fetching a season's box scores
+FETCH_DELAY = 2
+
+# Compact types of the leaderboard's columns
+COLUMN_TYPES = {
+    "season": "int16",
+    "team_id": "int32",
+    "team": "category",
+    "rank": "int8",
+    "player_1_id": "int32",
+    "player_1": "category",
+    "player_2_id": "int32",
+    "player_2": "category",
+    "games": "int16",
+    "win_pct": "float32",
+    "importance": "float32",
+    "player_1_importance": "float32",
+    "player_2_importance": "float32",
+    "player_1_top_stat": "category",
+    "player_1_top_coef": "float32",
+    "player_1_top_p": "float32",
+    "player_2_top_stat": "category",
+    "player_2_top_coef": "float32",
+    "player_2_top_p": "float32",
+    "converged": "bool",
+}
+
+
+def fetch_league_season(season: int, delay: float = FETCH_DELAY) -> int:
+    """
+    This function stores in the lake the box scores of all the league's regular season
+    and playoff games of a season that aren't stored yet. The games are discovered with
+    a single call to the endpoint LeagueGameFinder. Failed box scores are skipped and
+    fetched by a later run.
+
+    Args:
+        season: int with the first year of the season (e.g., 2023 for the 2023-24
+            season).
+        delay: float with the wait (seconds) after each call to the nba_api.
+
+    Returns:
+        int with the number of box scores stored.
+    """
+
+    games = discover_games(team_id="", season=str(season) + "-" + str(season + 1)[2:])
+    write_league_game_finder(games=games.drop(columns=["SEASON_TYPE"]))
+    time.sleep(delay)
+
+    stored = 0
+    for game_id in ingested_games(games)["GAME_ID"].unique():
+        path = partition_path(
+            "box_score_teams", season_id_from_game_id(game_id), game_id
+        )
+        if os.path.exists(path):
+            continue
+        try:
+            box_score = boxscoretraditionalv2.BoxScoreTraditionalV2(game_id=game_id)
+            write_box_score(box_score=box_score, game_id=game_id)
+            stored += 1
+        except (requests.RequestException, ValueError, KeyError) as error:
+            print(
+                "The box score of game "
+                + game_id
+                + " failed and will be fetched by a later run: "
+                + type(error).__name__
+            )
+        # We add a sleep to avoid being blocked by the nba_api
+        time.sleep(delay)
+
+    return stored
+
+
+def team_seasons(first_season: int, last_season: int) -> dict:
+    """
+    This function lists the teams' seasons stored in the lake, with the ids of their
+    games and a fingerprint of them, which changes as soon as a game is added.
+
+    Args:
+        first_season: int with the first year of the first season.
+        last_season: int with the first year of the last season.
+
+    Returns:
+        dict keyed by 'team_id-season', with the team's id ('team_id'), the season
+            ('season'), the games' ids ('game_ids') and their fingerprint
+            ('fingerprint').
+    """
+
+    teams = scan(
+        "box_score_teams",
+        season_ids=season_ids(first_season, last_season),
+        columns=["season_id", "game_id", "TEAM_ID"],
+    )
+    teams["season"] = teams["season_id"].str[1:].astype(int)
+
+    units = {}
+    for (team_id, season), games in teams.groupby(["TEAM_ID", "season"]):
+        game_ids = sorted(games["game_id"].unique())
+        units[str(team_id) + "-" + str(season)] = {
+            "team_id": int(team_id),
+            "season": int(season),
+            "game_ids": game_ids,
+            "fingerprint": data_fingerprint(pd.DataFrame({"game_id": game_ids})),
+        }
+
+    return units
+
+
+def table_path(team_id: int, season: int, tables_dir: str = TABLES_DIR) -> str:
+    """
+    This function builds the path of the cached per-player game table of a team's
+    season.
+
+    Args:
+        team_id: int with the team's id.
+        season: int with the first year of the season.
+        tables_dir: str with the directory of the cached tables.
+
+    Returns:
+        str with the path of the table.
+    """
+
+    return os.path.join(
+        tables_dir, "season=" + str(season), "team_id=" + str(team_id) + ".parquet"
+    )
+
+
+def team_season_duos(
+    team_id: int,
+    season: int,
+    game_ids: list,
+    options: dict,
+    tables_dir: str = TABLES_DIR,
+) -> pd.DataFrame:
+    """
+    This function ranks the duos of a team's season. The cached per-player game table
+    is extended with the games that aren't in it yet, read from the lake, and all the
+    team's pairs of starters are fitted as a batch (see pair_analysis.rank_pairs()).
+    It runs in a worker of the process pool.
+
+    Args:
+        team_id: int with the team's id.
+        season: int with the first year of the season.
+        game_ids: list with the ids of the team's games in the lake.
+        options: dict with the options of the fits (see DEFAULT_OPTIONS).
+        tables_dir: str with the directory of the cached tables.
+
+    Returns:
+        pd.DataFrame with the team's top duos of the season.
+    """
+
+    path = table_path(team_id, season, tables_dir)
+    table = pd.read_parquet(path) if os.path.exists(path) else None
+
+    # A cached table with games that aren't in the lake anymore is rebuilt
+    if table is not None and not set(table["game_id"]) <= set(game_ids):
+        table = None
+    new_ids = sorted(set(game_ids) - set(table["game_id"] if table is not None else []))
+
+    if new_ids:
+        new_games = player_game_table(
+            first_season=season,
+            last_season=season,
+            team_id=team_id,
+            game_ids=new_ids,
+        )
+        table = pd.concat([table, new_games], ignore_index=True)
+        table = table.sort_values(["game_date", "game_id"], ignore_index=True)
+
+        # The table is written to a temporary file first, so it's never left
+        # partially written
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = path + "." + str(os.getpid()) + ".tmp"
+        table.to_parquet(temp_path, index=False)
+        os.replace(temp_path, path)
+
+    duos = rank_pairs(
+        table=table, min_games=options["min_games"], c_value=options["c_value"]
+    ).head(options["top"])
+
+    return duos.assign(season=season, team_id=team_id, rank=range(1, len(duos) + 1))
+
+
+def load_leaderboard(path: str = LEADERBOARD_PATH) -> pd.DataFrame:
+    """
+    This function loads the leaderboard.
+
+    Args:
+        path: str with the path of the leaderboard.
+
+    Returns:
+        pd.DataFrame with the leaderboard, or an empty DataFrame if it isn't stored.
+    """
+
+    if not os.path.exists(path):
+        return pd.DataFrame(columns=list(COLUMN_TYPES))
+
+    return pd.read_parquet(path)
+
+
+def push_leaderboard(leaderboard: pd.DataFrame) -> None:
+    """
+    This function pushes the whole leaderboard into the feature store, together with
+    the time of the push. The rows dropped since the last push (e.g., if fewer duos are
+    kept per team and season) stay in the feature group, so they're told apart by
+    their older time (see pull_leaderboard()).
+
+    Args:
+        leaderboard: pd.DataFrame with the leaderboard.
+    """
+
+    # We push plain types, which the feature store supports
+    plain_types = {
+        "category": "str",
+        "int8": "int64",
+        "int16": "int64",
+        "int32": "int64",
+        "float32": "float64",
+        "bool": "bool",
+    }
+    rows = leaderboard.astype(
+        {col: plain_types[col_type] for col, col_type in COLUMN_TYPES.items()}
+    )
+    rows["pushed"] = int(time.time())
+
+    hsfs_connection, feature_group = feature_group_connection_r3(
+        name=LEADERBOARD_FEATURE_GROUP,
+        description="League-wide leaderboard of duos",
+        primary_key=["season", "team_id", "rank"],
+    )
+    feature_group.insert(rows, write_options={"start_offline_backfill": False})
+    hsfs_connection.close()
+
+
+def pull_leaderboard() -> pd.DataFrame:
+    """
+    This function pulls the leaderboard from the feature store (see
+    push_leaderboard()).
+
+    Returns:
+        pd.DataFrame with the leaderboard, or an empty DataFrame if it wasn't pushed
+            yet.
+    """
+
+    rows = get_feature_group_data(name=LEADERBOARD_FEATURE_GROUP)
+    if rows.empty:
+        return pd.DataFrame(columns=list(COLUMN_TYPES))
+
+    # We keep the rows of the last push
+    rows = rows[rows["pushed"] == rows["pushed"].max()]
+
+    return (
+        rows[list(COLUMN_TYPES)]
+        .astype(COLUMN_TYPES)
+        .sort_values(["season", "importance"], ascending=False)
+        .reset_index(drop=True)
+    )
+
+
+def update_leaderboard(
+    first_season: int,
+    last_season: int,
+    options: dict = DEFAULT_OPTIONS,
+    workers: int | None = None,
+    force: bool = False,
+    run: PipelineRun | None = None,
+) -> pd.DataFrame:
+    """
+    This function updates the leaderboard for a range of seasons. Only the teams'
+    seasons of the range whose games or options of the fits changed since they were
+    fitted are fitted again, across a process pool. The rows of the rest of the teams'
+    seasons of the range are kept, as are the rows of the seasons out of the range,
+    which keep the options they were fitted with (the manifest records the options of
+    each team's season).
+
+    Args:
+        first_season: int with the first year of the first season.
+        last_season: int with the first year of the last season.
+        options: dict with the options of the fits (see DEFAULT_OPTIONS).
+        workers: int with the number of processes. By default, the number of CPUs.
+        force: bool that indicates whether to fit all the teams' seasons again.
+        run: PipelineRun the stages are recorded in, if any.
+
+    Returns:
+        pd.DataFrame with the updated leaderboard.
+    """
+
+    run = run or PipelineRun(name="duo_leaderboard")
+
+    with run.span("fingerprint_games") as span:
+        units = team_seasons(first_season, last_season)
+        try:
+            with open(MANIFEST_PATH, "r") as manifest_file:
+                manifest = json.load(manifest_file)
+        except (FileNotFoundError, ValueError):
+            manifest = {"units": {}}
+        fits = {
+            key: {"fingerprint": unit["fingerprint"], "options": options}
+            for key, unit in units.items()
+        }
+        # The rows of a team's season can be reused if it was fitted to the same games
+        # with the same options
+        up_to_date = [
+            key
+            for key in units
+            if not force and manifest["units"].get(key) == fits[key]
+        ]
+
+        # Teams' seasons with fewer games than the fewest required for a duo (e.g.,
+        # the opponents of the team ingested by the cron job) have no duos
+        stale = {
+            key: unit
+            for key, unit in units.items()
+            if len(unit["game_ids"]) >= options["min_games"] and key not in up_to_date
+        }
+        span["rows_in"] = len(units)
+        span["rows_out"] = len(stale)
+
+    with run.span("fit_team_seasons", rows_in=len(stale)) as span:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {
+                key: executor.submit(
+                    team_season_duos,
+                    unit["team_id"],
+                    unit["season"],
+                    unit["game_ids"],
+                    options,
+                )
+                for key, unit in stale.items()
+            }
+            fitted = [future.result() for future in futures.values()]
+        span["rows_out"] = sum(len(duos) for duos in fitted)
+
+    with run.span("write_leaderboard") as span:
+        # We keep the rows of the seasons out of the range and of the teams' seasons
+        # fitted to the same games with the same options. The rest of the rows of the
+        # range are replaced (or dropped, e.g., if the fewest games required went up)
+        leaderboard = load_leaderboard()
+        keys = (
+            leaderboard["team_id"].astype(str) + "-" + leaderboard["season"].astype(str)
+        )
+        in_range = leaderboard["season"].between(first_season, last_season)
+        kept = leaderboard[~in_range | keys.isin(up_to_date)]
+
+        # We load the nba_teams info
+        teams_path = "../data/nba_teams.csv"
+        nba_teams = pd.read_csv(teams_path).set_index("id")["full_name"]
+        new_rows = [duos for duos in fitted if not duos.empty]
+        if new_rows:
+            new_rows = pd.concat(new_rows, ignore_index=True)
+            new_rows["team"] = new_rows["team_id"].map(nba_teams)
+            kept = pd.concat(
+                [kept.astype(object), new_rows[list(COLUMN_TYPES)]], ignore_index=True
+            )
+        leaderboard = (
+            kept.astype(COLUMN_TYPES)
+            .sort_values(["season", "importance"], ascending=False)
+            .reset_index(drop=True)
+        )
+
+        # The files are written to temporary files first, so they're never left
+        # partially written
+        os.makedirs(DUOS_DIR, exist_ok=True)
+        temp_path = LEADERBOARD_PATH + "." + str(os.getpid()) + ".tmp"
+        leaderboard.to_parquet(temp_path, index=False, compression="zstd")
+        os.replace(temp_path, LEADERBOARD_PATH)
+
+        manifest["units"].update(fits)
+        temp_path = MANIFEST_PATH + "." + str(os.getpid()) + ".tmp"
+        with open(temp_path, "w") as manifest_file:
+            json.dump(manifest, manifest_file, indent=2)
+        os.replace(temp_path, MANIFEST_PATH)
+        span["rows_out"] = len(leaderboard)
+
+    return leaderboard
+
+
+def main() -> None:
+    """
+    This function parses the command-line arguments, fetches the missing box scores
+    (if requested) and updates the leaderboard.
+    """
+
+    parser = argparse.ArgumentParser(
+        description="Build the league-wide leaderboard of duos."
+    )
+    parser.add_argument(
+        "--seasons",
+        type=int,
+        nargs=2,
+        required=True,
+        metavar=("FIRST", "LAST"),
+        help="first year of the first and last seasons (e.g., 2015 2024)",
+    )
+    parser.add_argument(
+        "--fetch",
+        action="store_true",
+        help="store the league's missing box scores of the seasons in the lake first",
+    )
+    parser.add_argument(
+        "--workers", type=int, default=None, help="number of processes of the pool"
+    )
+    parser.add_argument(
+        "--top",
+        type=int,
+        default=DEFAULT_OPTIONS["top"],
+        help="duos kept per team and season",
+    )
+    parser.add_argument(
+        "--min-games",
+        type=int,
+        default=DEFAULT_OPTIONS["min_games"],
+        help="fewest games where both players were starters",
+    )
+    parser.add_argument(
+        "--c-value",
+        type=float,
+        default=DEFAULT_OPTIONS["c_value"],
+        help="inverse of the L2 regularization strength",
+    )
+    parser.add_argument(
+        "--force", action="store_true", help="fit all the teams' seasons again"
+    )
+    parser.add_argument(
+        "--push",
+        action="store_true",
+        help="push the leaderboard into the feature store, where the app reads it",
+    )
+    args = parser.parse_args()
+
+    run = PipelineRun(name="duo_leaderboard")
+
+    if args.fetch:
+        configure_nba_api()
+        for season in range(args.seasons[0], args.seasons[1] + 1):
+            with run.span("fetch_league_season") as span:
+                span["rows_out"] = fetch_league_season(season)
+
+    leaderboard = update_leaderboard(
+        first_season=args.seasons[0],
+        last_season=args.seasons[1],
+        options={
+            "top": args.top,
+            "min_games": args.min_games,
+            "c_value": args.c_value,
+        },
+        workers=args.workers,
+        force=args.force,
+        run=run,
+    )
+    print(
+        "The leaderboard has "
+        + str(len(leaderboard))
+        + " duos from "
+        + str(leaderboard["season"].nunique())
+        + " seasons."
+    )
+
+    if args.push:
+        with run.span("push_leaderboard", rows_in=len(leaderboard)):
+            push_leaderboard(leaderboard)
+
+    run.summary()
+
+
+if __name__ == "__main__":
+
+    main()
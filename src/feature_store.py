@@ -3,6 +3,7 @@ feature_store.py
     This script contains all supporting functions to connect to Hopsworks.
 """
 
+import hsfs
 import hopsworks
 import pandas as pd
 from hsfs import connection
@@ -312,3 +313,61 @@ def get_feature_store_data_r2(feature_group: FeatureGroup) -> pd.DataFrame:
     dataframe.reset_index(drop=True, inplace=True)
 
     return dataframe
+
+
+def feature_group_connection_r3(
+    name: str, description: str, primary_key: list
+) -> tuple[Connection, FeatureGroup]:
+    """
+    Connects to the feature store and returns pointers to the Hopsworks connection and
+    a feature group written by a batch job (e.g., the leaderboard of duos), which is
+    created the first time data is inserted into it.
+
+    Args:
+        name: str with the name of the feature group.
+        description: str with the description of the feature group.
+        primary_key: list with the names of the columns of the primary key.
+
+    Returns:
+        hsfs_connection: Connection pointer to Hopsworks.
+        feature_group: FeatureGroup pointer to the feature group.
+    """
+
+    hsfs_connection, _ = hopsworks_connection()
+    fs = hsfs_connection.get_feature_store()
+    feature_group = fs.get_or_create_feature_group(
+        name=name,
+        version=1,
+        description=description,
+        primary_key=primary_key,
+        online_enabled=True,
+    )
+
+    return hsfs_connection, feature_group
+
+
+def get_feature_group_data(name: str) -> pd.DataFrame:
+    """
+    Pulls all data of a feature group written by a batch job (see
+    feature_group_connection_r3()) from the Hopsworks feature store.
+
+    Args:
+        name: str with the name of the feature group.
+
+    Returns:
+        dataframe: pd.DataFrame with data pulled from the feature store, which is empty
+            if the batch job hasn't inserted any data yet.
+    """
+
+    hsfs_connection, _ = hopsworks_connection()
+    try:
+        fs = hsfs_connection.get_feature_store()
+        feature_group = fs.get_feature_group(name=name, version=1)
+        dataframe = feature_group.read(online=True)
+    # The feature group doesn't exist yet
+    except hsfs.client.exceptions.RestAPIError:
+        dataframe = pd.DataFrame()
+    finally:
+        hsfs_connection.close()
+
+    return dataframe
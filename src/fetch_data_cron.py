@@ -2,17 +2,49 @@
 fetch_data_cron.py
     This script contains supporting functions to pull NBA data using a cron job. Testing
     done using the script fetch_data_github_action.py didn't work as expected since it
-    seems the NBA blocks connections triggered from GitHub actions. 
+    seems the NBA blocks connections triggered from GitHub actions.
 """
 
+import functools
 import numpy as np
 import pandas as pd
+import requests
 from hsfs.feature_group import FeatureGroup
-from nba_api.stats.endpoints import boxscoretraditionalv2, leaguegamefinder
-from feature_store import feature_group_connection_r1, get_date_most_recent_game_fs
-
-
-def append_players_stats(players_list: list, team_games: pd.DataFrame) -> pd.DataFrame:
+from nba_api.stats.endpoints import boxscoretraditionalv2
+from feature_store import (
+    feature_group_connection_r1,
+    get_date_most_recent_game_fs,
+    get_feature_store_data_r2,
+)
+from data import pull_games_starters
+from dead_letter import due_games, load_dead_letters, update_dead_letters
+from game_discovery import discover_games, ingested_games
+from artifact_store import collect_garbage
+from modeling import log_reg_results
+from model_state import (
+    init_model_state,
+    load_model_state,
+    push_model_state,
+    save_model_state,
+    state_model,
+    update_model_state,
+)
+from instrumentation import PipelineRun
+from raw_lake import write_box_score, write_league_game_finder
+from single_flight import file_lock, pull_key, single_flight
+from utils import configure_nba_api, current_season
+
+# Calls to the nba_api go to the base URL set in the environment, if any (e.g., the
+# replay server's)
+configure_nba_api()
+
+# Players whose stats are appended to the games data (Jokic and Murray)
+PLAYERS = [203999, 1627750]
+
+
+def append_players_stats(
+    players_list: list, team_games: pd.DataFrame, box_scores: dict | None = None
+) -> pd.DataFrame:
     """
     This function appends to a team's games info DataFrame from a single season the
     three main stats (points, rebounds and assists) from a given set of its players.
@@ -23,10 +55,13 @@ def append_players_stats(players_list: list, team_games: pd.DataFrame) -> pd.Dat
         players_list: list that contains the players' ids.
         team_games: pd.DataFrame that contains the team's games data from a single
             season.
+        box_scores: dict with the box scores already pulled, keyed by game id. The box
+            scores of the rest of the games are pulled from the nba_api.
 
     Returns:
         pd.DataFrame that contains the team's games data from a single season,
-        including the main stats from the given set of players.
+        including the main stats from the given set of players. Games whose box score
+        couldn't be pulled are left out and recorded in the dead-letter queue.
     """
 
     # We load the nba_players info
@@ -57,12 +92,31 @@ def append_players_stats(players_list: list, team_games: pd.DataFrame) -> pd.Dat
             )
         )
 
+    # Errors of the games whose box score couldn't be pulled, keyed by game id
+    errors = {}
+
     # We loop through each game in a season
     for game in team_games.itertuples():
-        # We get the box score for the game by calling the nba_api
+        # We get the box score for the game by calling the nba_api, unless it was
+        # already pulled. If the call fails, we skip the game and record it in the
+        # dead-letter queue, so it's retried in a later run
         game_id = getattr(game, "GAME_ID")
-        box_score = boxscoretraditionalv2.BoxScoreTraditionalV2(game_id=game_id)
-        players_stats = box_score.player_stats.get_data_frame()
+        try:
+            box_score = (box_scores or {}).get(game_id)
+            if box_score is None:
+                box_score = boxscoretraditionalv2.BoxScoreTraditionalV2(game_id=game_id)
+            players_stats = box_score.player_stats.get_data_frame()
+        except (requests.RequestException, ValueError, KeyError) as error:
+            errors[game_id] = type(error).__name__ + ": " + str(error)
+            print(
+                "The box score of game "
+                + game_id
+                + " failed and was added to the dead-letter queue: "
+                + errors[game_id]
+            )
+            continue
+        # We keep the raw box score, so new features don't require fetching it again
+        write_box_score(box_score=box_score, game_id=game_id)
 
         # We loop through each player
         for i, player in enumerate(players_list):
@@ -96,6 +150,17 @@ def append_players_stats(players_list: list, team_games: pd.DataFrame) -> pd.Dat
                 # We update his DataFrame
                 players_df_list[i].loc[len(players_df_list[i])] = [0, 0, 0, 0]
 
+    # We update the dead-letter queue and drop the failed games, so the games info
+    # DataFrame and the players' stats DataFrames have the same length
+    failed = team_games["GAME_ID"].isin(list(errors))
+    if failed.any() or len(load_dead_letters()) > 0:
+        update_dead_letters(
+            failed=team_games[failed],
+            errors=errors,
+            succeeded=team_games.loc[~failed, "GAME_ID"].tolist(),
+        )
+    team_games = team_games[~failed]
+
     # We insert the games info DataFrame at the beginning of the list containing the
     # players' stats DataFrames to ease the concatenation
     players_df_list.insert(0, team_games)
@@ -108,205 +173,314 @@ def append_players_stats(players_list: list, team_games: pd.DataFrame) -> pd.Dat
     return pd.concat(players_df_list, axis=1)
 
 
-def teammates_stats(team_games: pd.DataFrame) -> pd.DataFrame:
+@functools.lru_cache(maxsize=None)
+def compile_column_plan(players: tuple) -> dict:
     """
-    This function compute the main stats (PTS, REB and AST) from the rest of the
-    teammates, i.e., from the teammates whose stats weren't appended to the games data.
-    It takes advantage of the name codification of the players stats columns. For
-    example, for each player whose stats were appended to the games data, the points
-    column's name is 'NAME_PTS'. Thus, the function pulls all columns whose names
-    contain '_PTS', adds these points up and substracts them from the whole team points.
+    This function compiles, once per set of tracked players, the columns the
+    preparation of the games data reads and writes. The players' stats columns are
+    named after their last names (see append_players_stats()).
 
     Args:
-        team_games: pd.DataFrame that contains the team's games data.
+        players: tuple that contains the players' ids.
 
     Returns:
-        team_games = pd.DataFrame that contains the team's games data, including the
-            main stats from the rest of the teammates.
+        plan: dict with the columns of the plan:
+            players: list with the players' stats columns (points, rebounds, assists
+                and starter flag of each player).
+            totals: list with the team's stats columns the rest of the teammates'
+                stats are computed from.
+            keys: list with the game's columns kept as they are.
+            output: list with the names of the prepared columns, in order.
     """
 
-    # Some player stats could be filled with NaN values. Fill them with 0
-    cols = [
-        col
-        for col in team_games.columns
-        if "_PTS" in col or "_REB" in col or "_AST" in col or "_STARTER" in col
-    ]
-    col_dict = {col: 0 for col in cols}
-    team_games.fillna(value=col_dict, inplace=True)
-
-    # Pull points from the players, add them up and substract the sum from the whole
-    # team points
-    cols = [col for col in team_games.columns if "_PTS" in col]
-    team_games["REST_PTS"] = team_games["PTS"] - team_games[cols].sum(axis=1)
-
-    # Pull rebounds from the players, add them up and substract the sum from the whole
-    # team rebounds
-    cols = [col for col in team_games.columns if "_REB" in col]
-    team_games["REST_REB"] = team_games["REB"] - team_games[cols].sum(axis=1)
+    # We load the nba_players info
+    players_path = "../data/nba_players.csv"
+    nba_players = pd.read_csv(players_path)
+    last_names = nba_players.set_index("id").loc[list(players), "last_name"].str.upper()
 
-    # Pull assists from the players, add them up and substract the sum from the whole
-    # team assists
-    cols = [col for col in team_games.columns if "_AST" in col]
-    team_games["REST_AST"] = team_games["AST"] - team_games[cols].sum(axis=1)
+    player_cols = [
+        last_name + "_" + stat
+        for last_name in last_names
+        for stat in ["PTS", "REB", "AST", "STARTER"]
+    ]
+    totals = ["PTS", "REB", "AST"]
+    keys = ["GAME_ID", "GAME_DATE", "SEASON_ID", "PLAYOFFS"]
+    output = player_cols + ["REST_" + stat for stat in totals] + keys + ["WIN"]
 
-    return team_games
+    return {
+        "players": player_cols,
+        "totals": totals,
+        "keys": keys,
+        "output": [col.lower() for col in output],
+    }
 
 
-def stats_to_int(team_games: pd.DataFrame) -> pd.DataFrame:
+def prepare_games(team_games: pd.DataFrame, plan: dict) -> pd.DataFrame:
     """
-    This function converts the stats columns from (i) the players whose stats were
-    appended to the games data and (ii) the rest of their teammates to 'int'.
+    This function prepares the games data for the feature store in a single pass: it
+    computes the main stats (PTS, REB and AST) from the rest of the teammates, i.e.,
+    from the teammates whose stats weren't appended to the games data, converts all
+    stats to 'int', computes the games' result and keeps the prepared columns, with
+    lowercase names.
 
     Args:
-        team_games: pd.DataFrame that contains the team's games data.
+        team_games: pd.DataFrame that contains the team's games data, including the
+            players' stats.
+        plan: dict with the columns of the plan (see compile_column_plan()).
 
     Returns:
-        team_games: pd.DataFrame where all stats columns are of type 'int'.
+        pd.DataFrame prepared.
     """
 
-    cols = [
-        col
-        for col in team_games.columns
-        if "_PTS" in col or "_REB" in col or "_AST" in col or "_STARTER" in col
-    ]
-    for col in cols:
-        team_games[col] = team_games[col].astype(int)
+    # Some player stats could be filled with NaN values. Fill them with 0
+    player_stats = team_games[plan["players"]].to_numpy(dtype=float, na_value=0)
 
-    return team_games
+    # The rest of the teammates' stats are the team's stats minus the sum of the
+    # players' stats. Each player has 4 columns, the first 3 of them are the totals
+    n_games = len(team_games)
+    players_totals = player_stats.reshape(n_games, -1, 4)[:, :, :3].sum(axis=1)
+    rest_stats = team_games[plan["totals"]].to_numpy(dtype=float) - players_totals
 
+    # We convert all stats to 'int' at once
+    stats = np.concatenate([player_stats, rest_stats], axis=1).astype(int)
 
-def final_preparation(team_games: pd.DataFrame) -> pd.DataFrame:
+    # We build the prepared DataFrame with its final column names and order
+    columns = [stats[:, i] for i in range(stats.shape[1])]
+    columns += [team_games[col].to_numpy() for col in plan["keys"]]
+    columns.append(np.where(team_games["WL"].to_numpy() == "W", 1, 0))
+
+    return pd.DataFrame(dict(zip(plan["output"], columns)))
+
+
+def push_data_to_feature_store(
+    feature_group: FeatureGroup,
+    team_games: pd.DataFrame,
+    box_scores: dict | None = None,
+    run: PipelineRun | None = None,
+) -> pd.DataFrame:
     """
-    This function performs some final processing steps to the DataFrame games.
+    This function pushes the DataFrame team_games to the feature store. Each stage is
+    recorded as a span of the pipeline run.
 
     Args:
+        feature_group: FeatureGroup where the DataFrame team_games will be pushed.
         team_games: pd.DataFrame that contains the team's games data.
+        box_scores: dict with the box scores already pulled, keyed by game id (see
+            append_players_stats()).
+        run: PipelineRun the spans are recorded in. By default, the push is a run of
+            its own, whose summary is emitted at the end.
 
     Returns:
-        team_games = pd.DataFrame prepared.
+        pd.DataFrame with the games pushed (prepared).
     """
 
-    team_games["WIN"] = np.where(team_games["WL"] == "W", 1, 0)
-    cols = [
-        col
-        for col in team_games.columns
-        if "_PTS" in col or "_REB" in col or "_AST" in col or "_STARTER" in col
-    ]
-    cols.append("GAME_ID")
-    cols.append("GAME_DATE")
-    cols.append("SEASON_ID")
-    cols.append("PLAYOFFS")
-    cols.append("WIN")
-    team_games = team_games[cols].copy()
+    own_run = run is None
+    if own_run:
+        run = PipelineRun(name="push_data_to_feature_store")
+
+    with run.span("append_players_stats", rows_in=len(team_games)) as span:
+        team_games = append_players_stats(
+            players_list=PLAYERS, team_games=team_games, box_scores=box_scores
+        )
+        span["rows_out"] = len(team_games)
+
+    # All the box scores failed, so there's nothing to push
+    if len(team_games) == 0:
+        if own_run:
+            run.summary()
+        return team_games
+
+    with run.span("prepare_games", rows_in=len(team_games)) as span:
+        team_games = prepare_games(
+            team_games=team_games, plan=compile_column_plan(tuple(PLAYERS))
+        )
+        span["rows_out"] = len(team_games)
+
+    with run.span("feature_group_insert", rows_in=len(team_games)) as span:
+        # Inserts from concurrent runs (the app, the cron job or the daemon) go one at
+        # a time
+        with file_lock("feature_group_insert"):
+            feature_group.insert(
+                team_games, write_options={"start_offline_backfill": False}
+            )
+        span["rows_out"] = len(team_games)
+        # The insert doesn't necessarily go through HTTP, so we count the data sent
+        span["bytes_out"] += int(team_games.memory_usage(deep=True).sum())
+
+    # The app notices the new games by itself and warms up its cache again (see
+    # warmup.py)
+    with run.span("collect_garbage"):
+        # Artifacts computed from the previous games aren't loaded anymore. We don't
+        # remove them right away: the garbage collection removes the artifacts unused
+        # for 30 days and then the least recently used ones until the store is within
+        # 200 MB
+        collect_garbage()
 
-    for col in team_games.columns:
-        team_games.rename(columns={col: col.lower()}, inplace=True)
+    with run.span("refresh_model_state", rows_in=len(team_games)):
+        refresh_model_state(feature_group=feature_group, team_games=team_games)
+
+    if own_run:
+        run.summary()
 
     return team_games
 
 
-def push_data_to_feature_store(
-    feature_group: FeatureGroup, team_games: pd.DataFrame
-) -> None:
+def refresh_model_state(feature_group: FeatureGroup, team_games: pd.DataFrame) -> None:
     """
-    This function pushes the DataFrame team_games to the feature store.
+    This function updates the persisted state of the full-history model with the new
+    games, warm-starting from the previous solution. If there's no state yet, it fits
+    the model to all games in the feature store. The model is pushed into the feature
+    store, where the app takes it for the analysis of all games (see warmup.py).
 
     Args:
-        feature_group: FeatureGroup where the DataFrame team_games will be pushed.
-        team_games: pd.DataFrame that contains the team's games data.
+        feature_group: FeatureGroup with all games data.
+        team_games: pd.DataFrame that contains the new games data (prepared).
     """
 
-    team_games = append_players_stats(
-        players_list=[203999, 1627750], team_games=team_games
-    )
-    team_games = teammates_stats(team_games=team_games)
-    team_games = stats_to_int(team_games=team_games)
-    team_games = final_preparation(team_games=team_games)
+    if len(team_games) == 0:
+        return
+
+    state = load_model_state()
+    if state is None:
+        team_games = get_feature_store_data_r2(feature_group=feature_group)
 
-    feature_group.insert(team_games, write_options={"start_offline_backfill": False})
+    # The model only uses games where both Jokic and Murray were starters
+    games_starters = pull_games_starters(
+        team_games=team_games,
+        date_range=(team_games["game_date"].min(), team_games["game_date"].max()),
+    )
+    if state is None:
+        state = init_model_state(games_starters=games_starters)
+    else:
+        state = update_model_state(state=state, new_games_starters=games_starters)
+    save_model_state(state)
+    push_model_state(state)
+
+    jokic, murray, diff_test, _ = log_reg_results(model=state_model(state))
+    print(
+        "Model state updated ("
+        + str(state["n_games"])
+        + " games). Change in the odds of winning per standard deviation of Jokic's "
+        + "assists: "
+        + str(jokic[0])
+        + "%, of Murray's points: "
+        + str(murray[0])
+        + "%, difference test: z = "
+        + str(diff_test[0])
+        + ", p = "
+        + str(diff_test[1])
+        + "."
+    )
 
 
-def fetch_recent_games() -> None:
+def ingest_recent_games(
+    feature_group: FeatureGroup, date_from: str, run: PipelineRun
+) -> pd.DataFrame:
     """
-    This function pulls the date from the most recent game available in the feature
-    store and uses this date to pull games from the day after using the nba_api.
+    This function pulls the team's games from a given date using the nba_api and
+    pushes the regular season and playoff games into the feature store, together with
+    the games in the dead-letter queue due for a retry.
+
+    Args:
+        feature_group: FeatureGroup where the games are pushed.
+        date_from: str with the date (mm/dd/yyyy) from which the games are pulled.
+        run: PipelineRun the spans are recorded in.
+
+    Returns:
+        pd.DataFrame with the games pushed (prepared), in the format of the games
+            pulled by the app (see data.pull_seasons_to_feature_store()).
     """
 
-    # We connect to the feature group
-    hsfs_connection, feature_group = feature_group_connection_r1()
-
-    # We pull data from the feature store and we get the date from the most recent game
-    # available in the data
-    most_recent_date = get_date_most_recent_game_fs(feature_group=feature_group)
-
-    # We split the date into its elements and create a new date variable with the format
-    # required by the endpoint LeagueGameFinder
-    date_elements = most_recent_date.split("-")
-    year = date_elements[0]
-    month = date_elements[1]
-    day = date_elements[2]
-    date_from = month + "/" + day + "/" + year
-
-    # We pull regular season games by calling the endpoint LeagueGameFinder
-    new_data_regular_season = leaguegamefinder.LeagueGameFinder(
-        team_id_nullable=1610612743,
-        date_from_nullable=date_from,
-        season_type_nullable="Regular Season",
-    ).get_data_frames()[0]
-
-    # We drop summer league games, if any. They're played in July, so we drop games
-    # whose date has July as the month
-    summer_league_games = new_data_regular_season[
-        new_data_regular_season["GAME_DATE"].str[5:7] == "07"
-    ].index
-    new_data_regular_season.drop(summer_league_games, inplace=True)
-
-    # We pull playoff games by calling the endpoint LeagueGameFinder
-    new_data_playoffs = leaguegamefinder.LeagueGameFinder(
-        team_id_nullable=1610612743,
-        date_from_nullable=date_from,
-        season_type_nullable="Playoffs",
-    ).get_data_frames()[0]
-
-    # We concat regular season and playoff dataframes checking whether they're empty
-
-    # Fetched data include both regular season and playoff games
-    if len(new_data_regular_season) > 0 and len(new_data_playoffs) > 0:
-        new_data_regular_season["PLAYOFFS"] = 0
-        new_data_playoffs["PLAYOFFS"] = 1
+    with run.span("discover_games") as span:
+        # We pull all the team's games with a single call to the endpoint
+        # LeagueGameFinder and store the raw response in the lake
+        new_games = discover_games(team_id=1610612743, date_from=date_from)
+        write_league_game_finder(games=new_games.drop(columns=["SEASON_TYPE"]))
+
+        # We keep regular season and playoff games. The rest of the games (e.g.,
+        # preseason and summer league games) are told apart by their game id
+        games = ingested_games(new_games)
+        span["rows_out"] = len(games)
+
+    with run.span("dead_letter_retry") as span:
+        # We retry the games in the dead-letter queue that are due. The games the
+        # ingestion daemon queued before their box score was pulled don't have the
+        # team's stats yet, so the daemon retries them
+        retry_games = due_games().dropna(subset=["PTS"])
         games = pd.concat(
-            [new_data_regular_season, new_data_playoffs], axis=0, ignore_index=True
-        )
-        push_data_to_feature_store(feature_group=feature_group, team_games=games)
-        print(
-            "Data from recent games fetched, prepared and pushed into the feature store."
+            [games, retry_games[~retry_games["GAME_ID"].isin(games["GAME_ID"])]],
+            ignore_index=True,
         )
+        span["rows_out"] = len(retry_games)
 
-    # Fetched data include only regular season games
-    elif len(new_data_regular_season) > 0 and len(new_data_playoffs) == 0:
-        new_data_regular_season["PLAYOFFS"] = 0
-        games = new_data_regular_season
-        push_data_to_feature_store(feature_group=feature_group, team_games=games)
-        print(
-            "Data from recent games fetched, prepared and pushed into the feature store."
+    if len(games) > 0:
+        games = push_data_to_feature_store(
+            feature_group=feature_group, team_games=games, run=run
         )
 
-    # Fetched data include only playoff games
-    elif len(new_data_regular_season) == 0 and len(new_data_playoffs) > 0:
-        new_data_playoffs["PLAYOFFS"] = 1
-        games = new_data_playoffs
-        push_data_to_feature_store(feature_group=feature_group, team_games=games)
-        print(
-            "Data from recent games fetched, prepared and pushed into the feature store."
-        )
+    return games
 
-    # There's no data (off season)
-    else:
-        print(
-            "There is no data from recent games to fetch, prepare and push into the feature store."
+
+def fetch_recent_games() -> None:
+    """
+    This function pulls the date from the most recent game available in the feature
+    store and uses this date to pull games from the day after using the nba_api. The
+    stages of the run are emitted as JSON lines to the log, followed by a summary.
+    """
+
+    run = PipelineRun(name="fetch_recent_games")
+    hsfs_connection = None
+
+    # The summary is emitted even when a stage raises
+    try:
+        with run.span("connect_feature_store"):
+            # We connect to the feature group
+            hsfs_connection, feature_group = feature_group_connection_r1()
+
+            # We pull data from the feature store and we get the date from the most
+            # recent game available in the data
+            most_recent_date = get_date_most_recent_game_fs(feature_group=feature_group)
+
+        # We split the date into its elements and create a new date variable with the
+        # format required by the endpoint LeagueGameFinder
+        date_elements = most_recent_date.split("-")
+        year = date_elements[0]
+        month = date_elements[1]
+        day = date_elements[2]
+        date_from = month + "/" + day + "/" + year
+
+        # Concurrent runs pulling the team's games up to the current season (this job
+        # or the app pulling the current season) wait for the one in flight and share
+        # its result
+        games, shared = single_flight(
+            pull_key(team_id=1610612743, season_end=current_season()),
+            ingest_recent_games,
+            feature_group=feature_group,
+            date_from=date_from,
+            run=run,
         )
 
-    hsfs_connection.close()
+        if shared:
+            print(
+                str(len(games))
+                + " recent games were fetched, prepared and pushed into the feature store "
+                + "by another run."
+            )
+        elif len(games) > 0:
+            print(
+                "Data from recent games fetched, prepared and pushed into the feature store."
+            )
+
+        # There's no data (off season)
+        else:
+            print(
+                "There is no data from recent games to fetch, prepare and push into the feature store."
+            )
+
+    finally:
+        if hsfs_connection is not None:
+            hsfs_connection.close()
+        run.summary()
 
 
 if __name__ == "__main__":
@@ -9,11 +9,16 @@ import pandas as pd
 from hsfs.feature_group import FeatureGroup
 from nba_api.stats.endpoints import boxscoretraditionalv2, leaguegamefinder
 from feature_store import feature_group_connection_r2, get_date_most_recent_game_fs
+from utils import configure_nba_api
 
 HOPSWORKS_API_KEY = os.environ.get("HOPSWORKS_API_KEY")
 HOPSWORKS_PROJECT_NAME = os.environ.get("HOPSWORKS_PROJECT_NAME")
 FEATURE_GROUP_NAME = os.environ.get("FEATURE_GROUP_NAME")
 
+# Calls to the nba_api go to the base URL set in the environment, if any (e.g., the
+# replay server's)
+configure_nba_api()
+
 
 def append_players_stats(players_list: list, team_games: pd.DataFrame) -> pd.DataFrame:
     """
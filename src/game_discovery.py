@@ -0,0 +1,114 @@
+"""
+game_discovery.py
+    This script contains the discovery of a team's games. All the games of a team in a
+    window of dates (or in a season) are pulled with a single LeagueGameFinder call,
+    and each game is classified by the prefix of its game id. Unlike the season id or
+    the game's date, the prefix tells apart every type of game (e.g., summer league
+    games share the season id of the regular season).
+"""
+
+import pandas as pd
+from nba_api.stats.endpoints import leaguegamefinder
+
+# Types of games by the prefix of their game id. NBA game ids start with 00 followed
+# by the type of game, while summer league game ids start with the id of the summer
+# league
+SEASON_TYPES = {
+    "001": "Preseason",
+    "002": "Regular Season",
+    "003": "All-Star",
+    "004": "Playoffs",
+    "005": "Play-In",
+    "006": "NBA Cup",
+    "13": "Summer League",
+    "14": "Summer League",
+    "15": "Summer League",
+    "16": "Summer League",
+}
+
+# Categories of the column SEASON_TYPE, including the games of unknown type
+SEASON_TYPE_CATEGORIES = list(dict.fromkeys(SEASON_TYPES.values())) + ["Other"]
+
+# Types of games ingested into the feature store and their value in the column
+# PLAYOFFS. As before, play-in games aren't part of the playoffs
+INGESTED_TYPES = {"Regular Season": 0, "Playoffs": 1}
+
+
+def season_type(game_id: str) -> str:
+    """
+    This function classifies a game by the prefix of its id.
+
+    Args:
+        game_id: str with the game id.
+
+    Returns:
+        str with the type of game (see SEASON_TYPES), or 'Other' if it's unknown.
+    """
+
+    return SEASON_TYPES.get(game_id[:3], SEASON_TYPES.get(game_id[:2], "Other"))
+
+
+def classify_games(games: pd.DataFrame) -> pd.DataFrame:
+    """
+    This function adds the type of each game to the games returned by
+    LeagueGameFinder.
+
+    Args:
+        games: pd.DataFrame returned by LeagueGameFinder.
+
+    Returns:
+        pd.DataFrame with the games, sorted by date, and the columns SEASON_TYPE
+            (categorical) and PLAYOFFS (1 for playoff games and 0 otherwise).
+    """
+
+    games = games.copy()
+    games["SEASON_TYPE"] = pd.Categorical(
+        games["GAME_ID"].astype(str).map(season_type),
+        categories=SEASON_TYPE_CATEGORIES,
+    )
+    games["PLAYOFFS"] = (games["SEASON_TYPE"] == "Playoffs").astype(int)
+
+    return games.sort_values(by="GAME_DATE", ignore_index=True)
+
+
+def discover_games(
+    team_id: int | str, date_from: str = "", season: str = ""
+) -> pd.DataFrame:
+    """
+    This function pulls all the games of a team, of every type, with a single call to
+    the endpoint LeagueGameFinder.
+
+    Args:
+        team_id: int that contains the team id. An empty string pulls the games of
+            all the teams.
+        date_from: str with the date (mm/dd/yyyy) from which the games are pulled. By
+            default, there's no limit.
+        season: str with the season (yyyy-yy) whose games are pulled. By default, all
+            seasons.
+
+    Returns:
+        pd.DataFrame with the games, classified (see classify_games()).
+    """
+
+    games = leaguegamefinder.LeagueGameFinder(
+        team_id_nullable=team_id,
+        date_from_nullable=date_from,
+        season_nullable=season,
+    ).get_data_frames()[0]
+
+    return classify_games(games)
+
+
+def ingested_games(games: pd.DataFrame) -> pd.DataFrame:
+    """
+    This function keeps the types of games ingested into the feature store (regular
+    season and playoff games).
+
+    Args:
+        games: pd.DataFrame with the games, classified (see classify_games()).
+
+    Returns:
+        pd.DataFrame with the ingested games.
+    """
+
+    return games[games["SEASON_TYPE"].isin(list(INGESTED_TYPES))].reset_index(drop=True)
@@ -0,0 +1,329 @@
+"""
+ingest_daemon.py
+    This script contains the ingestion daemon that keeps the feature store up to date.
+    It caches the season schedule published in the NBA's CDN and only wakes up after
+    the Nuggets' scheduled games should have finished. Then, it pulls the box scores of
+    just those games and pushes them into the feature store. In the off-season, when
+    there are no games left in the schedule, it only checks the schedule once a day.
+"""
+
+import os
+import json
+import time
+from datetime import datetime, timedelta, timezone
+import pandas as pd
+import requests
+from nba_api.stats.endpoints import boxscoretraditionalv2
+from dead_letter import GAME_COLUMNS, due_games, update_dead_letters
+from feature_store import feature_group_connection_r1, get_date_most_recent_game_fs
+from fetch_data_cron import push_data_to_feature_store
+from game_discovery import INGESTED_TYPES, season_type
+from instrumentation import PipelineRun
+from raw_lake import write_partition
+from utils import add_one_day, season_id_from_game_id
+
+# Nuggets' team id
+TEAM_ID = 1610612743
+
+# Season schedule published in the NBA's CDN (or at the URL set in the environment,
+# e.g., the replay server's) and the file where it's cached
+SCHEDULE_URL = os.environ.get(
+    "NBA_SCHEDULE_URL",
+    "https://cdn.nba.com/static/json/staticData/scheduleLeagueV2.json",
+)
+SCHEDULE_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "data", "schedule.json"
+)
+
+# The cached schedule is pulled again once it's older than this (games can be
+# rescheduled and the next season's schedule is published during the off-season)
+SCHEDULE_MAX_AGE = timedelta(days=1)
+
+# Time from the tip-off until the box score of a game is final. A game lasts about
+# 2.5 hours, and we give the stats some extra time to be published
+GAME_DURATION = timedelta(hours=4)
+
+# Time to wait before trying again to pull box scores that weren't final yet
+RETRY_DELAY = timedelta(hours=1)
+
+# Longest sleep, so the schedule is refreshed at least once a day
+MAX_SLEEP = timedelta(days=1)
+
+# Status of the games in the schedule whose box score is final (1: scheduled, 2: in
+# progress, 3: final), and status texts of the games that won't be played as scheduled
+FINAL_STATUS = 3
+POSTPONED_STATUS_TEXTS = ("PPD", "Postponed", "Cancelled", "Canceled")
+
+# Columns of the Nuggets' games from the schedule
+SCHEDULE_COLUMNS = ["game_id", "game_date", "season_id", "playoffs", "status", "end"]
+
+
+def parse_schedule(schedule: dict) -> pd.DataFrame:
+    """
+    This function extracts the Nuggets' games from the season schedule. Postponed and
+    cancelled games are left out (a postponed game gets a new entry once it's
+    rescheduled).
+
+    Args:
+        schedule: dict with the season schedule published in the NBA's CDN.
+
+    Returns:
+        pd.DataFrame with the game id, the game date (yyyy-mm-dd, Eastern time), the
+            season id, whether it's a playoff game, the game's status and the time
+            (UTC) the game should have finished, sorted by the latter.
+    """
+
+    rows = []
+    for game_date in schedule["leagueSchedule"]["gameDates"]:
+        for game in game_date["games"]:
+            game_id = game["gameId"]
+            teams = (game["homeTeam"]["teamId"], game["awayTeam"]["teamId"])
+            # We ingest the same types of games as the weekly cron job
+            game_type = season_type(game_id)
+            if TEAM_ID not in teams or game_type not in INGESTED_TYPES:
+                continue
+            if game.get("gameStatusText", "").strip() in POSTPONED_STATUS_TEXTS:
+                continue
+            tip_off = datetime.strptime(
+                game["gameDateTimeUTC"], "%Y-%m-%dT%H:%M:%SZ"
+            ).replace(tzinfo=timezone.utc)
+            rows.append(
+                [
+                    game_id,
+                    datetime.strptime(game_date["gameDate"][:10], "%m/%d/%Y").strftime(
+                        "%Y-%m-%d"
+                    ),
+                    season_id_from_game_id(game_id),
+                    INGESTED_TYPES[game_type],
+                    game["gameStatus"],
+                    tip_off + GAME_DURATION,
+                ]
+            )
+
+    return pd.DataFrame(rows, columns=SCHEDULE_COLUMNS).sort_values(
+        "end", ignore_index=True
+    )
+
+
+def load_schedule(now: datetime) -> pd.DataFrame:
+    """
+    This function loads the Nuggets' games from the season schedule. The schedule is
+    pulled from the NBA's CDN only if the cached copy is missing or outdated, or if
+    some game that should have finished isn't final in it yet (e.g., a delayed game or
+    a game that went to overtime).
+
+    Args:
+        now: datetime with the current (UTC) time.
+
+    Returns:
+        pd.DataFrame with the Nuggets' games (see parse_schedule()).
+    """
+
+    schedule = None
+    if os.path.exists(SCHEDULE_PATH):
+        cache_age = now - datetime.fromtimestamp(
+            os.path.getmtime(SCHEDULE_PATH), tz=timezone.utc
+        )
+        with open(SCHEDULE_PATH, "r") as schedule_file:
+            schedule = parse_schedule(json.load(schedule_file))
+        pending = (schedule["end"] <= now) & (schedule["status"] != FINAL_STATUS)
+        if cache_age <= SCHEDULE_MAX_AGE and not pending.any():
+            return schedule
+
+    try:
+        response = requests.get(SCHEDULE_URL, timeout=30)
+        response.raise_for_status()
+        with open(SCHEDULE_PATH, "w") as schedule_file:
+            schedule_file.write(response.text)
+        return parse_schedule(response.json())
+    except (requests.RequestException, ValueError) as error:
+        # We keep using the cached schedule, if any
+        print("The schedule couldn't be pulled: " + str(error))
+        if schedule is None:
+            return pd.DataFrame(columns=SCHEDULE_COLUMNS)
+        return schedule
+
+
+def pull_finished_games(games: pd.DataFrame) -> tuple[pd.DataFrame, dict]:
+    """
+    This function pulls the box scores of the given games and builds the team's games
+    data in the format the weekly cron job gets from LeagueGameFinder. It stops at the
+    first game whose box score isn't final yet, leaving the rest of the games for the
+    next try. Games whose box score fails are recorded in the dead-letter queue and
+    skipped, so they don't hold up the rest of the games.
+
+    Args:
+        games: pd.DataFrame with the scheduled games (see load_schedule()), sorted by
+            the time they should have finished.
+
+    Returns:
+        team_games: pd.DataFrame that contains the team's games data.
+        box_scores: dict with the pulled box scores, keyed by game id, so they aren't
+            pulled again to append the players' stats.
+    """
+
+    rows = []
+    box_scores = {}
+    failed = []
+    errors = {}
+    for game in games.itertuples():
+        try:
+            box_score = boxscoretraditionalv2.BoxScoreTraditionalV2(
+                game_id=game.game_id
+            )
+            team_stats = box_score.team_stats.get_data_frame()
+        except (requests.RequestException, ValueError, KeyError) as error:
+            errors[game.game_id] = type(error).__name__ + ": " + str(error)
+            print(
+                "The box score of game "
+                + game.game_id
+                + " failed and was added to the dead-letter queue: "
+                + errors[game.game_id]
+            )
+            # The team's stats aren't known yet, so the game is queued without them
+            # and its box score is pulled again when it's retried
+            failed.append(
+                {
+                    "SEASON_ID": game.season_id,
+                    "GAME_ID": game.game_id,
+                    "GAME_DATE": game.game_date,
+                    "PLAYOFFS": game.playoffs,
+                }
+            )
+            continue
+        team = team_stats[team_stats["TEAM_ID"] == TEAM_ID]
+        opponent = team_stats[team_stats["TEAM_ID"] != TEAM_ID]
+        # We stop at the first game that isn't final, so the games pushed are always
+        # the oldest ones and no game is skipped
+        if team.empty or opponent.empty or team["PTS"].isna().any():
+            print("The box score of game " + game.game_id + " isn't final yet.")
+            break
+
+        box_scores[game.game_id] = box_score
+        # Box scores don't include the game's date, so we keep the game's schedule
+        # entry in the lake, too
+        write_partition(
+            dataset="schedule",
+            frame=games.loc[[game.Index]],
+            season_id=game.season_id,
+            game_id=game.game_id,
+        )
+        rows.append(
+            {
+                "SEASON_ID": game.season_id,
+                "GAME_ID": game.game_id,
+                "GAME_DATE": game.game_date,
+                "WL": (
+                    "W" if team["PTS"].values[0] > opponent["PTS"].values[0] else "L"
+                ),
+                "PTS": team["PTS"].values[0],
+                "REB": team["REB"].values[0],
+                "AST": team["AST"].values[0],
+                "PLAYOFFS": game.playoffs,
+            }
+        )
+
+    if failed:
+        update_dead_letters(
+            failed=pd.DataFrame(failed, columns=GAME_COLUMNS),
+            errors=errors,
+            succeeded=[],
+        )
+
+    return pd.DataFrame(rows, columns=GAME_COLUMNS), box_scores
+
+
+def run_daemon() -> None:
+    """
+    This function runs the ingestion daemon. Each time it wakes up, it pushes the games
+    that should have finished since the most recent game in the feature store, and then
+    it sleeps until the next scheduled game should have finished (or, at most, a day).
+    """
+
+    # We connect to the feature group and get the day after the most recent game
+    hsfs_connection, feature_group = feature_group_connection_r1()
+    date_from = get_date_most_recent_game_fs(feature_group=feature_group)
+    hsfs_connection.close()
+
+    while True:
+        now = datetime.now(timezone.utc)
+        schedule = load_schedule(now)
+        finished = schedule[
+            (schedule["end"] <= now) & (schedule["game_date"] >= date_from)
+        ]
+        # We only pull final games, up to the first one that isn't final yet (e.g., a
+        # delayed game), so its partial stats are never pushed and no game is skipped
+        final = (finished["status"] == FINAL_STATUS).cumprod().astype(bool)
+        pending = len(finished) - int(final.sum())
+        finished = finished[final]
+
+        # Games in the dead-letter queue due for a retry. The games queued before their
+        # box score was pulled go through pull_finished_games() again
+        retry_games = due_games()
+        unpulled = retry_games["PTS"].isna()
+        finished = pd.concat(
+            [
+                pd.DataFrame(
+                    {
+                        "game_id": retry_games.loc[unpulled, "GAME_ID"],
+                        "game_date": retry_games.loc[unpulled, "GAME_DATE"],
+                        "season_id": retry_games.loc[unpulled, "SEASON_ID"],
+                        "playoffs": retry_games.loc[unpulled, "PLAYOFFS"],
+                        "status": FINAL_STATUS,
+                        "end": now,
+                    },
+                    columns=SCHEDULE_COLUMNS,
+                ),
+                finished[~finished["game_id"].isin(retry_games["GAME_ID"])],
+            ],
+            ignore_index=True,
+        )
+        retry_games = retry_games[~unpulled]
+
+        retry = pending > 0
+        if len(finished) > 0 or len(retry_games) > 0:
+            run = PipelineRun(name="ingest_daemon")
+            with run.span("pull_box_scores", rows_in=len(finished)) as span:
+                team_games, box_scores = pull_finished_games(finished)
+                span["rows_out"] = len(team_games)
+            retry = len(team_games) < len(finished) or pending > 0
+            games = pd.concat(
+                [
+                    team_games,
+                    retry_games[~retry_games["GAME_ID"].isin(team_games["GAME_ID"])],
+                ],
+                ignore_index=True,
+            )
+            if len(games) > 0:
+                with run.span("connect_feature_store"):
+                    hsfs_connection, feature_group = feature_group_connection_r1()
+                push_data_to_feature_store(
+                    feature_group=feature_group,
+                    team_games=games,
+                    box_scores=box_scores,
+                    run=run,
+                )
+                hsfs_connection.close()
+                print(
+                    str(len(games))
+                    + " games fetched, prepared and pushed into the feature store."
+                )
+            if len(team_games) > 0:
+                date_from = add_one_day(team_games["GAME_DATE"].max())
+            run.summary()
+
+        # We sleep until the next game should have finished, but we try again sooner
+        # if some box score wasn't final yet
+        upcoming = schedule.loc[schedule["end"] > now, "end"]
+        wake_up = now + MAX_SLEEP
+        if len(upcoming) > 0:
+            wake_up = min(wake_up, upcoming.iloc[0])
+        if retry:
+            wake_up = min(wake_up, now + RETRY_DELAY)
+        print("Sleeping until " + wake_up.strftime("%Y-%m-%d %H:%M UTC") + ".")
+        time.sleep(max((wake_up - now).total_seconds(), 0))
+
+
+if __name__ == "__main__":
+
+    run_daemon()
@@ -0,0 +1,7 @@
+#!/bin/bash
+function fetch_data {
+  cd /mnt/c/Users/USER/DS_Projects/nba_analysis/src
+}
+fetch_data
+source /home/jacasta2/.cache/pypoetry/virtualenvs/nba-analysis-QLTyKPT2-py3.10/bin/activate /home/jacasta2/.cache/pypoetry/virtualenvs/nba-analysis-QLTyKPT2-py3.10
+nohup /home/jacasta2/.local/bin/poetry run python /mnt/c/Users/USER/DS_Projects/nba_analysis/src/ingest_daemon.py >> /mnt/c/Users/USER/DS_Projects/nba_analysis/logs/ingest_daemon.log 2>&1 &
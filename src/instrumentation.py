@@ -0,0 +1,203 @@
+"""
+instrumentation.py
+    This script contains the instrumentation of the ingest pipeline. Each stage of a
+    run is wrapped in a span that records its wall and CPU time, the rows it takes in
+    and puts out, and the HTTP calls and bytes it moves. Spans are emitted as JSON
+    lines to the standard output (i.e., the cron log), followed by a summary of the run.
+    Runs are only created by the batch scripts. Outside of them (e.g., in the app), the
+    functions of the pipeline record nothing (see NullRun).
+"""
+
+import json
+import time
+import uuid
+import contextvars
+from contextlib import contextmanager
+from datetime import datetime, timezone
+import requests
+
+# HTTP counters of the spans open in the current thread. The hook installed by
+# install_http_counter() adds each call, and the bytes sent and received, to them, so
+# the spans of concurrent threads don't count each other's calls
+_SPAN_COUNTERS = contextvars.ContextVar("span_counters", default=())
+_HTTP_COUNTER_INSTALLED = False
+
+
+def install_http_counter() -> None:
+    """
+    This function counts every HTTP call made through requests (used by nba_api and
+    the Hopsworks client) in the counters of the spans open in the calling thread,
+    together with the size of the request and response bodies. It only needs to be
+    called once per process.
+    """
+
+    global _HTTP_COUNTER_INSTALLED  # pylint: disable=global-statement
+    if _HTTP_COUNTER_INSTALLED:
+        return
+
+    send = requests.Session.send
+
+    def counted_send(session, request, **kwargs):
+        counters = _SPAN_COUNTERS.get()
+        # Failed calls count, too
+        for counter in counters:
+            counter["api_calls"] += 1
+            counter["bytes_out"] += len(request.body or b"")
+        response = send(session, request, **kwargs)
+        # We don't read streamed responses, so their size comes from their header
+        if kwargs.get("stream"):
+            bytes_in = int(response.headers.get("Content-Length", 0))
+        else:
+            bytes_in = len(response.content or b"")
+        for counter in counters:
+            counter["bytes_in"] += bytes_in
+        return response
+
+    requests.Session.send = counted_send
+    _HTTP_COUNTER_INSTALLED = True
+
+
+def emit(record: dict) -> None:
+    """
+    This function writes a record as a JSON line to the standard output.
+
+    Args:
+        record: dict with the record.
+    """
+
+    print(json.dumps(record, default=str), flush=True)
+
+
+class PipelineRun:
+    """
+    Spans of a run of the ingest pipeline.
+    """
+
+    def __init__(self, name: str):
+        install_http_counter()
+        self.name = name
+        self.run_id = uuid.uuid4().hex[:12]
+        self.started = datetime.now(timezone.utc).isoformat(timespec="seconds")
+        self.wall_start = time.perf_counter()
+        self.cpu_start = time.process_time()
+        self.spans = []
+
+    @contextmanager
+    def span(self, stage: str, rows_in: int | None = None):
+        """
+        Record a stage of the run. The stage sets the rows it puts out (and any bytes
+        moved outside of HTTP calls) in the yielded record.
+
+        Args:
+            stage: str with the name of the stage.
+            rows_in: int with the number of rows the stage takes in.
+
+        Yields:
+            dict with the record of the span.
+        """
+
+        record = {
+            "event": "span",
+            "run_id": self.run_id,
+            "stage": stage,
+            "rows_in": rows_in,
+            "rows_out": None,
+            "bytes_in": 0,
+            "bytes_out": 0,
+        }
+        # The span counts the HTTP calls of its thread (see install_http_counter())
+        http_counter = {"api_calls": 0, "bytes_in": 0, "bytes_out": 0}
+        token = _SPAN_COUNTERS.set(_SPAN_COUNTERS.get() + (http_counter,))
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            yield record
+            record["status"] = "ok"
+        except BaseException as error:
+            record["status"] = "error"
+            record["error"] = type(error).__name__ + ": " + str(error)
+            raise
+        finally:
+            record["wall_s"] = round(time.perf_counter() - wall_start, 4)
+            record["cpu_s"] = round(time.process_time() - cpu_start, 4)
+            _SPAN_COUNTERS.reset(token)
+            record["api_calls"] = http_counter["api_calls"]
+            record["bytes_in"] += http_counter["bytes_in"]
+            record["bytes_out"] += http_counter["bytes_out"]
+            self.spans.append(record)
+            emit(record)
+
+    def summary(self) -> dict:
+        """
+        Emit the summary of the run: its totals and the share of the wall time taken
+        by each stage.
+
+        Returns:
+            dict with the summary.
+        """
+
+        wall_s = time.perf_counter() - self.wall_start
+        stages = {}
+        for record in self.spans:
+            stage = stages.setdefault(
+                record["stage"],
+                {"count": 0, "wall_s": 0.0, "cpu_s": 0.0, "api_calls": 0, "bytes": 0},
+            )
+            stage["count"] += 1
+            stage["wall_s"] += record["wall_s"]
+            stage["cpu_s"] += record["cpu_s"]
+            stage["api_calls"] += record["api_calls"]
+            stage["bytes"] += record["bytes_in"] + record["bytes_out"]
+        for stage in stages.values():
+            stage["wall_s"] = round(stage["wall_s"], 4)
+            stage["cpu_s"] = round(stage["cpu_s"], 4)
+            stage["wall_share"] = round(stage["wall_s"] / wall_s, 3) if wall_s else 0.0
+
+        summary = {
+            "event": "run_summary",
+            "run_id": self.run_id,
+            "name": self.name,
+            "started": self.started,
+            "wall_s": round(wall_s, 4),
+            "cpu_s": round(time.process_time() - self.cpu_start, 4),
+            "api_calls": sum(record["api_calls"] for record in self.spans),
+            "bytes_in": sum(record["bytes_in"] for record in self.spans),
+            "bytes_out": sum(record["bytes_out"] for record in self.spans),
+            "errors": sum(record["status"] == "error" for record in self.spans),
+            "stages": stages,
+        }
+        emit(summary)
+
+        return summary
+
+
+class NullRun:
+    """
+    Stand-in for a PipelineRun used when the functions of the pipeline are called
+    outside of the batch scripts (e.g., by the app), which records and emits nothing.
+    """
+
+    @contextmanager
+    def span(self, stage: str, rows_in: int | None = None):
+        """
+        Discard a stage.
+
+        Args:
+            stage: str with the name of the stage.
+            rows_in: int with the number of rows the stage takes in.
+
+        Yields:
+            dict with a record that isn't kept.
+        """
+
+        yield {"bytes_in": 0, "bytes_out": 0}
+
+    def summary(self) -> dict:
+        """
+        Discard the summary.
+
+        Returns:
+            dict, empty.
+        """
+
+        return {}
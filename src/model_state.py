@@ -0,0 +1,305 @@
+"""
+model_state.py
+    This script contains the persisted state of the full-history logistic regression,
+    which is updated incrementally every time new games are pushed into the feature
+    store instead of refitting the model from scratch. The model is pushed into the
+    feature store, where the app reads it to serve the analysis of all games.
+"""
+
+import os
+import numpy as np
+import pandas as pd
+import scipy.special
+from feature_store import feature_group_connection_r3, get_feature_group_data
+from modeling import FEATURES, LogitModel, fit_logit_batch
+from utils import data_fingerprint
+
+# File where the model state is persisted
+MODEL_STATE_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "data", "model_state.npz"
+)
+
+# Feature group where the model is pushed, so the app can read it
+MODEL_STATE_FEATURE_GROUP = "model_state"
+
+
+def _design_matrix(games_starters: pd.DataFrame) -> tuple[np.ndarray, np.ndarray]:
+    """
+    This function extracts the raw (not standardized) predictors, with the intercept
+    column (last), and the games' result from the games data.
+
+    Args:
+        games_starters: pd.DataFrame that contains the team's games data from games
+            where Jokic and Murray were starters.
+
+    Returns:
+        x_matrix: np.ndarray with the predictors and the intercept column.
+        y_vector: np.ndarray with the games' result (1: win, 0: loss).
+    """
+
+    x_matrix = np.column_stack(
+        [games_starters[FEATURES].to_numpy(dtype=float), np.ones(len(games_starters))]
+    )
+    y_vector = games_starters["win"].to_numpy(dtype=float)
+
+    return x_matrix, y_vector
+
+
+def _information(x_matrix: np.ndarray, beta: np.ndarray) -> np.ndarray:
+    """
+    This function computes the Fisher information (negative Hessian of the log
+    likelihood) of a logistic regression at the given coefficients.
+
+    Args:
+        x_matrix: np.ndarray with the predictors and the intercept column.
+        beta: np.ndarray with the coefficients.
+
+    Returns:
+        np.ndarray with the information matrix.
+    """
+
+    prob = scipy.special.expit(x_matrix @ beta)
+    return (x_matrix.T * (prob * (1 - prob))) @ x_matrix
+
+
+def init_model_state(games_starters: pd.DataFrame) -> dict:
+    """
+    This function fits the logistic regression to all games and builds the model
+    state: the coefficients of the raw predictors, the running moments of the
+    predictors (used to standardize them) and the information matrix at the solution,
+    which summarizes the log likelihood of the games for later updates.
+
+    Args:
+        games_starters: pd.DataFrame that contains the team's games data from games
+            where Jokic and Murray were starters.
+
+    Returns:
+        state: dict with the model state.
+    """
+
+    x_matrix, y_vector = _design_matrix(games_starters)
+
+    # We fit the model to the standardized predictors, which is better conditioned,
+    # and then we express the coefficients in terms of the raw predictors
+    mean = x_matrix[:, :-1].mean(axis=0)
+    std = x_matrix[:, :-1].std(axis=0)
+    z_matrix = np.column_stack([(x_matrix[:, :-1] - mean) / std, x_matrix[:, -1]])
+    beta, _, converged = fit_logit_batch(z_matrix[None], y_vector[None])
+    raw_coef = beta[0, :-1] / std
+    beta_raw = np.append(raw_coef, beta[0, -1] - raw_coef @ mean)
+
+    state = {
+        "n_games": len(y_vector),
+        "sums": x_matrix[:, :-1].sum(axis=0),
+        "sums_sq": (x_matrix[:, :-1] ** 2).sum(axis=0),
+        "beta": beta_raw,
+        "information": _information(x_matrix, beta_raw),
+        "game_ids": games_starters["game_id"].to_numpy(dtype=str),
+        "converged": bool(converged[0]),
+    }
+
+    return state
+
+
+def update_model_state(
+    state: dict, new_games_starters: pd.DataFrame, n_steps: int = 3
+) -> dict:
+    """
+    This function updates the model state with new games. The log likelihood of the
+    games already in the state is approximated by a quadratic around the previous
+    solution (given by the information matrix), so a few Newton steps warm-started
+    from the previous solution only need the new games. The running moments are
+    updated with the new games, too. Games already in the state are skipped.
+
+    Args:
+        state: dict with the model state.
+        new_games_starters: pd.DataFrame that contains the new games data from games
+            where Jokic and Murray were starters.
+        n_steps: int with the number of Newton steps.
+
+    Returns:
+        state: dict with the updated model state.
+    """
+
+    is_new = ~new_games_starters["game_id"].astype(str).isin(state["game_ids"])
+    new_games_starters = new_games_starters[is_new]
+    if new_games_starters.empty:
+        return state
+
+    x_matrix, y_vector = _design_matrix(new_games_starters)
+    beta_prev = state["beta"]
+    information_prev = state["information"]
+
+    beta = beta_prev.copy()
+    converged = False
+    for _ in range(n_steps):
+        prob = scipy.special.expit(x_matrix @ beta)
+        gradient = x_matrix.T @ (y_vector - prob) - information_prev @ (
+            beta - beta_prev
+        )
+        hessian = (x_matrix.T * (prob * (1 - prob))) @ x_matrix + information_prev
+        step = np.linalg.solve(hessian, gradient)
+        beta += step
+        converged = np.max(np.abs(step)) < 1e-8
+        if converged:
+            break
+
+    state = {
+        "n_games": state["n_games"] + len(y_vector),
+        "sums": state["sums"] + x_matrix[:, :-1].sum(axis=0),
+        "sums_sq": state["sums_sq"] + (x_matrix[:, :-1] ** 2).sum(axis=0),
+        "beta": beta,
+        "information": information_prev + _information(x_matrix, beta),
+        "game_ids": np.concatenate(
+            [state["game_ids"], new_games_starters["game_id"].to_numpy(dtype=str)]
+        ),
+        "converged": bool(converged),
+    }
+
+    return state
+
+
+def state_model(state: dict) -> LogitModel:
+    """
+    This function expresses the model state in terms of the standardized predictors,
+    as fitted in the app's analysis.
+
+    Args:
+        state: dict with the model state.
+
+    Returns:
+        LogitModel with the standardized coefficients and their covariance matrix. It
+            doesn't contain predictions since the state doesn't keep the games.
+    """
+
+    mean = state["sums"] / state["n_games"]
+    std = np.sqrt(np.maximum(state["sums_sq"] / state["n_games"] - mean**2, 0))
+
+    # The standardized coefficients are a linear transformation of the raw ones
+    n_coef = len(state["beta"])
+    transform = np.zeros((n_coef, n_coef))
+    transform[np.arange(n_coef - 1), np.arange(n_coef - 1)] = std
+    transform[-1, :-1] = mean
+    transform[-1, -1] = 1
+    beta = transform @ state["beta"]
+    cov = transform @ np.linalg.inv(state["information"]) @ transform.T
+
+    names = FEATURES + ["Intercept"]
+    return LogitModel(
+        coef=pd.Series(beta, index=names),
+        cov=pd.DataFrame(cov, index=names, columns=names),
+        predictions=None,
+        penalty="none",
+        converged=state["converged"],
+    )
+
+
+def save_model_state(state: dict, path: str = MODEL_STATE_PATH) -> None:
+    """
+    This function persists the model state.
+
+    Args:
+        state: dict with the model state.
+        path: str with the path of the file.
+    """
+
+    np.savez(path, **state)
+
+
+def load_model_state(path: str = MODEL_STATE_PATH) -> dict | None:
+    """
+    This function loads the persisted model state.
+
+    Args:
+        path: str with the path of the file.
+
+    Returns:
+        dict with the model state, or None if it doesn't exist.
+    """
+
+    if not os.path.exists(path):
+        return None
+
+    with np.load(path) as data:
+        state = {key: data[key] for key in data.files}
+    state["n_games"] = int(state["n_games"])
+    state["converged"] = bool(state["converged"])
+
+    return state
+
+
+def games_fingerprint(game_ids: list) -> str:
+    """
+    This function computes a fingerprint of a set of games, which doesn't depend on
+    their order.
+
+    Args:
+        game_ids: list with the ids of the games.
+
+    Returns:
+        str with the fingerprint.
+    """
+
+    return data_fingerprint(pd.DataFrame({"game_id": sorted(map(str, game_ids))}))
+
+
+def push_model_state(state: dict) -> None:
+    """
+    This function pushes the model of the state, in terms of the standardized
+    predictors (see state_model()), into the feature store. There's a row per
+    coefficient, with its row of the covariance matrix and the fingerprint of the games
+    the model was fitted to.
+
+    Args:
+        state: dict with the model state.
+    """
+
+    model = state_model(state)
+    rows = pd.DataFrame(
+        {"coefficient": model.coef.index, "value": model.coef.to_numpy()}
+    )
+    for name in model.cov.columns:
+        rows["cov_" + name.lower()] = model.cov[name].to_numpy()
+    rows["games"] = games_fingerprint(state["game_ids"])
+    rows["converged"] = state["converged"]
+
+    hsfs_connection, feature_group = feature_group_connection_r3(
+        name=MODEL_STATE_FEATURE_GROUP,
+        description="Logistic regression fitted to all games from Denver Nuggets",
+        primary_key=["coefficient"],
+    )
+    feature_group.insert(rows, write_options={"start_offline_backfill": False})
+    hsfs_connection.close()
+
+
+def pull_model_state(games_starters: pd.DataFrame) -> LogitModel | None:
+    """
+    This function pulls the model of the state from the feature store (see
+    push_model_state()), if it was fitted to the given games.
+
+    Args:
+        games_starters: pd.DataFrame that contains the team's games data from games
+            where Jokic and Murray were starters.
+
+    Returns:
+        LogitModel with the standardized coefficients and their covariance matrix, or
+            None if the model wasn't pushed or was fitted to other games.
+    """
+
+    rows = get_feature_group_data(name=MODEL_STATE_FEATURE_GROUP)
+    if rows.empty:
+        return None
+    if (rows["games"] != games_fingerprint(games_starters["game_id"])).any():
+        return None
+
+    names = FEATURES + ["Intercept"]
+    rows = rows.set_index("coefficient").loc[names]
+    cov = rows[["cov_" + name.lower() for name in names]].to_numpy(dtype=float)
+
+    return LogitModel(
+        coef=rows["value"].astype(float),
+        cov=pd.DataFrame(cov, index=names, columns=names),
+        predictions=None,
+        penalty="none",
+        converged=bool(rows["converged"].all()),
+    )
@@ -6,42 +6,56 @@ modeling.py
 import math
 import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
-from matplotlib.figure import Figure
+import scipy.special
 import scipy.stats
 from sklearn.preprocessing import StandardScaler
-from sklearn.linear_model import LogisticRegression
 import statsmodels.api as sm
-import shap
-from utils import log_odds_to_prob, odds_to_prob
+from utils import odds_to_prob
 
+# Stats of each player (and of the rest of the teammates) in the analysis
+STATS = ["pts", "reb", "ast"]
 
-def prepare_data(games_data: pd.DataFrame) -> tuple[pd.DataFrame, pd.DataFrame]:
+
+def pair_features(player_1: str, player_2: str) -> list:
+    """
+    This function lists the columns of the analysis of a pair of starters: the points,
+    rebounds and assists of each player and of the rest of their teammates.
+
+    Args:
+        player_1: str with the prefix of the first player's columns (his last name in
+            lowercase, e.g., jokic).
+        player_2: str with the prefix of the second player's columns.
+
+    Returns:
+        list with the columns' names.
+    """
+
+    return [
+        prefix + "_" + stat for prefix in [player_1, player_2, "rest"] for stat in STATS
+    ]
+
+
+# Columns for the analysis
+FEATURES = pair_features("jokic", "murray")
+
+
+def prepare_data(
+    games_data: pd.DataFrame, features: list = FEATURES
+) -> tuple[pd.DataFrame, pd.DataFrame]:
     """
     This function standardize the predictors and returns both these standardized
     predictors and the dependent variable.
 
     Args:
         games_data: pd.DataFrame that contains the team's games data.
+        features: list with the predictors' columns (by default, Jokic's and Murray's;
+            see pair_features() for any other pair).
     Returns:
         X_train: pd.DataFrame with predictors.
         y_train: pd.DataFrame with the games' result (1: win, 0: loss).
     """
 
-    # Columns for the analysis
-    columns = [
-        "jokic_pts",
-        "jokic_reb",
-        "jokic_ast",
-        "murray_pts",
-        "murray_reb",
-        "murray_ast",
-        "rest_pts",
-        "rest_reb",
-        "rest_ast",
-    ]
-
-    x_train = games_data[columns].copy()
+    x_train = games_data[features].copy()
     scaler = StandardScaler()
     x_train = pd.DataFrame(scaler.fit_transform(x_train), columns=x_train.columns)
     y_train = games_data.iloc[:, -1]
@@ -49,89 +63,257 @@ def prepare_data(games_data: pd.DataFrame) -> tuple[pd.DataFrame, pd.DataFrame]:
     return x_train, y_train
 
 
-def log_reg_results(
-    x_train: pd.DataFrame, y_train: pd.DataFrame
-) -> tuple[list, list, list, Figure]:
+class LogitModel:
+    """
+    Logistic regression fitted once per dataset. Both the coefficients and the SHAP
+    values analyses take their results from it.
+    """
+
+    def __init__(
+        self,
+        coef: pd.Series,
+        cov: pd.DataFrame,
+        predictions: np.ndarray | None,
+        penalty: str,
+        converged: bool,
+    ):
+        # The last coefficient is the intercept
+        self.coef = coef
+        self.cov = cov
+        self.predictions = predictions
+        self.penalty = penalty
+        self.converged = converged
+
+        self.std_err = pd.Series(np.sqrt(np.diag(cov)), index=coef.index)
+        z_scores = coef / self.std_err
+        self.p_values = pd.Series(
+            2 * scipy.stats.norm.sf(np.abs(z_scores)), index=coef.index
+        )
+
+        # All pairwise contrasts between the features' coefficients
+        self.contrast_z, self.contrast_p = pairwise_contrasts(
+            coef=coef.iloc[:-1], cov=cov.iloc[:-1, :-1]
+        )
+
+        # Table with the same layout as statsmodels' summary2()
+        z_crit = scipy.stats.norm.ppf(0.975)
+        self.summary = pd.DataFrame(
+            {
+                "Coef.": coef,
+                "Std.Err.": self.std_err,
+                "z": z_scores,
+                "P>|z|": self.p_values,
+                "[0.025": coef - z_crit * self.std_err,
+                "0.975]": coef + z_crit * self.std_err,
+            }
+        )
+
+    @property
+    def features(self) -> list:
+        """
+        Names of the predictors (without the intercept).
+        """
+
+        return self.coef.index[:-1].tolist()
+
+
+def pairwise_contrasts(
+    coef: pd.Series, cov: pd.DataFrame
+) -> tuple[pd.DataFrame, pd.DataFrame]:
     """
-    This function fits a logistic regression model to the standardized games data and
-    returns a bar plot of the coefficients with 95% CI.
+    This function tests the differences between all pairs of coefficients at once from
+    their covariance matrix. The z-score of the difference between coefficients i and j
+    is (b_i - b_j) / sqrt(V_ii + V_jj - 2 * V_ij). The p-values are adjusted for
+    multiple comparisons with Holm's method.
 
     Args:
-        X_train: pd.DataFrame with the predictors.
+        coef: pd.Series with the coefficients.
+        cov: pd.DataFrame with the covariance matrix of the coefficients.
+
+    Returns:
+        contrast_z: pd.DataFrame with the z-score of each pair's difference (row minus
+            column).
+        contrast_p: pd.DataFrame with the Holm-adjusted two-sided p-value of each pair.
+    """
+
+    values = coef.to_numpy()
+    cov_values = cov.to_numpy()
+    variances = np.diag(cov_values)
+    diff_var = variances[:, None] + variances[None, :] - 2 * cov_values
+    with np.errstate(divide="ignore", invalid="ignore"):
+        z_scores = (values[:, None] - values[None, :]) / np.sqrt(diff_var)
+    np.fill_diagonal(z_scores, np.nan)
+
+    # Holm's step-down adjustment over the pairs in the upper triangle
+    rows, cols = np.triu_indices(len(values), k=1)
+    p_values = 2 * scipy.stats.norm.sf(np.abs(z_scores[rows, cols]))
+    order = np.argsort(p_values)
+    n_pairs = len(p_values)
+    adjusted = np.empty(n_pairs)
+    adjusted[order] = np.minimum(
+        np.maximum.accumulate((n_pairs - np.arange(n_pairs)) * p_values[order]), 1
+    )
+    p_matrix = np.full(z_scores.shape, np.nan)
+    p_matrix[rows, cols] = adjusted
+    p_matrix[cols, rows] = adjusted
+
+    contrast_z = pd.DataFrame(z_scores, index=coef.index, columns=coef.index)
+    contrast_p = pd.DataFrame(p_matrix, index=coef.index, columns=coef.index)
+
+    return contrast_z, contrast_p
+
+
+def fit_logit(
+    x_train: pd.DataFrame,
+    y_train: pd.DataFrame,
+    penalty: str = "none",
+    c_value: float = 1.0,
+) -> LogitModel:
+    """
+    This function fits a logistic regression model to the standardized games data.
+
+    The unregularized model is fitted with statsmodels. The L2-regularized model uses
+    scikit-learn's parametrization (the inverse of the regularization strength, C,
+    multiplies the log loss and the intercept isn't penalized) and is fitted by
+    Newton-Raphson. Its covariance matrix is the inverse of the penalized Hessian, so
+    its standard errors and p-values are approximate.
+
+    Args:
+        x_train: pd.DataFrame with the predictors.
         y_train: pd.DataFrame with the games' result (1: win, 0: loss).
+        penalty: str with the penalty, either 'none' or 'l2'.
+        c_value: float with the inverse of the regularization strength (only used by
+            the L2-regularized model).
+
     Returns:
-        jokic: list with Jokic's assists coefficient, probability equivalent and its
-            p-value.
-        murray: list with Murray's points coefficient, probability equivalent and its
-            p-value.
-        diff_test: list with results from test evaluating differences between Jokic and
-            Murray regression coefficients.
-        fig: Figure bar plot of the regression coefficients.
+        LogitModel with the fitted model.
+    """
+
+    x_matrix = x_train.assign(Intercept=1.0)
+
+    if penalty == "none":
+        log_reg = sm.Logit(np.asarray(y_train, dtype=float), x_matrix).fit(disp=0)
+        return LogitModel(
+            coef=log_reg.params,
+            cov=log_reg.cov_params(),
+            predictions=np.asarray(log_reg.predict()),
+            penalty=penalty,
+            converged=bool(log_reg.mle_retvals["converged"]),
+        )
+
+    if penalty == "l2":
+        values = x_matrix.to_numpy(dtype=float)
+        # The intercept isn't penalized
+        l2_vector = np.append(np.full(x_train.shape[1], 1 / c_value), 0.0)
+        beta, converged = _logit_newton(
+            values,
+            np.asarray(y_train, dtype=float),
+            np.zeros(values.shape[1]),
+            l2_vector=l2_vector,
+        )
+        predictions = scipy.special.expit(values @ beta)
+        hessian = (values * (predictions * (1 - predictions))[:, None]).T @ values
+        cov = np.linalg.inv(hessian + np.diag(l2_vector))
+        return LogitModel(
+            coef=pd.Series(beta, index=x_matrix.columns),
+            cov=pd.DataFrame(cov, index=x_matrix.columns, columns=x_matrix.columns),
+            predictions=predictions,
+            penalty=penalty,
+            converged=converged,
+        )
+
+    raise ValueError("penalty must be either 'none' or 'l2'.")
+
+
+def log_reg_results(
+    model: LogitModel, feature_1: str = "jokic_ast", feature_2: str = "murray_pts"
+) -> tuple[list, list, list, pd.DataFrame]:
     """
+    This function extracts the standardized coefficients of two features (by default,
+    Jokic's assists and Murray's points) from the fitted logistic regression model,
+    tests their difference and returns all the coefficients with 95% CI. The bar plot
+    of the coefficients is rendered in plots.py.
 
-    x_train["Intercept"] = 1
-    log_reg = sm.Logit(y_train, x_train).fit()
+    Args:
+        model: LogitModel fitted to the standardized games data.
+        feature_1: str with the first feature.
+        feature_2: str with the second feature.
+    Returns:
+        first: list with the first feature's coefficient, probability equivalent and
+            its p-value.
+        second: list with the second feature's coefficient, probability equivalent and
+            its p-value.
+        diff_test: list with results from test evaluating differences between both
+            regression coefficients.
+        coef_summary: pd.DataFrame with the regression coefficients (but the
+            Intercept) and their 95% CI, sorted by the coefficients.
+    """
 
     # Extract all coefficients but the Intercept
-    summary = log_reg.summary2().tables[1].iloc[:-1, :]
+    summary = model.summary.iloc[:-1, :].copy()
     summary.sort_values(by="Coef.", inplace=True)
 
     # Extract the coefficients for the interpretation
-    jokic_coeff = summary.loc["jokic_ast", "Coef."]
-    jokic_assists = round((math.exp(jokic_coeff) - 1) * 100, 2)
-    jokic_prob = round(odds_to_prob(math.exp(jokic_coeff) - 1) * 100, 2)
-    jokic_assists_p = round(summary.loc["jokic_ast", "P>|z|"], 2)
-    jokic = [jokic_assists, jokic_prob, jokic_assists_p]
-
-    murray_coeff = summary.loc["murray_pts", "Coef."]
-    murray_points = round((math.exp(murray_coeff) - 1) * 100, 2)
-    murray_prob = round(odds_to_prob(math.exp(murray_coeff) - 1) * 100, 2)
-    murray_points_p = round(summary.loc["murray_pts", "P>|z|"], 2)
-    murray = [murray_points, murray_prob, murray_points_p]
-
-    # Extract additional information to test differences between Jokic and Murray
-    # coefficients
-    jokic_var = log_reg.cov_params().loc["jokic_ast", "jokic_ast"]
-    murray_var = log_reg.cov_params().loc["murray_pts", "murray_pts"]
-    covar = log_reg.cov_params().loc["jokic_ast", "murray_pts"]
+    results = []
+    for feature in [feature_1, feature_2]:
+        coeff = summary.loc[feature, "Coef."]
+        results.append(
+            [
+                round((math.exp(coeff) - 1) * 100, 2),
+                round(odds_to_prob(math.exp(coeff) - 1) * 100, 2),
+                round(summary.loc[feature, "P>|z|"], 2),
+            ]
+        )
+    first, second = results
+
+    # Extract additional information to test differences between both coefficients
+    coeff_1 = summary.loc[feature_1, "Coef."]
+    coeff_2 = summary.loc[feature_2, "Coef."]
+    var_1 = model.cov.loc[feature_1, feature_1]
+    var_2 = model.cov.loc[feature_2, feature_2]
+    covar = model.cov.loc[feature_1, feature_2]
     # Run test
-    diff = (
-        jokic_coeff - murray_coeff
-        if jokic_coeff >= murray_coeff
-        else murray_coeff - jokic_coeff
-    )
-    z_score = diff / ((jokic_var + murray_var - 2 * covar) ** (1 / 2))
+    diff = abs(coeff_1 - coeff_2)
+    z_score = diff / ((var_1 + var_2 - 2 * covar) ** (1 / 2))
     p_value = scipy.stats.norm.sf(z_score) * 2
     diff_test = [round(z_score, 2), round(p_value, 2)]
 
-    # Extract the names, the estimates and the values for the error bars
-    coef_names = summary.index
-    coef_estimates = summary["Coef."]
-    coef_error = summary["Coef."] - summary["[0.025"]
-    # Create a bar plot with error bars
-    fig, axis = plt.subplots()
-    fig.set_figheight(4)
-    axis.barh(coef_names, coef_estimates, xerr=coef_error, capsize=4)
-    axis.set_xlabel("Value")
-    axis.set_ylabel("Coefficient")
-    axis.set_title("Standardized logistic regression coefficients with 95% CI")
-    axis.axvline(
-        x=0, color="black", linewidth=0.8, linestyle="--"
-    )  # Add vertical line at zero
+    return first, second, diff_test, summary
+
+
+def linear_shap_values(coef: np.ndarray, x_matrix: np.ndarray) -> np.ndarray:
+    """
+    This function computes the exact SHAP values of a linear model in log odds space
+    with an independent masker whose background data is the explained data itself,
+    i.e., the SHAP value of a feature in a game is its coefficient times the feature's
+    deviation from its mean.
+
+    Args:
+        coef: np.ndarray with the coefficients (without the intercept).
+        x_matrix: np.ndarray with the predictors.
+
+    Returns:
+        np.ndarray with SHAP values, with the same shape as x_matrix.
+    """
 
-    return jokic, murray, diff_test, fig
+    return (x_matrix - x_matrix.mean(axis=0)) * coef
 
 
 def shap_values_results(
-    x_train: pd.DataFrame, y_train: pd.DataFrame
+    model: LogitModel, x_train: pd.DataFrame, cross_check: bool = False
 ) -> tuple[np.ndarray, float, float, float, float]:
     """
-    This function computes the SHAP values of the games data and returns them together
-    with the SHAP values of Jokic's assists and Murray's points.
+    This function computes the SHAP values of the games data from the fitted logistic
+    regression model and returns them together with the SHAP values of Jokic's assists
+    and Murray's points. The SHAP values are computed in closed form (see
+    linear_shap_values()). The generic explainer from shap can still be used to
+    cross-check them.
 
     Args:
+        model: LogitModel fitted to the standardized games data.
         X_train: pd.DataFrame with the predictors.
-        y_train: pd.DataFrame with the games' result (1: win, 0: loss).
+        cross_check: bool that indicates whether to check the SHAP values against the
+            ones computed by shap's generic explainer.
     Returns:
         shap_values: np.ndarray with SHAP values.
         jokic_shap_value: float with Jokic's assists SHAP value.
@@ -142,32 +324,430 @@ def shap_values_results(
             with Murray's points SHAP value.
     """
 
-    log_reg = LogisticRegression(max_iter=200)
-    log_reg.fit(x_train, y_train)
-    explainer = shap.Explainer(log_reg, x_train)
-    shap_values = explainer.shap_values(x_train)
+    coef = model.coef[x_train.columns].to_numpy()
+    shap_values = linear_shap_values(coef, x_train.to_numpy())
 
-    # Bring the SHAP values to a DataFrame
-    shap_values_df = pd.DataFrame(shap_values, columns=x_train.columns)
-    jokic_shap_value = round(shap_values_df["jokic_ast"].abs().mean(), 2)
-    jokic_prob = round(
-        log_odds_to_prob(shap_values_df["jokic_ast"].abs().mean()) * 100, 2
-    )
-    murray_shap_value = round(shap_values_df["murray_pts"].abs().mean(), 2)
-    murray_prob = round(
-        log_odds_to_prob(shap_values_df["murray_pts"].abs().mean()) * 100, 2
-    )
+    if cross_check:
+        # shap is slow to import, so we only import it when it's needed
+        import shap  # pylint: disable=import-outside-toplevel
+
+        # By default, shap's masker subsamples 100 games as background data, so we use
+        # all the games to get the exact values
+        masker = shap.maskers.Independent(x_train, max_samples=x_train.shape[0])
+        explainer = shap.explainers.Linear((coef, model.coef["Intercept"]), masker)
+        if not np.allclose(shap_values, explainer.shap_values(x_train)):
+            raise ValueError("The closed-form SHAP values don't match shap's values.")
+
+    # Mean absolute SHAP values of all features and their probability equivalents
+    importances = np.abs(shap_values).mean(axis=0)
+    probs = scipy.special.expit(importances)
+
+    jokic = x_train.columns.get_loc("jokic_ast")
+    jokic_shap_value = round(importances[jokic], 2)
+    jokic_prob = round(probs[jokic] * 100, 2)
+    murray = x_train.columns.get_loc("murray_pts")
+    murray_shap_value = round(importances[murray], 2)
+    murray_prob = round(probs[murray] * 100, 2)
 
     return shap_values, jokic_shap_value, jokic_prob, murray_shap_value, murray_prob
 
 
-def shap_values_plot(shap_values: np.ndarray, x_train: pd.DataFrame):
+def _logit_newton(
+    x_matrix: np.ndarray,
+    y_vector: np.ndarray,
+    beta: np.ndarray,
+    max_iter: int = 25,
+    l2_vector: np.ndarray | None = None,
+) -> tuple[np.ndarray, bool]:
     """
-    This function plots a bar plot of the SHAP values.
+    This function fits a logistic regression by Newton-Raphson starting from a given
+    solution. When the starting solution is close to the optimum (e.g., the solution of
+    an overlapping sample), it converges in a couple of steps.
 
     Args:
-        shap_values: np.ndarray with SHAP values.
-        X_train: pd.DataFrame with the predictors.
+        x_matrix: np.ndarray with the predictors, including the intercept column.
+        y_vector: np.ndarray with the games' result (1: win, 0: loss).
+        beta: np.ndarray with the starting coefficients.
+        max_iter: int with the maximum number of Newton steps.
+        l2_vector: np.ndarray with the L2 penalty of each coefficient, if any. The
+            penalized objective is the log likelihood minus sum(l2_vector * beta**2)/2.
+
+    Returns:
+        beta: np.ndarray with the fitted coefficients.
+        converged: bool that indicates whether the fit converged.
+    """
+
+    if l2_vector is None:
+        l2_vector = np.zeros(x_matrix.shape[1])
+
+    for _ in range(max_iter):
+        prob = 1 / (1 + np.exp(-(x_matrix @ beta)))
+        gradient = x_matrix.T @ (y_vector - prob) - l2_vector * beta
+        hessian = (x_matrix * (prob * (1 - prob))[:, None]).T @ x_matrix
+        hessian += np.diag(l2_vector)
+        step = np.linalg.solve(hessian, gradient)
+        beta = beta + step
+        if np.max(np.abs(step)) < 1e-8:
+            return beta, True
+
+    return beta, False
+
+
+def fit_logit_batch(
+    x_matrix: np.ndarray,
+    y_vector: np.ndarray,
+    weights: np.ndarray | None = None,
+    l2_vector: np.ndarray | None = None,
+    start: np.ndarray | None = None,
+    max_iter: int = 25,
+    tol: float = 1e-8,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    This function fits many logistic regressions at once by Newton-Raphson (IRLS), with
+    all the Newton steps computed with batched linear algebra. The models can either
+    have their own data (a stack of design matrices) or share the same games data with
+    their own weights. For example, a bootstrap resample is a set of weights that
+    counts how many times each game was drawn, and a subset of games (e.g., a
+    cross-validation fold) is a set of 0/1 weights.
+
+    Without penalty, the coefficients and standard errors match those of statsmodels'
+    Logit (with the games repeated according to their weights) to within 1e-6.
+
+    Args:
+        x_matrix: np.ndarray with the predictors, including the intercept column,
+            either shared by all models, of shape (games, coefficients), or stacked,
+            of shape (models, games, coefficients).
+        y_vector: np.ndarray with the games' result (1: win, 0: loss), either shared,
+            of shape (games,), or stacked, of shape (models, games).
+        weights: np.ndarray with the weight of each game in each model, of shape
+            (models, games). By default, all games weigh 1 (only allowed with stacked
+            design matrices).
+        l2_vector: np.ndarray with the L2 penalty of each coefficient, if any (see
+            _logit_newton()), either shared by all models, of shape (coefficients,), or
+            per model, of shape (models, coefficients).
+        start: np.ndarray with the starting coefficients, of shape
+            (models, coefficients). By default, the fits start from 0.
+        max_iter: int with the maximum number of Newton steps.
+        tol: float with the largest change of any coefficient in the last Newton step
+            for a fit to be considered converged.
+
+    Returns:
+        beta: np.ndarray with the fitted coefficients, of shape (models, coefficients).
+        std_err: np.ndarray with the coefficients' standard errors (from the inverse of
+            the (penalized) Hessian), of shape (models, coefficients).
+        converged: np.ndarray of bools that indicates whether each fit converged.
+    """
+
+    shared = x_matrix.ndim == 2
+    if shared and weights is None:
+        raise ValueError("weights are required when the design matrix is shared.")
+    n_models = weights.shape[0] if shared else x_matrix.shape[0]
+    n_games, n_coef = x_matrix.shape[-2:]
+    y_stack = np.broadcast_to(y_vector, (n_models, n_games))
+    if weights is None:
+        weights = np.ones((n_models, n_games))
+    if l2_vector is None:
+        l2_vector = np.zeros(n_coef)
+
+    beta = np.zeros((n_models, n_coef)) if start is None else start.astype(float)
+    converged = np.zeros(n_models, dtype=bool)
+    diverged = np.zeros(n_models, dtype=bool)
+    for _ in range(max_iter):
+        # Only the models that haven't converged (nor diverged) yet take a step
+        active = np.flatnonzero(~(converged | diverged))
+        if len(active) == 0:
+            break
+        gradient, hessian = _gradient_hessian(
+            x_matrix if shared else x_matrix[active],
+            y_stack[active],
+            weights[active],
+            l2_vector[active] if l2_vector.ndim == 2 else l2_vector,
+            beta[active],
+        )
+        try:
+            step = np.linalg.solve(hessian, gradient[:, :, None])[:, :, 0]
+        except np.linalg.LinAlgError:
+            # Some Hessian is singular (e.g., a feature is constant within a resample),
+            # so we fall back to the pseudo-inverse
+            step = np.einsum(
+                "mij,mj->mi", np.linalg.pinv(hessian, hermitian=True), gradient
+            )
+        beta[active] += step
+        max_step = np.max(np.abs(step), axis=1)
+        converged[active] = max_step < tol
+        diverged[active] = ~np.isfinite(max_step)
+
+    # Standard errors from the inverse of the Hessian at the solution
+    _, hessian = _gradient_hessian(x_matrix, y_stack, weights, l2_vector, beta)
+    std_err = np.sqrt(
+        np.abs(np.diagonal(np.linalg.pinv(hessian, hermitian=True), axis1=1, axis2=2))
+    )
+
+    return beta, std_err, converged
+
+
+def _gradient_hessian(
+    x_matrix: np.ndarray,
+    y_stack: np.ndarray,
+    weights: np.ndarray,
+    l2_vector: np.ndarray,
+    beta: np.ndarray,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    This function computes the gradient and the Hessian of the (penalized) log
+    likelihood of each model in a batch (see fit_logit_batch()).
+
+    Args:
+        x_matrix: np.ndarray with the predictors, either shared, of shape
+            (games, coefficients), or stacked, of shape (models, games, coefficients).
+        y_stack: np.ndarray with the games' result, of shape (models, games).
+        weights: np.ndarray with the weight of each game, of shape (models, games).
+        l2_vector: np.ndarray with the L2 penalty of each coefficient, either shared,
+            of shape (coefficients,), or per model, of shape (models, coefficients).
+        beta: np.ndarray with the current coefficients, of shape (models, coefficients).
+
+    Returns:
+        gradient: np.ndarray of shape (models, coefficients).
+        hessian: np.ndarray with the negative Hessian, of shape
+            (models, coefficients, coefficients).
+    """
+
+    if x_matrix.ndim == 2:
+        prob = scipy.special.expit(beta @ x_matrix.T)
+        gradient = (weights * (y_stack - prob)) @ x_matrix
+        hessian = (x_matrix.T * (weights * prob * (1 - prob))[:, None, :]) @ x_matrix
+    else:
+        prob = scipy.special.expit(np.einsum("mnc,mc->mn", x_matrix, beta))
+        gradient = np.einsum("mn,mnc->mc", weights * (y_stack - prob), x_matrix)
+        hessian = (
+            x_matrix.transpose(0, 2, 1) * (weights * prob * (1 - prob))[:, None, :]
+        ) @ x_matrix
+
+    penalty_hessian = np.eye(beta.shape[1]) * l2_vector[..., None, :]
+    return gradient - l2_vector * beta, hessian + penalty_hessian
+
+
+def rolling_window_results(
+    games_data: pd.DataFrame, window: int, unit: str = "games", step: int = 1
+) -> pd.DataFrame:
+    """
+    This function slides a window of games or seasons across the games data and fits a
+    standardized logistic regression in each window. It returns the trajectory of
+    Jokic's assists and Murray's points coefficients and mean absolute SHAP values.
+
+    Each window is warm-started from the previous window's solution, carried over to
+    the new window's standardization so it describes the same model, which makes each
+    refit take one or two Newton steps. The standardization statistics are updated
+    incrementally from cumulative sums of the predictors and their squares.
+
+    Since the logistic regression is linear in log odds, the SHAP value of a feature
+    in a game is its coefficient times the (standardized) feature's deviation from its
+    mean (see linear_shap_values()), so the mean absolute SHAP value is
+    |coef| * mean(|z|).
+
+    Args:
+        games_data: pd.DataFrame that contains the team's games data.
+        window: int with the number of games or seasons in each window.
+        unit: str with the window unit, either 'games' or 'seasons'.
+        step: int with the number of games or seasons the window slides each time.
+
+    Returns:
+        trajectory: pd.DataFrame indexed by the date of the last game of each window,
+            with the coefficients and mean absolute SHAP values of Jokic's assists and
+            Murray's points, the number of games and whether the fit converged.
+    """
+
+    games_data = games_data.sort_values(by="game_date").reset_index(drop=True)
+    features = np.asarray(games_data[FEATURES], dtype=float)
+    y_vector = np.asarray(games_data.iloc[:, -1], dtype=float)
+
+    # Window boundaries (row positions) in the games data
+    if unit == "games":
+        starts = np.arange(0, len(games_data) - window + 1, step)
+        ends = starts + window
+    elif unit == "seasons":
+        # The first digit of the season id tells the regular season and playoffs apart,
+        # so we drop it to keep a season's playoff games in the same window
+        season_ids = games_data["season_id"].str[1:].to_numpy()
+        # Position of the first game of each season, plus the end of the data
+        bounds = np.append(
+            np.flatnonzero(np.r_[True, season_ids[1:] != season_ids[:-1]]),
+            len(games_data),
+        )
+        season_starts = np.arange(0, len(bounds) - window, step)
+        starts = bounds[season_starts]
+        ends = bounds[season_starts + window]
+    else:
+        raise ValueError("unit must be either 'games' or 'seasons'.")
+    if len(starts) == 0:
+        raise ValueError("The window is larger than the available games data.")
+
+    # Cumulative sums of the (centered) predictors and their squares. Centering with
+    # the overall mean avoids losing precision when computing the variances
+    features = features - features.mean(axis=0)
+    cum_sum = np.vstack([np.zeros(len(FEATURES)), np.cumsum(features, axis=0)])
+    cum_sq = np.vstack([np.zeros(len(FEATURES)), np.cumsum(features**2, axis=0)])
+
+    jokic = FEATURES.index("jokic_ast")
+    murray = FEATURES.index("murray_pts")
+    # The last element of the coefficients is the intercept
+    beta = np.zeros(len(FEATURES) + 1)
+    prev_mean, prev_std = None, None
+    rows = []
+    for start, end in zip(starts, ends):
+        size = end - start
+        mean = (cum_sum[end] - cum_sum[start]) / size
+        std = np.sqrt(np.maximum((cum_sq[end] - cum_sq[start]) / size - mean**2, 0))
+
+        # Carry the previous solution over to this window's standardization
+        if prev_mean is not None:
+            raw_coef = beta[:-1] / prev_std
+            intercept = beta[-1] - raw_coef @ prev_mean + raw_coef @ mean
+            beta = np.append(raw_coef * std, intercept)
+
+        z_matrix = (features[start:end] - mean) / std
+        x_matrix = np.column_stack([z_matrix, np.ones(size)])
+        beta, converged = _logit_newton(x_matrix, y_vector[start:end], beta)
+        prev_mean, prev_std = mean, std
+
+        mean_abs_z = np.abs(z_matrix).mean(axis=0)
+        rows.append(
+            [
+                games_data.loc[end - 1, "game_date"],
+                beta[jokic],
+                beta[murray],
+                abs(beta[jokic]) * mean_abs_z[jokic],
+                abs(beta[murray]) * mean_abs_z[murray],
+                size,
+                converged,
+            ]
+        )
+
+    trajectory = pd.DataFrame(
+        rows,
+        columns=[
+            "game_date",
+            "jokic_ast_coef",
+            "murray_pts_coef",
+            "jokic_ast_shap",
+            "murray_pts_shap",
+            "games",
+            "converged",
+        ],
+    ).set_index("game_date")
+
+    return trajectory
+
+
+def regularization_path(
+    x_train: pd.DataFrame,
+    y_train: pd.DataFrame,
+    penalty: str = "l2",
+    c_values: np.ndarray | None = None,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    This function fits the standardized logistic regression across a grid of inverse
+    regularization strengths (C), with scikit-learn's parametrization (see
+    fit_logit()). The grid is solved from the strongest to the weakest regularization,
+    each fit warm-started from the previous solution, so most fits only take a couple
+    of steps. The L2-regularized models are fitted by Newton-Raphson and the
+    L1-regularized ones by coordinate descent on a quadratic approximation of the log
+    likelihood (see _logit_l1()).
+
+    Args:
+        x_train: pd.DataFrame with the standardized predictors.
+        y_train: pd.DataFrame with the games' result (1: win, 0: loss).
+        penalty: str with the penalty, either 'l1' or 'l2'.
+        c_values: np.ndarray with the grid of C values. By default, 60 values evenly
+            spaced on a log scale between 1e-3 and 1e2.
+
+    Returns:
+        c_values: np.ndarray with the grid of C values, in increasing order.
+        coef_path: np.ndarray with the coefficients fitted at each C value (intercept
+            last), of shape (C values, coefficients).
+    """
+
+    if penalty not in ("l1", "l2"):
+        raise ValueError("penalty must be either 'l1' or 'l2'.")
+    if c_values is None:
+        c_values = np.logspace(-3, 2, 60)
+    c_values = np.sort(np.asarray(c_values, dtype=float))
+
+    x_matrix = np.column_stack([x_train.to_numpy(dtype=float), np.ones(len(x_train))])
+    y_vector = np.asarray(y_train, dtype=float)
+    # The intercept isn't penalized
+    is_penalized = np.append(np.ones(x_train.shape[1]), 0.0)
+
+    coef_path = np.empty((len(c_values), x_matrix.shape[1]))
+    beta = np.zeros(x_matrix.shape[1])
+    for i, c_value in enumerate(c_values):
+        if penalty == "l2":
+            beta, _ = _logit_newton(
+                x_matrix, y_vector, beta, l2_vector=is_penalized / c_value
+            )
+        else:
+            beta, _ = _logit_l1(x_matrix, y_vector, beta, is_penalized / c_value)
+        coef_path[i] = beta
+
+    return c_values, coef_path
+
+
+def _logit_l1(
+    x_matrix: np.ndarray,
+    y_vector: np.ndarray,
+    beta: np.ndarray,
+    l1_vector: np.ndarray,
+    max_iter: int = 100,
+    tol: float = 1e-8,
+) -> tuple[np.ndarray, bool]:
     """
+    This function fits an L1-regularized logistic regression starting from a given
+    solution. In each iteration, the log likelihood is approximated by a quadratic
+    around the current solution (as in Newton-Raphson) and the penalized quadratic is
+    maximized by cyclic coordinate descent with soft-thresholding.
+
+    Args:
+        x_matrix: np.ndarray with the predictors, including the intercept column.
+        y_vector: np.ndarray with the games' result (1: win, 0: loss).
+        beta: np.ndarray with the starting coefficients.
+        l1_vector: np.ndarray with the L1 penalty of each coefficient. The penalized
+            objective is the log likelihood minus sum(l1_vector * abs(beta)).
+        max_iter: int with the maximum number of quadratic approximations.
+        tol: float with the largest change of any coefficient in the last iteration
+            for the fit to be considered converged.
+
+    Returns:
+        beta: np.ndarray with the fitted coefficients.
+        converged: bool that indicates whether the fit converged.
+    """
+
+    beta = beta.copy()
+    for _ in range(max_iter):
+        prob = scipy.special.expit(x_matrix @ beta)
+        gradient = x_matrix.T @ (y_vector - prob)
+        hessian = (x_matrix.T * (prob * (1 - prob))) @ x_matrix
+
+        # Coordinate descent on the penalized quadratic approximation. We keep the
+        # gradient of the quadratic at the new solution up to date after each update
+        new_beta = beta.copy()
+        quad_gradient = gradient.copy()
+        for _ in range(100):
+            max_change = 0.0
+            for j in range(len(beta)):
+                target = hessian[j, j] * new_beta[j] + quad_gradient[j]
+                value = np.sign(target) * max(abs(target) - l1_vector[j], 0.0)
+                value /= hessian[j, j]
+                change = value - new_beta[j]
+                if change != 0.0:
+                    quad_gradient -= hessian[:, j] * change
+                    new_beta[j] = value
+                    max_change = max(max_change, abs(change))
+            if max_change < tol:
+                break
+
+        step = np.max(np.abs(new_beta - beta))
+        beta = new_beta
+        if step < tol:
+            return beta, True
 
-    shap.summary_plot(shap_values, x_train, plot_type="bar")
+    return beta, False
@@ -0,0 +1,468 @@
+"""
+pair_analysis.py
+    This script contains the analysis of any pair of starters of a roster. A single
+    per-player game table is read from the raw box scores in the lake (see
+    recompute_features.py), and each pair gets its own games (those where both players
+    were starters), its own standardization and its own logistic regression, with the
+    same 9 features as the analysis of Jokic and Murray. All pairs of a roster are
+    fitted at once as a batch (see modeling.fit_logit_batch()) and ranked by the
+    importance of the pair's stats. The table is pushed into the feature store, where
+    the app reads it, since the lake isn't deployed with the app.
+
+    Usage (from the folder src):
+        python pair_analysis.py --seasons 2000 2024
+"""
+
+import argparse
+import numpy as np
+import pandas as pd
+import scipy.stats
+from feature_store import feature_group_connection_r3, get_feature_group_data
+from instrumentation import PipelineRun
+from modeling import STATS, fit_logit_batch, pair_features
+from recompute_features import TEAM_ID, load_team_games, season_ids
+
+# Fewest games where both players were starters for a pair to be ranked, i.e., the
+# lower bound of the rule-of-thumb of 10-20 observations per predictor (9 features)
+MIN_GAMES = 90
+
+# Feature group where the per-player game table is pushed, so the app can read it
+PLAYER_GAMES_FEATURE_GROUP = "player_games"
+
+# Columns of the per-player game table
+TABLE_COLUMNS = [
+    "game_id",
+    "player_id",
+    "pts",
+    "reb",
+    "ast",
+    "starter",
+    "season_id",
+    "game_date",
+    "playoffs",
+    "team_pts",
+    "team_reb",
+    "team_ast",
+    "win",
+]
+
+
+def player_game_table(
+    first_season: int,
+    last_season: int,
+    team_id: int = TEAM_ID,
+    game_ids: list | None = None,
+    run: PipelineRun | None = None,
+) -> pd.DataFrame:
+    """
+    This function builds the table shared by the analyses of all pairs: one row per
+    team's player and game, with the player's stats, whether he was a starter, the
+    team's totals and the game's result.
+
+    Args:
+        first_season: int with the first year of the first season (e.g., 2015 for the
+            2015-16 season).
+        last_season: int with the first year of the last season.
+        team_id: int with the team's id.
+        game_ids: list with the ids of the games read. By default, all the games of
+            the seasons.
+        run: PipelineRun the stages are recorded in, if any.
+
+    Returns:
+        pd.DataFrame with the per-player game table, sorted by date, with lowercase
+            column names.
+    """
+
+    team_games, players_stats = load_team_games(
+        seasons=season_ids(first_season, last_season),
+        team_id=team_id,
+        game_ids=game_ids,
+        run=run,
+    )
+
+    team_games = team_games.rename(
+        columns={"PTS": "TEAM_PTS", "REB": "TEAM_REB", "AST": "TEAM_AST"}
+    ).assign(WIN=lambda games: (games["WL"] == "W").astype(int))
+    table = players_stats[
+        ["game_id", "PLAYER_ID", "PTS", "REB", "AST", "STARTER"]
+    ].merge(
+        team_games[
+            ["SEASON_ID", "GAME_DATE", "PLAYOFFS", "TEAM_PTS", "TEAM_REB", "TEAM_AST"]
+            + ["WIN"]
+        ],
+        left_on="game_id",
+        right_index=True,
+    )
+    table.columns = table.columns.str.lower()
+    # Players that didn't play have no stats
+    table[["pts", "reb", "ast"]] = table[["pts", "reb", "ast"]].fillna(0).astype(int)
+
+    return table.sort_values(["game_date", "game_id"], ignore_index=True)
+
+
+def push_player_game_table(table: pd.DataFrame) -> None:
+    """
+    This function pushes the per-player game table into the feature store. The rows of
+    the games already pushed are updated, so the table of the last seasons can be
+    pushed again as new games come in.
+
+    Args:
+        table: pd.DataFrame with the per-player game table (see player_game_table()).
+    """
+
+    hsfs_connection, feature_group = feature_group_connection_r3(
+        name=PLAYER_GAMES_FEATURE_GROUP,
+        description="Per-player games data from Denver Nuggets",
+        primary_key=["game_id", "player_id"],
+    )
+    feature_group.insert(table, write_options={"start_offline_backfill": False})
+    hsfs_connection.close()
+
+
+def pull_player_game_table(first_season: int, last_season: int) -> pd.DataFrame:
+    """
+    This function pulls the per-player game table of a range of seasons from the
+    feature store (see push_player_game_table()).
+
+    Args:
+        first_season: int with the first year of the first season.
+        last_season: int with the first year of the last season.
+
+    Returns:
+        pd.DataFrame with the per-player game table, sorted by date, which is empty if
+            the table wasn't pushed yet.
+    """
+
+    table = get_feature_group_data(name=PLAYER_GAMES_FEATURE_GROUP)
+    if table.empty:
+        return pd.DataFrame(columns=TABLE_COLUMNS)
+
+    seasons = table["season_id"].str[1:].astype(int)
+    table = table[seasons.between(first_season, last_season)]
+
+    return table[TABLE_COLUMNS].sort_values(["game_date", "game_id"], ignore_index=True)
+
+
+def player_names(player_ids: list) -> pd.DataFrame:
+    """
+    This function looks up the names of the players and the prefixes of their columns:
+    their last names in lowercase, followed by their ids if two players share a last
+    name.
+
+    Args:
+        player_ids: list with the players' ids.
+
+    Returns:
+        pd.DataFrame indexed by the players' ids, with their full names ('full_name')
+            and the prefixes of their columns ('prefix').
+    """
+
+    # We load the nba_players info
+    players_path = "../data/nba_players.csv"
+    nba_players = pd.read_csv(players_path).set_index("id").reindex(player_ids)
+    names = pd.DataFrame(
+        {
+            "full_name": nba_players["full_name"].fillna("Unknown player"),
+            "prefix": nba_players["last_name"]
+            .fillna("player")
+            .str.lower()
+            .str.replace(r"[^a-z]", "", regex=True),
+        }
+    )
+    repeated = names["prefix"].duplicated(keep=False)
+    names.loc[repeated, "prefix"] += "_" + names.index[repeated].astype(str)
+
+    return names
+
+
+def filter_dates(table: pd.DataFrame, date_range: tuple | None) -> pd.DataFrame:
+    """
+    This function keeps the games of the per-player game table within a date range.
+
+    Args:
+        table: pd.DataFrame with the per-player game table.
+        date_range: tuple that contains the start and end date of the analysis. By
+            default, all games.
+
+    Returns:
+        pd.DataFrame with the games within the range.
+    """
+
+    if date_range is None:
+        return table
+
+    return table[
+        (table["game_date"] >= date_range[0]) & (table["game_date"] <= date_range[1])
+    ]
+
+
+def pair_games(
+    table: pd.DataFrame,
+    player_1: int,
+    player_2: int,
+    date_range: tuple | None = None,
+) -> pd.DataFrame:
+    """
+    This function builds the games data of a pair of players from the per-player game
+    table: the games where both were starters, with the players' stats and the rest of
+    their teammates' stats, in the same format as the games of Jokic and Murray, so it
+    can be analyzed by modeling.prepare_data() with pair_features().
+
+    Args:
+        table: pd.DataFrame with the per-player game table.
+        player_1: int with the first player's id.
+        player_2: int with the second player's id.
+        date_range: tuple that contains the start and end date of the analysis.
+
+    Returns:
+        pd.DataFrame with the pair's games data, with the result of the game ('win') in
+            the last column.
+    """
+
+    table = filter_dates(table, date_range)
+    names = player_names([player_1, player_2])["prefix"]
+
+    games = None
+    for player_id in [player_1, player_2]:
+        stats = table.loc[
+            (table["player_id"] == player_id) & (table["starter"] == 1),
+            ["game_id", "pts", "reb", "ast"],
+        ].set_index("game_id")
+        stats.columns = [names[player_id] + "_" + stat for stat in STATS]
+        games = stats if games is None else games.join(stats, how="inner")
+
+    # The team's totals and the game's info, once per game
+    team_games = table.drop_duplicates("game_id").set_index("game_id").loc[games.index]
+    for stat in STATS:
+        games["rest_" + stat] = (
+            team_games["team_" + stat]
+            - games[names[player_1] + "_" + stat]
+            - games[names[player_2] + "_" + stat]
+        )
+    keys = team_games[["game_date", "season_id", "playoffs", "win"]]
+
+    return (
+        pd.concat([games, keys], axis=1)
+        .rename_axis("game_id")
+        .reset_index()
+        .sort_values("game_date", ignore_index=True)
+    )
+
+
+def pair_columns(player_1: int, player_2: int) -> list:
+    """
+    This function lists the predictors' columns of the games data of a pair of players
+    (see pair_games()).
+
+    Args:
+        player_1: int with the first player's id.
+        player_2: int with the second player's id.
+
+    Returns:
+        list with the columns' names.
+    """
+
+    names = player_names([player_1, player_2])["prefix"]
+    return pair_features(names[player_1], names[player_2])
+
+
+def rank_pairs(
+    table: pd.DataFrame,
+    date_range: tuple | None = None,
+    min_games: int = MIN_GAMES,
+    c_value: float | None = None,
+) -> pd.DataFrame:
+    """
+    This function fits the standardized logistic regression of every pair of starters
+    of the roster and ranks the pairs by the importance of their stats.
+
+    The games are pivoted once into an array of the players' stats. Each pair's design
+    matrix spans all the games, and the games where either player wasn't a starter get
+    a weight of 0, so all pairs are fitted in a single batch even though they have
+    different games. The predictors of each pair are standardized with the mean and
+    the standard deviation of the pair's own games.
+
+    The importance of a feature is its mean absolute SHAP value in log odds, i.e.,
+    |coef| * mean(|z|) (see modeling.linear_shap_values()), and the importance of a
+    pair is the sum over the 6 features of both players.
+
+    Args:
+        table: pd.DataFrame with the per-player game table (see player_game_table()).
+        date_range: tuple that contains the start and end date of the analysis. By
+            default, all games.
+        min_games: int with the fewest games where both players were starters for a
+            pair to be ranked.
+        c_value: float with the inverse of the regularization strength of an
+            L2-regularized fit (scikit-learn's parametrization). By default, the fits
+            are unregularized.
+
+    Returns:
+        pd.DataFrame with one row per pair, sorted by importance (the pairs whose fit
+            didn't converge go last). For each player, it contains his id and name,
+            his importance and the stat with the largest importance, with its
+            standardized coefficient and p-value.
+    """
+
+    table = filter_dates(table, date_range)
+    columns = [
+        "player_1_id",
+        "player_1",
+        "player_2_id",
+        "player_2",
+        "games",
+        "win_pct",
+        "importance",
+        "player_1_importance",
+        "player_2_importance",
+        "player_1_top_stat",
+        "player_1_top_coef",
+        "player_1_top_p",
+        "player_2_top_stat",
+        "player_2_top_coef",
+        "player_2_top_p",
+        "converged",
+    ]
+
+    # Only players who started enough games can be part of a ranked pair
+    starts = table.groupby("player_id")["starter"].sum()
+    players = starts[starts >= min_games].index.to_numpy()
+    if len(players) < 2:
+        return pd.DataFrame(columns=columns)
+
+    # Players' stats and starter flags as arrays of shape (players, games, ...)
+    games = table.drop_duplicates("game_id").set_index("game_id")
+    tracked = table[table["player_id"].isin(players)]
+    pivot = tracked.pivot_table(
+        index="player_id",
+        columns="game_id",
+        values=["pts", "reb", "ast", "starter"],
+        aggfunc="first",
+        fill_value=0,
+    )
+    pivot = pivot.reindex(
+        index=players,
+        columns=pd.MultiIndex.from_product([STATS + ["starter"], games.index]),
+        fill_value=0,
+    )
+    n_games = len(games)
+    stats = np.stack(
+        [pivot[stat].to_numpy(dtype=float) for stat in STATS], axis=2
+    )  # (players, games, stats)
+    starter = pivot["starter"].to_numpy() == 1
+    totals = games[["team_" + stat for stat in STATS]].to_numpy(dtype=float)
+    y_vector = games["win"].to_numpy(dtype=float)
+
+    # Pairs of players who started enough games together
+    first, second = np.triu_indices(len(players), k=1)
+    weights = (starter[first] & starter[second]).astype(float)
+    counts = weights.sum(axis=1)
+    keep = counts >= min_games
+    first, second, weights, counts = (
+        first[keep],
+        second[keep],
+        weights[keep],
+        counts[keep],
+    )
+    if len(first) == 0:
+        return pd.DataFrame(columns=columns)
+
+    # Design matrices of shape (pairs, games, 9): each player's stats and the rest of
+    # the teammates' stats
+    features = np.concatenate(
+        [stats[first], stats[second], totals - stats[first] - stats[second]], axis=2
+    )
+    n_features = features.shape[2]
+
+    # Standardization over each pair's own games (as StandardScaler, with ddof=0)
+    mean = np.einsum("mn,mnf->mf", weights, features) / counts[:, None]
+    centered = features - mean[:, None, :]
+    std = np.sqrt(np.einsum("mn,mnf->mf", weights, centered**2) / counts[:, None])
+    std[std == 0] = 1.0
+    # The games of other pairs are zeroed out, since they weigh 0 anyway
+    z_matrix = centered / std[:, None, :] * weights[:, :, None]
+    x_matrix = np.concatenate([z_matrix, np.ones((len(first), n_games, 1))], axis=2)
+
+    # The intercept isn't penalized
+    l2_vector = None
+    if c_value is not None:
+        l2_vector = np.append(np.full(n_features, 1 / c_value), 0.0)
+    beta, std_err, converged = fit_logit_batch(
+        x_matrix, y_vector, weights=weights, l2_vector=l2_vector
+    )
+    p_values = 2 * scipy.stats.norm.sf(np.abs(beta / std_err))
+
+    # Mean absolute SHAP values of the 9 features of each pair
+    mean_abs_z = np.abs(z_matrix).sum(axis=1) / counts[:, None]
+    shap = np.abs(beta[:, :n_features]) * mean_abs_z
+    n_stats = len(STATS)
+    importance_1 = shap[:, :n_stats].sum(axis=1)
+    importance_2 = shap[:, n_stats : 2 * n_stats].sum(axis=1)
+    top_1 = shap[:, :n_stats].argmax(axis=1)
+    top_2 = shap[:, n_stats : 2 * n_stats].argmax(axis=1) + n_stats
+    rows = np.arange(len(first))
+
+    names = player_names(list(players))["full_name"]
+    ranking = pd.DataFrame(
+        {
+            "player_1_id": players[first],
+            "player_1": [names[player] for player in players[first]],
+            "player_2_id": players[second],
+            "player_2": [names[player] for player in players[second]],
+            "games": counts.astype(int),
+            "win_pct": (weights @ y_vector) / counts,
+            "importance": importance_1 + importance_2,
+            "player_1_importance": importance_1,
+            "player_2_importance": importance_2,
+            "player_1_top_stat": np.array(STATS)[top_1],
+            "player_1_top_coef": beta[rows, top_1],
+            "player_1_top_p": p_values[rows, top_1],
+            "player_2_top_stat": np.array(STATS)[top_2 - n_stats],
+            "player_2_top_coef": beta[rows, top_2],
+            "player_2_top_p": p_values[rows, top_2],
+            "converged": converged,
+        },
+        columns=columns,
+    )
+    ranking = ranking[np.isfinite(ranking["importance"])]
+
+    return ranking.sort_values(
+        ["converged", "importance"], ascending=False, ignore_index=True
+    )
+
+
+def main() -> None:
+    """
+    This function parses the command-line arguments, builds the per-player game table
+    of the seasons from the lake and pushes it into the feature store.
+    """
+
+    parser = argparse.ArgumentParser(
+        description="Push the per-player game table into the feature store."
+    )
+    parser.add_argument(
+        "--seasons",
+        type=int,
+        nargs=2,
+        required=True,
+        metavar=("FIRST", "LAST"),
+        help="first year of the first and last seasons (e.g., 2000 2024)",
+    )
+    args = parser.parse_args()
+
+    run = PipelineRun(name="player_game_table")
+    table = player_game_table(
+        first_season=args.seasons[0], last_season=args.seasons[1], run=run
+    )
+
+    # There's nothing to push if the seasons' box scores aren't stored in the lake
+    if len(table) > 0:
+        with run.span("feature_group_insert", rows_in=len(table)) as span:
+            push_player_game_table(table)
+            span["rows_out"] = len(table)
+
+    run.summary()
+
+
+if __name__ == "__main__":
+
+    main()
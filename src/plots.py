@@ -0,0 +1,176 @@
+"""
+plots.py
+    This script contains the functions that render the figures of the analysis. The
+    figures are rendered to PNG bytes and closed right away, so they can be cached
+    together with the results they depict without keeping figures alive in memory.
+"""
+
+import io
+import numpy as np
+import pandas as pd
+import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
+
+
+def figure_to_png(fig: Figure) -> bytes:
+    """
+    This function renders a figure to PNG bytes and closes it.
+
+    Args:
+        fig: Figure to render.
+
+    Returns:
+        png: bytes with the rendered figure.
+    """
+
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format="png", bbox_inches="tight")
+    # Figures created through pyplot are kept alive by pyplot until they're closed
+    plt.close(fig)
+    png = buffer.getvalue()
+    buffer.close()
+
+    return png
+
+
+def coefficients_plot(coef_summary: pd.DataFrame) -> bytes:
+    """
+    This function renders a bar plot of the standardized logistic regression
+    coefficients with 95% CI.
+
+    Args:
+        coef_summary: pd.DataFrame with the coefficients ('Coef.') and the lower bound
+            of their 95% CI ('[0.025'), indexed by the features' names.
+
+    Returns:
+        bytes with the rendered bar plot.
+    """
+
+    # Extract the names, the estimates and the values for the error bars
+    coef_names = coef_summary.index
+    coef_estimates = coef_summary["Coef."]
+    coef_error = coef_summary["Coef."] - coef_summary["[0.025"]
+
+    # Create a bar plot with error bars. We use a Figure instead of pyplot so the
+    # figure isn't registered in pyplot's global state
+    fig = Figure(figsize=(6.4, 4))
+    axis = fig.subplots()
+    axis.barh(coef_names, coef_estimates, xerr=coef_error, capsize=4)
+    axis.set_xlabel("Value")
+    axis.set_ylabel("Coefficient")
+    axis.set_title("Standardized logistic regression coefficients with 95% CI")
+    axis.axvline(
+        x=0, color="black", linewidth=0.8, linestyle="--"
+    )  # Add vertical line at zero
+
+    return figure_to_png(fig)
+
+
+def shap_values_plot(shap_values: np.ndarray, x_train: pd.DataFrame) -> bytes:
+    """
+    This function renders a bar plot of the mean absolute SHAP values, like the one
+    drawn by shap's summary_plot() with plot_type="bar".
+
+    Args:
+        shap_values: np.ndarray with SHAP values.
+        x_train: pd.DataFrame with the predictors.
+
+    Returns:
+        bytes with the rendered bar plot.
+    """
+
+    # Sort the features so the most important one is at the top
+    importances = pd.Series(np.abs(shap_values).mean(axis=0), index=x_train.columns)
+    importances.sort_values(inplace=True)
+
+    fig = Figure(figsize=(6.4, 4))
+    axis = fig.subplots()
+    axis.barh(importances.index, importances.values, color="#1E88E5")
+    axis.set_xlabel("mean(|SHAP value|) (average impact on model output magnitude)")
+    axis.set_title("SHAP values")
+    axis.spines[["top", "right"]].set_visible(False)
+
+    return figure_to_png(fig)
+
+
+def contrasts_plot(contrast_z: pd.DataFrame, contrast_p: pd.DataFrame) -> bytes:
+    """
+    This function renders a heatmap of the z-scores of the differences between all
+    pairs of coefficients. Pairs whose difference is statistically significant (after
+    adjusting for multiple comparisons) are marked with an asterisk.
+
+    Args:
+        contrast_z: pd.DataFrame with the z-score of each pair's difference (row minus
+            column).
+        contrast_p: pd.DataFrame with the adjusted p-value of each pair.
+
+    Returns:
+        bytes with the rendered heatmap.
+    """
+
+    z_scores = contrast_z.to_numpy()
+    limit = np.nanmax(np.abs(z_scores))
+
+    fig = Figure(figsize=(6.4, 5))
+    axis = fig.subplots()
+    image = axis.imshow(z_scores, cmap="RdBu_r", vmin=-limit, vmax=limit)
+    axis.set_xticks(range(len(contrast_z.columns)), contrast_z.columns, rotation=90)
+    axis.set_yticks(range(len(contrast_z.index)), contrast_z.index)
+    axis.set_title("Pairwise differences between coefficients (z, row - column)")
+    fig.colorbar(image, ax=axis)
+
+    # Annotate the z-scores, marking the significant differences
+    for (row, col), z_score in np.ndenumerate(z_scores):
+        if np.isnan(z_score):
+            continue
+        label = str(round(z_score, 1))
+        if contrast_p.iat[row, col] <= 0.05:
+            label += "*"
+        axis.text(col, row, label, ha="center", va="center", fontsize=7)
+
+    return figure_to_png(fig)
+
+
+def regularization_path_plot(
+    c_values: np.ndarray, coef_path: np.ndarray, names: list, penalty: str
+) -> bytes:
+    """
+    This function renders the regularization path of the standardized logistic
+    regression coefficients, highlighting Jokic's assists and Murray's points.
+
+    Args:
+        c_values: np.ndarray with the grid of inverse regularization strengths (C).
+        coef_path: np.ndarray with the coefficients fitted at each C value, of shape
+            (C values, features). The intercept isn't plotted, so it must be excluded.
+        names: list with the features' names.
+        penalty: str with the penalty, either 'l1' or 'l2'.
+
+    Returns:
+        bytes with the rendered plot.
+    """
+
+    highlighted = {"jokic_ast": "#1E88E5", "murray_pts": "#D81B60"}
+
+    fig = Figure(figsize=(6.4, 4))
+    axis = fig.subplots()
+    for j, name in enumerate(names):
+        if name in highlighted:
+            axis.plot(
+                c_values,
+                coef_path[:, j],
+                color=highlighted[name],
+                linewidth=2.5,
+                label=name,
+            )
+        else:
+            axis.plot(c_values, coef_path[:, j], color="grey", linewidth=0.8)
+    axis.set_xscale("log")
+    axis.set_xlabel("C (inverse of the regularization strength)")
+    axis.set_ylabel("Coefficient")
+    axis.set_title(
+        "Regularization path of the standardized coefficients (" + penalty.upper() + ")"
+    )
+    axis.axhline(y=0, color="black", linewidth=0.8, linestyle="--")
+    axis.legend()
+
+    return figure_to_png(fig)
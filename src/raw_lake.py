@@ -0,0 +1,206 @@
+"""
+raw_lake.py
+    This script contains the lake of raw nba_api responses. The full LeagueGameFinder
+    and BoxScoreTraditionalV2 result sets are written once, when they're fetched, as
+    compressed Parquet files partitioned by season and game id, so new features can be
+    computed later without fetching the games again. The stored data is read back by
+    scanning the partitions with pyarrow's dataset API.
+"""
+
+import os
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from utils import season_id_from_game_id
+
+# Directory of the lake
+LAKE_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "data", "lake"
+)
+
+# Datasets of the lake: LeagueGameFinder's games, BoxScoreTraditionalV2's result sets
+# and the schedule entries of the games pulled by the ingestion daemon
+DATASETS = [
+    "league_game_finder",
+    "box_score_players",
+    "box_score_teams",
+    "box_score_starter_bench",
+    "schedule",
+]
+
+# Partitioning of every dataset. The partition values are kept as strings so game ids
+# keep their leading zeros
+PARTITIONING = ds.partitioning(
+    pa.schema([("season_id", pa.string()), ("game_id", pa.string())]), flavor="hive"
+)
+
+
+def partition_path(
+    dataset: str, season_id: str, game_id: str, lake_dir: str = LAKE_DIR
+) -> str:
+    """
+    This function builds the path of the file of a game in a dataset.
+
+    Args:
+        dataset: str with the name of the dataset.
+        season_id: str with the season id (e.g., 22023 for the 2023-24 regular season).
+        game_id: str with the game id.
+        lake_dir: str with the directory of the lake.
+
+    Returns:
+        str with the path of the file.
+    """
+
+    return os.path.join(
+        lake_dir,
+        dataset,
+        "season_id=" + str(season_id),
+        "game_id=" + str(game_id),
+        "part-0.parquet",
+    )
+
+
+def write_partition(
+    dataset: str,
+    frame: pd.DataFrame,
+    season_id: str,
+    game_id: str,
+    lake_dir: str = LAKE_DIR,
+) -> bool:
+    """
+    This function writes the raw data of a game to a dataset, unless it's already
+    stored: raw data is written only once. The file is written to a temporary path
+    first, so scans never see a partially written file.
+
+    Args:
+        dataset: str with the name of the dataset.
+        frame: pd.DataFrame with the raw data of the game.
+        season_id: str with the season id.
+        game_id: str with the game id.
+        lake_dir: str with the directory of the lake.
+
+    Returns:
+        bool that indicates whether the data was written.
+    """
+
+    path = partition_path(dataset, season_id, game_id, lake_dir)
+    if os.path.exists(path):
+        return False
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    table = pa.Table.from_pandas(frame, preserve_index=False)
+    # The temporary file's name starts with a dot, so scans ignore it
+    temp_path = os.path.join(
+        os.path.dirname(path), ".part-0." + str(os.getpid()) + ".tmp"
+    )
+    pq.write_table(table, temp_path, compression="zstd")
+    os.replace(temp_path, path)
+
+    return True
+
+
+def write_league_game_finder(games: pd.DataFrame, lake_dir: str = LAKE_DIR) -> int:
+    """
+    This function writes the raw games returned by LeagueGameFinder to the lake, one
+    file per game.
+
+    Args:
+        games: pd.DataFrame returned by LeagueGameFinder.
+        lake_dir: str with the directory of the lake.
+
+    Returns:
+        int with the number of games written.
+    """
+
+    written = 0
+    for (season_id, game_id), game in games.groupby(["SEASON_ID", "GAME_ID"]):
+        written += write_partition(
+            "league_game_finder", game, season_id, game_id, lake_dir
+        )
+
+    return written
+
+
+def write_box_score(box_score, game_id: str, lake_dir: str = LAKE_DIR) -> None:
+    """
+    This function writes the result sets of a BoxScoreTraditionalV2 response to the
+    lake.
+
+    Args:
+        box_score: BoxScoreTraditionalV2 with the box score of the game.
+        game_id: str with the game id.
+        lake_dir: str with the directory of the lake.
+    """
+
+    season_id = season_id_from_game_id(game_id)
+    result_sets = {
+        "box_score_players": box_score.player_stats,
+        "box_score_teams": box_score.team_stats,
+        "box_score_starter_bench": box_score.team_starter_bench_stats,
+    }
+    for dataset, result_set in result_sets.items():
+        write_partition(
+            dataset, result_set.get_data_frame(), season_id, game_id, lake_dir
+        )
+
+
+def scan(
+    dataset: str,
+    season_ids: list | None = None,
+    game_ids: list | None = None,
+    columns: list | None = None,
+    lake_dir: str = LAKE_DIR,
+) -> pd.DataFrame:
+    """
+    This function reads a dataset of the lake. Only the partitions of the requested
+    seasons and games, and only the requested columns, are read.
+
+    Args:
+        dataset: str with the name of the dataset.
+        season_ids: list with the season ids to read. By default, all seasons.
+        game_ids: list with the game ids to read. By default, all games.
+        columns: list with the columns to read, which may include the partition
+            columns 'season_id' and 'game_id'. By default, all columns.
+        lake_dir: str with the directory of the lake.
+
+    Returns:
+        pd.DataFrame with the data read.
+    """
+
+    path = os.path.join(lake_dir, dataset)
+    if not os.path.isdir(path):
+        return pd.DataFrame(columns=columns)
+
+    condition = None
+    if season_ids is not None:
+        condition = ds.field("season_id").isin([str(s) for s in season_ids])
+    if game_ids is not None:
+        game_condition = ds.field("game_id").isin([str(g) for g in game_ids])
+        condition = game_condition if condition is None else condition & game_condition
+
+    # We only read the files of the requested partitions
+    dataset = ds.dataset(path, format="parquet", partitioning=PARTITIONING)
+    try:
+        return dataset.to_table(columns=columns, filter=condition).to_pandas()
+    except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+        pass
+
+    # The type of a column may vary across games (e.g., a stat is all null in one
+    # game, or integer in a game and float in another with missing values), and the
+    # dataset's schema is inferred from a single file. In that case, we unify the
+    # schemas of all the files
+    files = [fragment.path for fragment in dataset.get_fragments(filter=condition)]
+    schema = pa.unify_schemas(
+        [pq.read_schema(file) for file in files] + [PARTITIONING.schema],
+        promote_options="permissive",
+    )
+    dataset = ds.dataset(
+        files,
+        schema=schema,
+        format="parquet",
+        partitioning=PARTITIONING,
+        partition_base_dir=path,
+    )
+
+    return dataset.to_table(columns=columns).to_pandas()
@@ -0,0 +1,288 @@
+"""
+recompute_features.py
+    This script rebuilds the games feature table for any set of players and range of
+    seasons from the raw box scores stored in the lake (see raw_lake.py), without
+    calling the nba_api. All games are processed at once with vectorized group-bys,
+    and the result is written to the feature store in a single insert (or to a file).
+
+    Usage (from the folder src):
+        python recompute_features.py --players 203999 1627750 --seasons 2015 2024
+        python recompute_features.py --seasons 2015 2024 --push
+"""
+
+import argparse
+import numpy as np
+import pandas as pd
+from feature_store import feature_group_connection_r1
+from fetch_data_cron import PLAYERS, compile_column_plan, prepare_games
+from instrumentation import NullRun, PipelineRun
+from raw_lake import scan
+
+# Nuggets' team id
+TEAM_ID = 1610612743
+
+# Types of games in the feature table (the first digit of the season id): regular
+# season and playoffs
+GAME_TYPES = {"2": 0, "4": 1}
+
+
+def season_ids(first_season: int, last_season: int) -> list:
+    """
+    This function lists the season ids of the regular seasons and playoffs in a range
+    of seasons.
+
+    Args:
+        first_season: int with the first year of the first season (e.g., 2015 for the
+            2015-16 season).
+        last_season: int with the first year of the last season.
+
+    Returns:
+        list with the season ids.
+    """
+
+    return [
+        game_type + str(season)
+        for game_type in GAME_TYPES
+        for season in range(first_season, last_season + 1)
+    ]
+
+
+def load_team_games(
+    seasons: list,
+    team_id: int = TEAM_ID,
+    game_ids: list | None = None,
+    run: PipelineRun | None = None,
+) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    This function reads the team's games and its players' stats from the raw box scores
+    in the lake, with a single scan per dataset. The team's games are taken from the
+    teams' box scores and their dates from the stored LeagueGameFinder games or, for
+    games pulled by the ingestion daemon, from the schedule.
+
+    Args:
+        seasons: list with the season ids (see season_ids()).
+        team_id: int with the team's id.
+        game_ids: list with the ids of the games read. By default, all the games of
+            the seasons.
+        run: PipelineRun the stages are recorded in, if any.
+
+    Returns:
+        team_games: pd.DataFrame with one row per team's game, indexed by game id, with
+            the team's totals and the game's result, in the format of the data
+            discovered by the cron job.
+        players_stats: pd.DataFrame with one row per team's player and game, with the
+            player's points, rebounds and assists and whether he was a starter.
+    """
+
+    run = run or NullRun()
+
+    with run.span("scan_lake") as span:
+        teams = scan(
+            "box_score_teams",
+            season_ids=seasons,
+            game_ids=game_ids,
+            columns=["season_id", "game_id", "TEAM_ID", "PTS", "REB", "AST"],
+        )
+        players_stats = scan(
+            "box_score_players",
+            season_ids=seasons,
+            game_ids=game_ids,
+            columns=["game_id", "TEAM_ID", "PLAYER_ID", "START_POSITION"]
+            + ["PTS", "REB", "AST"],
+        )
+        # Box scores don't include the games' date, which comes from LeagueGameFinder
+        # or, for games pulled by the ingestion daemon, from the schedule. Both teams
+        # of a game share its date, so any team's row will do (the lake may only have
+        # the row of the team whose games were pulled first)
+        league_games = scan(
+            "league_game_finder",
+            season_ids=seasons,
+            game_ids=game_ids,
+            columns=["game_id", "GAME_DATE"],
+        )
+        schedule = scan(
+            "schedule",
+            season_ids=seasons,
+            game_ids=game_ids,
+            columns=["game_id", "game_date"],
+        )
+        dates = pd.concat(
+            [
+                league_games,
+                schedule.rename(columns={"game_date": "GAME_DATE"}),
+            ],
+            ignore_index=True,
+        ).drop_duplicates("game_id")
+        span["rows_out"] = len(teams) + len(players_stats) + len(dates)
+
+    with run.span("build_team_games", rows_in=len(teams)) as span:
+        # One row per team's game, with the team's totals and the game's result
+        team = teams[teams["TEAM_ID"] == team_id].set_index("game_id")
+        opponent_pts = (
+            teams[teams["TEAM_ID"] != team_id].groupby("game_id")["PTS"].sum()
+        )
+        team_games = pd.DataFrame(
+            {
+                "SEASON_ID": team["season_id"],
+                "GAME_ID": team.index,
+                "GAME_DATE": dates.set_index("game_id")["GAME_DATE"].reindex(
+                    team.index
+                ),
+                "WL": np.where(
+                    team["PTS"] > opponent_pts.reindex(team.index), "W", "L"
+                ),
+                "PTS": team["PTS"],
+                "REB": team["REB"],
+                "AST": team["AST"],
+                "PLAYOFFS": team["season_id"].str[0].map(GAME_TYPES),
+            }
+        )
+        missing_dates = team_games["GAME_DATE"].isna()
+        if missing_dates.any():
+            print(
+                str(int(missing_dates.sum()))
+                + " games without a known date were left out."
+            )
+            team_games = team_games[~missing_dates]
+
+        players_stats = players_stats[
+            (players_stats["TEAM_ID"] == team_id)
+            & players_stats["game_id"].isin(team_games.index)
+        ].assign(STARTER=lambda stats: (stats["START_POSITION"] != "").astype(int))
+        span["rows_out"] = len(team_games)
+
+    return team_games, players_stats
+
+
+def recompute_features(
+    players: list,
+    first_season: int,
+    last_season: int,
+    team_id: int = TEAM_ID,
+    run: PipelineRun | None = None,
+) -> pd.DataFrame:
+    """
+    This function rebuilds the games feature table from the raw box scores in the lake.
+    The team's games are read with load_team_games(), the players' stats are pivoted
+    into columns for all games at once, and the table is prepared with the same
+    transform as the ingest pipeline (see prepare_games()).
+
+    Args:
+        players: list that contains the players' ids.
+        first_season: int with the first year of the first season.
+        last_season: int with the first year of the last season.
+        team_id: int with the team's id.
+        run: PipelineRun the stages are recorded in, if any.
+
+    Returns:
+        pd.DataFrame with the games feature table, sorted by date.
+    """
+
+    run = run or PipelineRun(name="recompute_features")
+    team_games, players_stats = load_team_games(
+        seasons=season_ids(first_season, last_season), team_id=team_id, run=run
+    )
+
+    with run.span("build_features", rows_in=len(players_stats)) as span:
+        # The players' stats, pivoted into one column per player and stat. Players that
+        # weren't part of the roster of a game get 0s, as in append_players_stats()
+        plan = compile_column_plan(tuple(players))
+        tracked = players_stats[players_stats["PLAYER_ID"].isin(players)]
+        pivot = tracked.pivot_table(
+            index="game_id",
+            columns="PLAYER_ID",
+            values=["PTS", "REB", "AST", "STARTER"],
+            aggfunc="first",
+        )
+        # We order the columns as in the plan: the 4 stats of each player in turn.
+        # Missing stats are filled with 0s by prepare_games()
+        pivot = pivot.reindex(
+            index=team_games.index,
+            columns=[
+                (stat, player)
+                for player in players
+                for stat in ["PTS", "REB", "AST", "STARTER"]
+            ],
+        )
+        pivot.columns = plan["players"]
+
+        team_games = pd.concat([team_games, pivot], axis=1)
+        team_games = team_games.sort_values("GAME_DATE", ignore_index=True)
+        features = prepare_games(team_games=team_games, plan=plan)
+        span["rows_out"] = len(features)
+
+    return features
+
+
+def main() -> None:
+    """
+    This function parses the command-line arguments, rebuilds the feature table and
+    writes it to the feature store or to a file.
+    """
+
+    parser = argparse.ArgumentParser(
+        description="Rebuild the games feature table from the raw box scores."
+    )
+    parser.add_argument(
+        "--players",
+        type=int,
+        nargs="+",
+        default=PLAYERS,
+        help="ids of the players whose stats are appended (default: Jokic, Murray)",
+    )
+    parser.add_argument(
+        "--seasons",
+        type=int,
+        nargs=2,
+        required=True,
+        metavar=("FIRST", "LAST"),
+        help="first year of the first and last seasons (e.g., 2015 2024)",
+    )
+    parser.add_argument("--team-id", type=int, default=TEAM_ID, help="team's id")
+    parser.add_argument(
+        "--push",
+        action="store_true",
+        help="insert the table into the feature store in a single call (only with the "
+        + "default players and team)",
+    )
+    parser.add_argument(
+        "--output", help="path of a Parquet file where the table is written"
+    )
+    args = parser.parse_args()
+    # The feature group only holds Jokic's and Murray's stats from the Nuggets' games,
+    # so the tables of other players or teams don't match its schema
+    if args.push and (args.players != PLAYERS or args.team_id != TEAM_ID):
+        parser.error(
+            "--push only works with the default players and team, since the feature "
+            + "group holds Jokic's and Murray's stats. Use --output for other ones."
+        )
+
+    run = PipelineRun(name="recompute_features")
+    features = recompute_features(
+        players=args.players,
+        first_season=args.seasons[0],
+        last_season=args.seasons[1],
+        team_id=args.team_id,
+        run=run,
+    )
+
+    if args.output:
+        with run.span("write_file", rows_in=len(features)) as span:
+            features.to_parquet(args.output, index=False)
+            span["rows_out"] = len(features)
+
+    if args.push:
+        with run.span("feature_group_insert", rows_in=len(features)) as span:
+            hsfs_connection, feature_group = feature_group_connection_r1()
+            feature_group.insert(
+                features, write_options={"start_offline_backfill": False}
+            )
+            hsfs_connection.close()
+            span["rows_out"] = len(features)
+
+    run.summary()
+
+
+if __name__ == "__main__":
+
+    main()
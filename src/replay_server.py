@@ -0,0 +1,451 @@
+"""
+replay_server.py
+    This script contains a local stand-in for the NBA stats API. It replays recorded
+    responses of the endpoints the ingestion scripts call (e.g., LeagueGameFinder and
+    BoxScoreTraditionalV2), with configurable latency, jitter, rate limit and injected
+    errors, so the fetch throughput and the retry behavior can be benchmarked offline
+    without risking a block. In record mode, it forwards the requests to the actual API
+    and records the responses.
+
+    Usage (from the folder src):
+        python replay_server.py --record
+        python replay_server.py --latency 0.3 --jitter 0.2 --rate-limit 5 --error-rate 0.05
+
+    The ingestion scripts call the server when the environment variable
+    NBA_STATS_BASE_URL is set (see utils.configure_nba_api()):
+        NBA_STATS_BASE_URL=http://127.0.0.1:8765/stats python fetch_data_cron.py
+"""
+
+import os
+import json
+import time
+import random
+import hashlib
+import argparse
+import threading
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+import requests
+
+# Directory of the recorded responses, one folder per endpoint
+REPLAY_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "data", "replay"
+)
+
+# Address of the server and URL of the actual API the requests are forwarded to in
+# record mode
+HOST = "127.0.0.1"
+PORT = 8765
+UPSTREAM_URL = "https://stats.nba.com/stats"
+
+# Body of the NBA stats API's error responses
+ERROR_BODY = '{"Message":"An error has occurred."}'
+
+# Request headers that aren't forwarded in record mode (requests sets them)
+HOP_HEADERS = {"host", "connection", "accept-encoding", "content-length"}
+
+
+def request_key(endpoint: str, params: list) -> str:
+    """
+    This function builds the key of a request from its endpoint and its parameters, in
+    any order.
+
+    Args:
+        endpoint: str with the endpoint's name (e.g., leaguegamefinder).
+        params: list with the (name, value) pairs of the query parameters.
+
+    Returns:
+        str with the key.
+    """
+
+    query = "&".join(name + "=" + value for name, value in sorted(params))
+    return hashlib.sha256((endpoint.lower() + "?" + query).encode()).hexdigest()[:24]
+
+
+def recording_path(endpoint: str, params: list, replay_dir: str = REPLAY_DIR) -> str:
+    """
+    This function builds the path of the recorded response of a request.
+
+    Args:
+        endpoint: str with the endpoint's name.
+        params: list with the (name, value) pairs of the query parameters.
+        replay_dir: str with the directory of the recorded responses.
+
+    Returns:
+        str with the path of the recording.
+    """
+
+    return os.path.join(
+        replay_dir, endpoint.lower(), request_key(endpoint, params) + ".json"
+    )
+
+
+def save_recording(
+    endpoint: str, params: list, body: str, replay_dir: str = REPLAY_DIR
+) -> None:
+    """
+    This function records the response of a request.
+
+    Args:
+        endpoint: str with the endpoint's name.
+        params: list with the (name, value) pairs of the query parameters.
+        body: str with the body of the response.
+        replay_dir: str with the directory of the recorded responses.
+    """
+
+    path = recording_path(endpoint, params, replay_dir)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = path + "." + str(os.getpid()) + ".tmp"
+    with open(temp_path, "w") as recording_file:
+        json.dump(
+            {"endpoint": endpoint, "params": dict(params), "body": body},
+            recording_file,
+        )
+    os.replace(temp_path, path)
+
+
+def load_recordings(endpoint: str, replay_dir: str = REPLAY_DIR) -> list:
+    """
+    This function loads the recorded responses of an endpoint.
+
+    Args:
+        endpoint: str with the endpoint's name.
+        replay_dir: str with the directory of the recorded responses.
+
+    Returns:
+        list with a dict per recording, with the endpoint, the query parameters and
+            the body of the response.
+    """
+
+    path = os.path.join(replay_dir, endpoint.lower())
+    if not os.path.isdir(path):
+        return []
+
+    recordings = []
+    for file_name in sorted(os.listdir(path)):
+        if file_name.endswith(".json"):
+            with open(os.path.join(path, file_name), "r") as recording_file:
+                recordings.append(json.load(recording_file))
+
+    return recordings
+
+
+class ReplayServer(ThreadingHTTPServer):
+    """
+    HTTP server that replays the recorded responses. The latency and the injected
+    faults of a request are drawn from a random generator seeded with the seed, the
+    request's key and its attempt number, so they don't depend on the order the
+    requests arrive in. The rate limit depends on when the requests arrive, so it's the
+    only fault that isn't reproducible across runs.
+    """
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        address: tuple = (HOST, PORT),
+        replay_dir: str = REPLAY_DIR,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        rate_limit: float | None = None,
+        error_rate: float = 0.0,
+        stall_rate: float = 0.0,
+        stall_time: float = 60.0,
+        seed: int = 0,
+        record: bool = False,
+        upstream: str = UPSTREAM_URL,
+        verbose: bool = False,
+    ):
+        super().__init__(address, ReplayHandler)
+        self.replay_dir = replay_dir
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit = rate_limit
+        self.error_rate = error_rate
+        self.stall_rate = stall_rate
+        self.stall_time = stall_time
+        self.record = record
+        self.upstream = upstream.rstrip("/")
+        self.verbose = verbose
+        self.seed = seed
+        self.attempts = {}
+        self.lock = threading.Lock()
+        self.recent = deque()
+        self.counters = {
+            "requests": 0,
+            "served": 0,
+            "recorded": 0,
+            "missing": 0,
+            "rate_limited": 0,
+            "errors": 0,
+            "stalls": 0,
+        }
+
+    def admit(self, key: str) -> tuple[str, float]:
+        """
+        Decide the fate of a request: whether it exceeds the rate limit (requests per
+        second over a sliding window), gets an injected error or stalls, and the
+        latency of its response.
+
+        Args:
+            key: str with the request's key (see request_key()).
+
+        Returns:
+            outcome: str with 'rate_limited', 'error', 'stall' or 'ok'.
+            delay: float with the latency (seconds) of the response.
+        """
+
+        with self.lock:
+            self.counters["requests"] += 1
+            self.attempts[key] = self.attempts.get(key, 0) + 1
+            # The n-th attempt of a request gets the same draws in every run
+            draws = random.Random(
+                str(self.seed) + ":" + key + ":" + str(self.attempts[key])
+            )
+            delay = self.latency + draws.uniform(0, self.jitter)
+            draw = draws.random()
+
+            now = time.monotonic()
+            while self.recent and now - self.recent[0] > 1.0:
+                self.recent.popleft()
+            if self.rate_limit is not None and len(self.recent) >= self.rate_limit:
+                self.counters["rate_limited"] += 1
+                return "rate_limited", delay
+            self.recent.append(now)
+
+            if draw < self.error_rate:
+                self.counters["errors"] += 1
+                return "error", delay
+            if draw < self.error_rate + self.stall_rate:
+                self.counters["stalls"] += 1
+                return "stall", delay
+
+        return "ok", delay
+
+    def count(self, counter: str) -> None:
+        """
+        Increase a counter of the server.
+
+        Args:
+            counter: str with the name of the counter.
+        """
+
+        with self.lock:
+            self.counters[counter] += 1
+
+
+class ReplayHandler(BaseHTTPRequestHandler):
+    """
+    Handler of the requests to the replay server.
+    """
+
+    def send_body(self, status: int, body: str, headers: dict | None = None) -> None:
+        """
+        Send a response.
+
+        Args:
+            status: int with the status code.
+            body: str with the body.
+            headers: dict with extra headers.
+        """
+
+        content = body.encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(content)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(content)
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """
+        Replay (or record) the response of a request.
+        """
+
+        url = urlsplit(self.path)
+        # The server's counters, for the benchmarks
+        if url.path == "/__stats":
+            with self.server.lock:
+                self.send_body(200, json.dumps(self.server.counters))
+            return
+
+        endpoint = url.path.rstrip("/").split("/")[-1]
+        params = parse_qsl(url.query, keep_blank_values=True)
+
+        if self.server.record:
+            self.forward(endpoint, params)
+            return
+
+        outcome, delay = self.server.admit(request_key(endpoint, params))
+        time.sleep(delay)
+        if outcome == "rate_limited":
+            self.send_body(429, ERROR_BODY, {"Retry-After": "1"})
+            return
+        if outcome == "error":
+            self.send_body(503, ERROR_BODY)
+            return
+        if outcome == "stall":
+            # Like a blocked client, the request gets no response
+            time.sleep(self.server.stall_time)
+            self.close_connection = True
+            return
+
+        path = recording_path(endpoint, params, self.server.replay_dir)
+        if not os.path.exists(path):
+            self.server.count("missing")
+            self.send_body(404, json.dumps({"Message": "No recording of the request."}))
+            return
+        with open(path, "r") as recording_file:
+            body = json.load(recording_file)["body"]
+        self.server.count("served")
+        self.send_body(200, body)
+
+    def forward(self, endpoint: str, params: list) -> None:
+        """
+        Forward a request to the actual API and record its response, if successful.
+
+        Args:
+            endpoint: str with the endpoint's name.
+            params: list with the (name, value) pairs of the query parameters.
+        """
+
+        headers = {
+            name: value
+            for name, value in self.headers.items()
+            if name.lower() not in HOP_HEADERS
+        }
+        try:
+            response = requests.get(
+                self.server.upstream + "/" + endpoint,
+                params=params,
+                headers=headers,
+                timeout=60,
+            )
+        except requests.RequestException as error:
+            self.send_body(502, json.dumps({"Message": str(error)}))
+            return
+
+        if response.status_code == 200:
+            save_recording(endpoint, params, response.text, self.server.replay_dir)
+            self.server.count("recorded")
+        self.send_body(response.status_code, response.text)
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+def start_server(**options) -> ReplayServer:
+    """
+    This function starts a replay server in a background thread.
+
+    Args:
+        **options: options of the server (see ReplayServer).
+
+    Returns:
+        ReplayServer started. Call its shutdown() method to stop it.
+    """
+
+    server = ReplayServer(**options)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    return server
+
+
+def main() -> None:
+    """
+    This function parses the command-line arguments and runs the replay server until
+    it's interrupted.
+    """
+
+    parser = argparse.ArgumentParser(
+        description="Replay recorded responses of the NBA stats API."
+    )
+    parser.add_argument("--host", default=HOST, help="address of the server")
+    parser.add_argument("--port", type=int, default=PORT, help="port of the server")
+    parser.add_argument(
+        "--replay-dir", default=REPLAY_DIR, help="directory of the recordings"
+    )
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="latency of the responses (s)"
+    )
+    parser.add_argument(
+        "--jitter",
+        type=float,
+        default=0.0,
+        help="random extra latency, up to this value (s)",
+    )
+    parser.add_argument(
+        "--rate-limit",
+        type=float,
+        default=None,
+        help="requests per second served; the rest get a 429 response",
+    )
+    parser.add_argument(
+        "--error-rate",
+        type=float,
+        default=0.0,
+        help="share of the requests that get a 503 response",
+    )
+    parser.add_argument(
+        "--stall-rate",
+        type=float,
+        default=0.0,
+        help="share of the requests that get no response, like a blocked client",
+    )
+    parser.add_argument(
+        "--stall-time",
+        type=float,
+        default=60.0,
+        help="time a stalled request is held before its connection is closed (s)",
+    )
+    parser.add_argument(
+        "--seed", type=int, default=0, help="seed of the injected faults"
+    )
+    parser.add_argument(
+        "--record",
+        action="store_true",
+        help="forward the requests to the actual API and record the responses",
+    )
+    parser.add_argument(
+        "--upstream", default=UPSTREAM_URL, help="URL of the actual API"
+    )
+    parser.add_argument("--verbose", action="store_true", help="log every request")
+    args = parser.parse_args()
+
+    server = ReplayServer(
+        address=(args.host, args.port),
+        replay_dir=args.replay_dir,
+        latency=args.latency,
+        jitter=args.jitter,
+        rate_limit=args.rate_limit,
+        error_rate=args.error_rate,
+        stall_rate=args.stall_rate,
+        stall_time=args.stall_time,
+        seed=args.seed,
+        record=args.record,
+        upstream=args.upstream,
+        verbose=args.verbose,
+    )
+    print(
+        ("Recording" if args.record else "Replaying")
+        + " at http://"
+        + args.host
+        + ":"
+        + str(args.port)
+        + "/stats. Press Ctrl+C to stop."
+    )
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(json.dumps(server.counters))
+
+
+if __name__ == "__main__":
+
+    main()
@@ -0,0 +1,446 @@
+"""
+resampling.py
+    This script contains the resampling-based inference of the analysis: bootstrap
+    confidence intervals of the standardized coefficients and SHAP values, a
+    permutation test of the difference between two coefficients and a season-blocked
+    cross-validation of the model.
+"""
+
+import os
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+import scipy.special
+import scipy.stats
+from modeling import fit_logit_batch
+
+# Number of replicates fitted together in a batch. The batches (and their seeds) don't
+# depend on the number of processes, so the results are reproducible on any machine
+BATCH_SIZE = 250
+
+
+def _bootstrap_batch(
+    x_matrix: np.ndarray,
+    y_vector: np.ndarray,
+    n_replicates: int,
+    seed: np.random.SeedSequence,
+    l2_vector: np.ndarray | None,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    This function fits a batch of bootstrap replicates of the logistic regression. The
+    resamples are drawn as index arrays and turned into weights that count how many
+    times each game was drawn, so all replicates are fitted over the same matrix.
+
+    Args:
+        x_matrix: np.ndarray with the standardized predictors and the intercept column
+            (last).
+        y_vector: np.ndarray with the games' result (1: win, 0: loss).
+        n_replicates: int with the number of replicates in the batch.
+        seed: np.random.SeedSequence of the batch.
+        l2_vector: np.ndarray with the L2 penalty of each coefficient, if any.
+
+    Returns:
+        coef: np.ndarray with the replicates' standardized coefficients (without the
+            intercept), of shape (replicates, features).
+        shap: np.ndarray with the replicates' mean absolute SHAP values, of shape
+            (replicates, features).
+        converged: np.ndarray of bools that indicates whether each fit converged.
+    """
+
+    n_games = x_matrix.shape[0]
+    rng = np.random.default_rng(seed)
+    indices = rng.integers(0, n_games, size=(n_replicates, n_games))
+    # Count how many times each game was drawn in each replicate
+    offsets = (np.arange(n_replicates) * n_games)[:, None]
+    weights = np.bincount(
+        (indices + offsets).ravel(), minlength=n_replicates * n_games
+    ).reshape(n_replicates, n_games)
+    weights = weights.astype(float)
+
+    beta, _, converged = fit_logit_batch(
+        x_matrix, y_vector, weights, l2_vector=l2_vector
+    )
+
+    # The predictors are standardized with the whole data. We rescale the coefficients
+    # to the resample's standardization, which describes the same model
+    features = x_matrix[:, :-1]
+    res_mean = weights @ features / n_games
+    res_sq = weights @ features**2 / n_games
+    res_std = np.sqrt(np.maximum(res_sq - res_mean**2, 0))
+    coef = beta[:, :-1] * res_std
+
+    # Mean absolute SHAP values over the resampled games (see linear_shap_values()).
+    # The deviations from the mean don't depend on the standardization
+    abs_dev = np.abs(features[None, :, :] - res_mean[:, None, :])
+    shap = np.abs(beta[:, :-1]) * np.einsum("rn,rnf->rf", weights, abs_dev) / n_games
+
+    return coef, shap, converged
+
+
+def bootstrap_results(
+    x_train: pd.DataFrame,
+    y_train: pd.DataFrame,
+    n_replicates: int = 2000,
+    penalty: str = "none",
+    c_value: float = 1.0,
+    seed: int = 0,
+    n_jobs: int | None = None,
+) -> pd.DataFrame:
+    """
+    This function computes bootstrap 95% confidence intervals (percentile method) of
+    the standardized logistic regression coefficients and mean absolute SHAP values.
+    The replicates are fitted in batches, which are spread across a pool of spawned
+    processes.
+
+    Args:
+        x_train: pd.DataFrame with the standardized predictors.
+        y_train: pd.DataFrame with the games' result (1: win, 0: loss).
+        n_replicates: int with the number of bootstrap replicates.
+        penalty: str with the penalty of the logistic regression, either 'none' or
+            'l2' (see fit_logit()).
+        c_value: float with the inverse of the regularization strength (only used by
+            the L2-regularized model).
+        seed: int with the seed of the resamples.
+        n_jobs: int with the number of processes. By default, it uses all CPUs.
+
+    Returns:
+        intervals: pd.DataFrame indexed by the features, with the lower and upper
+            bounds of the coefficients' and SHAP values' intervals. Its attribute
+            'replicates' contains the number of converged replicates they're based on.
+    """
+
+    x_matrix = np.column_stack([x_train.to_numpy(dtype=float), np.ones(len(x_train))])
+    y_vector = np.asarray(y_train, dtype=float)
+    if penalty == "none":
+        l2_vector = None
+    elif penalty == "l2":
+        l2_vector = np.append(np.full(x_train.shape[1], 1 / c_value), 0.0)
+    else:
+        raise ValueError("penalty must be either 'none' or 'l2'.")
+
+    # Split the replicates in batches, each with its own independent seed
+    batch_sizes = [BATCH_SIZE] * (n_replicates // BATCH_SIZE)
+    if n_replicates % BATCH_SIZE > 0:
+        batch_sizes.append(n_replicates % BATCH_SIZE)
+    seeds = np.random.SeedSequence(seed).spawn(len(batch_sizes))
+
+    n_jobs = n_jobs or os.cpu_count() or 1
+    n_batches = len(batch_sizes)
+    if n_jobs > 1 and n_batches > 1:
+        # The app's server is multi-threaded (e.g., the warm-up thread), and forking a
+        # threaded process can deadlock on the locks held at fork time, so the workers
+        # are spawned instead
+        with ProcessPoolExecutor(
+            max_workers=min(n_jobs, n_batches),
+            mp_context=multiprocessing.get_context("spawn"),
+        ) as executor:
+            batches = list(
+                executor.map(
+                    _bootstrap_batch,
+                    [x_matrix] * n_batches,
+                    [y_vector] * n_batches,
+                    batch_sizes,
+                    seeds,
+                    [l2_vector] * n_batches,
+                )
+            )
+    else:
+        batches = [
+            _bootstrap_batch(x_matrix, y_vector, size, batch_seed, l2_vector)
+            for size, batch_seed in zip(batch_sizes, seeds)
+        ]
+
+    converged = np.concatenate([batch[2] for batch in batches])
+    coef = np.vstack([batch[0] for batch in batches])[converged]
+    shap = np.vstack([batch[1] for batch in batches])[converged]
+
+    intervals = pd.DataFrame(
+        {
+            "coef_lower": np.percentile(coef, 2.5, axis=0),
+            "coef_upper": np.percentile(coef, 97.5, axis=0),
+            "shap_lower": np.percentile(shap, 2.5, axis=0),
+            "shap_upper": np.percentile(shap, 97.5, axis=0),
+        },
+        index=x_train.columns,
+    )
+    intervals.attrs["replicates"] = int(converged.sum())
+
+    return intervals
+
+
+def contrast_permutation_test(
+    x_train: pd.DataFrame,
+    y_train: pd.DataFrame,
+    first: str = "jokic_ast",
+    second: str = "murray_pts",
+    method: str = "sign_flip",
+    max_permutations: int = 10000,
+    batch_size: int = 500,
+    alpha: float = 0.05,
+    penalty: str = "none",
+    c_value: float = 1.0,
+    seed: int = 0,
+) -> dict:
+    """
+    This function runs a permutation test of the difference between the coefficients
+    of two features, which doesn't rely on the normal approximation of the z-test in
+    log_reg_results().
+
+    The model is reparametrized with the sum and the difference of both features, so
+    the coefficient of the difference is half the difference between the coefficients.
+    The test statistic is the absolute z-score of that coefficient. Under the null
+    hypothesis (equal coefficients), the difference doesn't matter, so its values can
+    be randomized: 'sign_flip' swaps both features' values in random games, while
+    'permutation' shuffles the difference across games. The permutations are refitted
+    in batches, and the test stops early once the p-value is clearly on one side of
+    alpha (more than three Monte Carlo standard errors away).
+
+    Args:
+        x_train: pd.DataFrame with the standardized predictors.
+        y_train: pd.DataFrame with the games' result (1: win, 0: loss).
+        first: str with the name of the first feature.
+        second: str with the name of the second feature.
+        method: str with the randomization, either 'sign_flip' or 'permutation'.
+        max_permutations: int with the maximum number of permutations.
+        batch_size: int with the number of permutations refitted together.
+        alpha: float with the significance level used to stop early.
+        penalty: str with the penalty of the logistic regression, either 'none' or
+            'l2' (see fit_logit()).
+        c_value: float with the inverse of the regularization strength (only used by
+            the L2-regularized model).
+        seed: int with the seed of the permutations.
+
+    Returns:
+        dict with the observed z-score ('z'), the p-value ('p_value'), its Monte Carlo
+            standard error ('mc_error'), the number of converged permutations
+            ('permutations') and the elapsed time in seconds ('elapsed').
+    """
+
+    start_time = time.perf_counter()
+    if method not in ("sign_flip", "permutation"):
+        raise ValueError("method must be either 'sign_flip' or 'permutation'.")
+
+    # Design matrix with the sum and the difference of both features, the rest of the
+    # features and the intercept column (last)
+    rest = [feature for feature in x_train.columns if feature not in (first, second)]
+    x_matrix = np.column_stack(
+        [
+            x_train[first] - x_train[second],
+            x_train[first] + x_train[second],
+            x_train[rest].to_numpy(dtype=float),
+            np.ones(len(x_train)),
+        ]
+    )
+    y_vector = np.asarray(y_train, dtype=float)
+    n_games, n_coef = x_matrix.shape
+    if penalty == "none":
+        l2_vector = None
+    elif penalty == "l2":
+        # The penalty of the original coefficients, b1**2 + b2**2, is
+        # 2 * (coef_diff**2 + coef_sum**2) in the new parametrization
+        l2_vector = np.append(np.full(n_coef - 1, 1 / c_value), 0.0)
+        l2_vector[:2] *= 2
+    else:
+        raise ValueError("penalty must be either 'none' or 'l2'.")
+
+    # Observed statistic
+    beta, std_err, _ = fit_logit_batch(
+        x_matrix[None], y_vector[None], l2_vector=l2_vector
+    )
+    z_observed = abs(beta[0, 0] / std_err[0, 0])
+
+    rng = np.random.default_rng(seed)
+    exceed, total = 0, 0
+    p_value, mc_error = 1.0, 0.0
+    while total < max_permutations:
+        size = min(batch_size, max_permutations - total)
+        x_stack = np.repeat(x_matrix[None], size, axis=0)
+        if method == "sign_flip":
+            x_stack[:, :, 0] *= rng.choice([-1.0, 1.0], size=(size, n_games))
+        else:
+            x_stack[:, :, 0] = rng.permuted(
+                np.broadcast_to(x_matrix[:, 0], (size, n_games)), axis=1
+            )
+        beta, std_err, converged = fit_logit_batch(
+            x_stack, y_vector, l2_vector=l2_vector
+        )
+        z_permuted = np.abs(beta[converged, 0] / std_err[converged, 0])
+        exceed += int(np.sum(z_permuted >= z_observed))
+        total += int(converged.sum())
+
+        # The observed statistic counts as one of the permutations
+        p_value = (exceed + 1) / (total + 1)
+        mc_error = np.sqrt(p_value * (1 - p_value) / (total + 1))
+        if abs(p_value - alpha) > 3 * mc_error:
+            break
+
+    return {
+        "z": round(float(z_observed), 2),
+        "p_value": round(float(p_value), 4),
+        "mc_error": round(float(mc_error), 4),
+        "permutations": total,
+        "elapsed": round(time.perf_counter() - start_time, 2),
+    }
+
+
+def season_cross_validation(
+    x_train: pd.DataFrame,
+    y_train: pd.DataFrame,
+    season_ids: pd.Series,
+    min_train_seasons: int = 2,
+    penalty: str = "none",
+    c_value: float = 1.0,
+    n_bins: int = 5,
+) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    This function evaluates the model out of sample with time-ordered, season-blocked
+    folds: each season (after the first min_train_seasons) is predicted by a model
+    trained on all previous seasons only, so no future games leak into training. A
+    season's playoff games belong to the same fold as its regular season.
+
+    All folds are fitted at once over the same design matrix, each one with 0/1
+    weights that select its training games, so the matrix isn't copied. The
+    predictors are standardized with all games, which doesn't leak information into
+    the unregularized model since its predictions don't depend on the standardization.
+    For the L2-regularized model, each fold's penalty is rescaled so it penalizes the
+    coefficients of the predictors standardized with the fold's training games.
+
+    Args:
+        x_train: pd.DataFrame with the standardized predictors.
+        y_train: pd.DataFrame with the games' result (1: win, 0: loss).
+        season_ids: pd.Series with the season id of each game.
+        min_train_seasons: int with the number of seasons of the first training set.
+        penalty: str with the penalty of the logistic regression, either 'none' or
+            'l2' (see fit_logit()).
+        c_value: float with the inverse of the regularization strength (only used by
+            the L2-regularized model).
+        n_bins: int with the number of bins (quantiles of the predicted probability)
+            of the calibration table.
+
+    Returns:
+        folds: pd.DataFrame with the test season, number of training and test games,
+            log loss and AUC of each fold, plus a row with the pooled out-of-sample
+            predictions of all folds.
+        calibration: pd.DataFrame with the mean predicted probability and the observed
+            win rate of each bin of the pooled out-of-sample predictions, indexed by
+            the range of the bin.
+    """
+
+    x_matrix = np.column_stack([x_train.to_numpy(dtype=float), np.ones(len(x_train))])
+    y_vector = np.asarray(y_train, dtype=float)
+    # The first digit of the season id tells the regular season and playoffs apart, so
+    # we drop it to keep a season's playoff games in the same fold
+    season_ids = np.array([str(season)[1:] for season in season_ids])
+
+    # Seasons in chronological order (by their starting year)
+    seasons = sorted(np.unique(season_ids))
+    test_seasons = seasons[min_train_seasons:]
+    if len(test_seasons) == 0:
+        raise ValueError("There aren't enough seasons to cross-validate the model.")
+    season_rank = pd.Series(season_ids).map(
+        {season: rank for rank, season in enumerate(seasons)}
+    )
+    season_rank = season_rank.to_numpy()
+    fold_ranks = np.arange(min_train_seasons, len(seasons))
+    train_weights = (season_rank[None, :] < fold_ranks[:, None]).astype(float)
+    test_masks = season_rank[None, :] == fold_ranks[:, None]
+
+    if penalty == "none":
+        l2_vector = None
+    elif penalty == "l2":
+        train_size = train_weights.sum(axis=1, keepdims=True)
+        features = x_matrix[:, :-1]
+        fold_mean = train_weights @ features / train_size
+        fold_var = train_weights @ features**2 / train_size - fold_mean**2
+        l2_vector = np.column_stack([fold_var / c_value, np.zeros(len(test_seasons))])
+    else:
+        raise ValueError("penalty must be either 'none' or 'l2'.")
+
+    beta, _, _ = fit_logit_batch(x_matrix, y_vector, train_weights, l2_vector=l2_vector)
+    prob = scipy.special.expit(beta @ x_matrix.T)
+
+    rows = []
+    for k, season in enumerate(test_seasons):
+        mask = test_masks[k]
+        rows.append(
+            [
+                season,
+                int(train_weights[k].sum()),
+                int(mask.sum()),
+                _log_loss(y_vector[mask], prob[k, mask]),
+                _auc(y_vector[mask], prob[k, mask]),
+            ]
+        )
+
+    # Pooled out-of-sample predictions (each game is predicted by its season's fold)
+    test_fold = np.argmax(test_masks, axis=0)
+    tested = test_masks.any(axis=0)
+    y_pooled = y_vector[tested]
+    prob_pooled = prob[test_fold[tested], np.flatnonzero(tested)]
+    rows.append(
+        [
+            "All",
+            np.nan,
+            len(y_pooled),
+            _log_loss(y_pooled, prob_pooled),
+            _auc(y_pooled, prob_pooled),
+        ]
+    )
+    folds = pd.DataFrame(
+        rows, columns=["test_season", "train_games", "test_games", "log_loss", "auc"]
+    ).astype({"train_games": "Int64"})
+
+    # Calibration by quantiles of the predicted probability
+    bins = pd.qcut(prob_pooled, q=n_bins, duplicates="drop")
+    calibration = (
+        pd.DataFrame({"predicted": prob_pooled, "observed": y_pooled, "bin": bins})
+        .groupby("bin", observed=True)
+        .agg(
+            games=("observed", "size"),
+            predicted=("predicted", "mean"),
+            observed=("observed", "mean"),
+        )
+    )
+    calibration.index = calibration.index.astype(str)
+
+    return folds, calibration
+
+
+def _log_loss(y_vector: np.ndarray, prob: np.ndarray) -> float:
+    """
+    This function computes the mean log loss of predicted probabilities.
+
+    Args:
+        y_vector: np.ndarray with the games' result (1: win, 0: loss).
+        prob: np.ndarray with the predicted probabilities of winning.
+
+    Returns:
+        float with the log loss.
+    """
+
+    prob = np.clip(prob, 1e-15, 1 - 1e-15)
+    return float(-np.mean(y_vector * np.log(prob) + (1 - y_vector) * np.log(1 - prob)))
+
+
+def _auc(y_vector: np.ndarray, prob: np.ndarray) -> float:
+    """
+    This function computes the area under the ROC curve of predicted probabilities
+    from the ranks of the predictions (Mann-Whitney U statistic).
+
+    Args:
+        y_vector: np.ndarray with the games' result (1: win, 0: loss).
+        prob: np.ndarray with the predicted probabilities of winning.
+
+    Returns:
+        float with the AUC, or NaN if all games have the same result.
+    """
+
+    n_wins = int(y_vector.sum())
+    n_losses = len(y_vector) - n_wins
+    if n_wins == 0 or n_losses == 0:
+        return np.nan
+    ranks = scipy.stats.rankdata(prob)
+    u_statistic = ranks[y_vector == 1].sum() - n_wins * (n_wins + 1) / 2
+    return float(u_statistic / (n_wins * n_losses))
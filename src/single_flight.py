@@ -0,0 +1,153 @@
+"""
+single_flight.py
+    This script contains a single-flight guard for the runs that fetch games and insert
+    them into the feature store (the app's data pull, the cron job and the ingestion
+    daemon). Concurrent requests for the same work, in any process, wait for the one
+    in flight and share its result instead of repeating the API calls and racing on the
+    insert. The guard is a lock on a local file, which the operating system releases as
+    soon as its holder exits, so the lock of a crashed run expires by itself.
+"""
+
+import os
+import re
+import time
+import fcntl
+from contextlib import contextmanager
+import pandas as pd
+
+# Directory of the lock files and the shared results
+LOCK_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "data", "locks"
+)
+
+# Longest wait for a run in flight (fetching whole seasons takes a while since calls to
+# the nba_api are spaced out) and time between tries to take the lock
+WAIT_TIMEOUT = 2 * 3600
+POLL_INTERVAL = 1.0
+
+
+def _path(key: str, suffix: str, lock_dir: str) -> str:
+    """
+    This function builds the path of a file of the guard from its key.
+
+    Args:
+        key: str with the key of the work.
+        suffix: str with the file's extension.
+        lock_dir: str with the directory of the lock files.
+
+    Returns:
+        str with the path of the file.
+    """
+
+    return os.path.join(lock_dir, re.sub(r"[^A-Za-z0-9_.-]", "_", key) + suffix)
+
+
+@contextmanager
+def file_lock(key: str, lock_dir: str = LOCK_DIR, wait_timeout: float = WAIT_TIMEOUT):
+    """
+    Hold the lock of a key, waiting for its current holder to release it. The lock is
+    held by an open file, so it's released when the holder exits, even if it crashes.
+    The holder's process id and start time are written to the file for diagnostics.
+
+    Args:
+        key: str with the key of the lock.
+        lock_dir: str with the directory of the lock files.
+        wait_timeout: float with the longest wait (seconds) for the lock.
+
+    Yields:
+        bool that indicates whether the lock was held by another run when requested.
+    """
+
+    os.makedirs(lock_dir, exist_ok=True)
+    # We don't truncate the file when opening it, so the holder's info stays readable
+    lock_file = open(_path(key, ".lock", lock_dir), "a+")
+    try:
+        waited = False
+        deadline = time.monotonic() + wait_timeout
+        while True:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except BlockingIOError:
+                waited = True
+                if time.monotonic() > deadline:
+                    lock_file.seek(0)
+                    raise TimeoutError(
+                        "The lock " + key + " is still held: " + lock_file.read()
+                    ) from None
+                time.sleep(POLL_INTERVAL)
+
+        lock_file.seek(0)
+        lock_file.truncate()
+        lock_file.write("pid " + str(os.getpid()) + " since " + time.ctime())
+        lock_file.flush()
+        yield waited
+    finally:
+        # Closing the file releases the lock
+        lock_file.close()
+
+
+def pull_key(team_id: int, season_end: int) -> str:
+    """
+    This function builds the key of the runs that pull a team's games missing in the
+    feature store. The app pulls the missing seasons up to the last selected season and
+    the cron job pulls the games after the most recent one up to the current season, so
+    both windows end at the same season when they overlap (e.g., the app pulling the
+    current season before the cron job has pushed any of its games) and the runs share
+    a key.
+
+    Args:
+        team_id: int with the team's id.
+        season_end: int with the last season of the window (e.g., 2023).
+
+    Returns:
+        str with the key of the work.
+    """
+
+    return "pull_data-" + str(team_id) + "-" + str(season_end)
+
+
+def single_flight(
+    key: str,
+    function,
+    *args,
+    lock_dir: str = LOCK_DIR,
+    wait_timeout: float = WAIT_TIMEOUT,
+    **kwargs,
+) -> tuple[object, bool]:
+    """
+    This function runs a function unless the same work (same key) is already in flight,
+    in which case it waits for it and returns its result. If the run in flight fails or
+    crashes without a result, the waiting run runs the function itself.
+
+    Args:
+        key: str with the key of the work (e.g., the team and the season window).
+        function: function that does the work. Its result must be picklable.
+        *args: positional arguments of the function.
+        lock_dir: str with the directory of the lock files and the shared results.
+        wait_timeout: float with the longest wait (seconds) for the run in flight.
+        **kwargs: keyword arguments of the function.
+
+    Returns:
+        result: result of the function.
+        shared: bool that indicates whether the result was shared by another run.
+    """
+
+    result_path = _path(key, ".result.pkl", lock_dir)
+    requested = time.time()
+
+    with file_lock(key, lock_dir=lock_dir, wait_timeout=wait_timeout) as waited:
+        # A result written after the request was made comes from the run we waited for
+        if waited and os.path.exists(result_path):
+            if os.path.getmtime(result_path) >= requested:
+                return pd.read_pickle(result_path), True
+
+        result = function(*args, **kwargs)
+
+        # The result is written to a temporary file first, so waiting runs never read
+        # a partially written result
+        temp_path = result_path + "." + str(os.getpid()) + ".tmp"
+        pd.to_pickle(result, temp_path)
+        os.replace(temp_path, result_path)
+
+    return result, False
@@ -3,18 +3,24 @@ streamlit_app.py
     This script contains the app's frontend. 
 """
 
+import os
 import time
 import streamlit as st
 import pandas as pd
-import matplotlib.pyplot as plt
 from streamlit.delta_generator import DeltaGenerator
 from data import pull_games_starters, pull_games_feature_store
+from artifact_store import load_or_run_analysis
+from duo_leaderboard import pull_leaderboard
 from modeling import (
+    fit_logit,
     prepare_data,
-    log_reg_results,
-    shap_values_results,
-    shap_values_plot,
+    regularization_path,
+    rolling_window_results,
 )
+from pair_analysis import pair_columns, pair_games, pull_player_game_table, rank_pairs
+from plots import regularization_path_plot
+from utils import current_season
+from warmup import WarmCache
 
 
 def pull_games_feature_store_(
@@ -34,6 +40,142 @@ def pull_games_feature_store_(
     return pull_games_feature_store(status_message=status_message)
 
 
+@st.cache_resource
+def get_warm_cache() -> WarmCache:
+    """
+    This function creates the cache shared by all the app's sessions and starts warming
+    it up in the background as soon as the app serves its first session.
+
+    Returns:
+        WarmCache with the games data and the analysis of the default date range.
+    """
+
+    warm_cache = WarmCache()
+    warm_cache.start()
+    return warm_cache
+
+
+@st.cache_data(max_entries=16, show_spinner=False)
+def run_analysis_(
+    games_starters: pd.DataFrame, date_range: tuple, options: dict
+) -> dict:
+    """
+    This function runs the analysis and caches its results together with the rendered
+    plots, so repeated runs over the same games neither refit the models nor render
+    the plots again. The number of entries is bounded to keep the worker's memory flat.
+    Results that aren't in memory are loaded from the artifact store, if they're
+    stored.
+
+    Args:
+        games_starters: pd.DataFrame that contains the team's games data from games
+            where Jokic and Murray were starters.
+        date_range: tuple that contains the start and end date of the analysis.
+        options: dict with the options of the analysis (see run_analysis()).
+
+    Returns:
+        dict with the results of the analysis and the rendered plots.
+    """
+
+    return load_or_run_analysis(games_starters, date_range, options)
+
+
+@st.cache_data(max_entries=16, show_spinner=False)
+def rolling_window_results_(
+    games_starters: pd.DataFrame, window: int, unit: str
+) -> pd.DataFrame:
+    """
+    This function computes the rolling-window trajectory of the coefficients and SHAP
+    values and caches it.
+
+    Args:
+        games_starters: pd.DataFrame that contains the team's games data from games
+            where Jokic and Murray were starters.
+        window: int with the number of games or seasons in each window.
+        unit: str with the window unit, either 'games' or 'seasons'.
+
+    Returns:
+        pd.DataFrame with the trajectory of the coefficients and SHAP values.
+    """
+
+    return rolling_window_results(games_data=games_starters, window=window, unit=unit)
+
+
+@st.cache_data(max_entries=16, show_spinner=False)
+def regularization_path_plot_(games_starters: pd.DataFrame, penalty: str) -> bytes:
+    """
+    This function computes the regularization path of the standardized coefficients
+    and caches its rendered plot.
+
+    Args:
+        games_starters: pd.DataFrame that contains the team's games data from games
+            where Jokic and Murray were starters.
+        penalty: str with the penalty, either 'l1' or 'l2'.
+
+    Returns:
+        bytes with the rendered plot of the regularization path.
+    """
+
+    x_train, y_train = prepare_data(games_starters)
+    c_values, coef_path = regularization_path(
+        x_train=x_train, y_train=y_train, penalty=penalty
+    )
+    # The intercept (last coefficient) isn't plotted
+    return regularization_path_plot(
+        c_values=c_values,
+        coef_path=coef_path[:, :-1],
+        names=list(x_train.columns),
+        penalty=penalty,
+    )
+
+
+@st.cache_data(max_entries=4, ttl=3600, show_spinner=False)
+def player_game_table_(first_season: int, last_season: int) -> pd.DataFrame:
+    """
+    This function pulls the per-player game table of a range of seasons from the
+    feature store and caches it for an hour, so it's shared by the analyses of all
+    pairs.
+
+    Args:
+        first_season: int with the first year of the first season.
+        last_season: int with the first year of the last season.
+
+    Returns:
+        pd.DataFrame with the per-player game table.
+    """
+
+    return pull_player_game_table(first_season=first_season, last_season=last_season)
+
+
+@st.cache_data(max_entries=16, show_spinner=False)
+def rank_pairs_(table: pd.DataFrame, penalty: str) -> pd.DataFrame:
+    """
+    This function fits the models of all pairs of starters as a batch, ranks the pairs
+    and caches the ranking.
+
+    Args:
+        table: pd.DataFrame with the per-player game table.
+        penalty: str with the penalty, either 'none' or 'l2' (C = 1).
+
+    Returns:
+        pd.DataFrame with the ranking of the pairs.
+    """
+
+    return rank_pairs(table=table, c_value=None if penalty == "none" else 1.0)
+
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def pull_leaderboard_() -> pd.DataFrame:
+    """
+    This function pulls the league-wide leaderboard of duos from the feature store and
+    caches it for an hour, since the batch job pushes it rarely.
+
+    Returns:
+        pd.DataFrame with the leaderboard.
+    """
+
+    return pull_leaderboard()
+
+
 # Use all space in the layout
 st.set_page_config(layout="wide")
 
@@ -60,6 +202,10 @@ st.markdown(DESCRIPTION)
 # Placeholder for informative messages
 status_message = st.empty()
 
+# Cache warmed up in the background with the games data and the default analysis
+warm_cache = get_warm_cache()
+warm_cache.refresh_if_ingested()
+
 
 # Initialize the DataFrames that will contain the data used in the analysis
 if "games" not in st.session_state:
@@ -70,13 +216,19 @@ if "games_starters" not in st.session_state:
 
 ### Pull data from feature store
 st.sidebar.header("Feature store")
+st.sidebar.caption(warm_cache.describe())
 # Games button
 if st.sidebar.button("Pull data"):
     if st.session_state.games.empty:
 
-        st.session_state.games, number_games = pull_games_feature_store_(
-            status_message=status_message
-        )
+        # Use the games data from the warm cache if it's already there
+        if not warm_cache.games.empty:
+            st.session_state.games = warm_cache.games.copy()
+            number_games = st.session_state.games.shape[0]
+        else:
+            st.session_state.games, number_games = pull_games_feature_store_(
+                status_message=status_message
+            )
 
         MESSAGE = "Job finished!" + "\n"
         MESSAGE += (
@@ -106,6 +258,27 @@ else:
         max_value=max_date,
     )
 
+    # Both the coefficients and the SHAP values come from the same model
+    selected_model = st.sidebar.radio(
+        label="Select model", options=["Unregularized", "L2-regularized (C = 1)"]
+    )
+    options = {
+        "penalty": "none" if selected_model == "Unregularized" else "l2",
+        "n_bootstrap": (
+            2000
+            if st.sidebar.checkbox(
+                label="Bootstrap confidence intervals (2,000 resamples)"
+            )
+            else 0
+        ),
+        "permutation_test": st.sidebar.checkbox(
+            label="Permutation test of the difference between Jokic and Murray"
+        ),
+        "cross_validation": st.sidebar.checkbox(
+            label="Season-blocked cross-validation"
+        ),
+    }
+
     # Catch error associated with the selection of the end date. When selecting the
     # range, once the start date is selected, an error is raised because the end date
     # is not selected yet.
@@ -151,38 +324,57 @@ else:
                 MESSAGE = MESSAGE.format(NUMBER_OF_GAMES_STR)
                 st.warning(MESSAGE)
             else:
-                status_message.text("Running the logistic regression analysis...")
-                # Split data into standardized independent variables and dependent
-                # variable
-                x_train, y_train = prepare_data(st.session_state.games_starters)
-                # Fit a logistic regression (using statsmodels) and plot the
-                # coefficients
-                jokic, murray, diff_test, bar_plot = log_reg_results(
-                    x_train=x_train, y_train=y_train
+                status_message.text("Running the analysis...")
+                # The analysis of the default date range is precomputed in the warm
+                # cache
+                results = warm_cache.get_results(
+                    (start_date_str, end_date_str), options
                 )
-                container_1.col1.pyplot(bar_plot)
-                time.sleep(1)
-
-                status_message.text("Running the SHAP values analysis...")
-                fig, ax = plt.subplots()
-                ax.set_title("SHAP values")
-                # Compute the SHAP values. We remove the last column of the predictors
-                # in the slicing since an intercept column is added to 'X_train' in
-                # 'log_reg_plot()' and this column is no longer needed since
-                # scikit-learn adds it by default when fitting a logistic regression
-                (
-                    shap_values,
-                    jokic_shap_value,
-                    jokic_prob,
-                    murray_shap_value,
-                    murray_prob,
-                ) = shap_values_results(x_train=x_train.iloc[:, :-1], y_train=y_train)
-
-                # Plot the SHAP values
-                shap_values_plot(shap_values=shap_values, x_train=x_train.iloc[:, :-1])
-                plt.figure().set_figheight(4)
-                container_1.col2.pyplot(fig)
-                time.sleep(1)
+                if results is None:
+                    results = run_analysis_(
+                        st.session_state.games_starters,
+                        (start_date_str, end_date_str),
+                        options,
+                    )
+                jokic = results["jokic"]
+                murray = results["murray"]
+                diff_test = results["diff_test"]
+                jokic_shap_value, jokic_prob = results["jokic_shap"]
+                murray_shap_value, murray_prob = results["murray_shap"]
+
+                # Display the plots, which are cached as PNG images together with the
+                # results
+                container_1.col1.image(results["coef_plot"], use_column_width=True)
+                container_1.col2.image(results["shap_plot"], use_column_width=True)
+
+                # Display the out-of-sample metrics next to the coefficients, if they
+                # were computed
+                if results["cross_validation"] is not None:
+                    cv_folds, cv_calibration = results["cross_validation"]
+                    container_1.col1.caption(
+                        "Season-blocked cross-validation: each season is predicted by "
+                        + "a model trained on the previous seasons only."
+                    )
+                    container_1.col1.dataframe(
+                        cv_folds.round(3), hide_index=True, use_container_width=True
+                    )
+                    container_1.col1.caption(
+                        "Calibration of the out-of-sample predictions."
+                    )
+                    container_1.col1.dataframe(
+                        cv_calibration.round(3), use_container_width=True
+                    )
+
+                # Display the bootstrap confidence intervals, if they were computed
+                if results["bootstrap"] is not None:
+                    container_bootstrap = st.container()
+                    container_bootstrap.subheader("Bootstrap 95% confidence intervals")
+                    container_bootstrap.caption(
+                        "Percentile intervals from "
+                        + str(results["bootstrap"].attrs["replicates"])
+                        + " converged bootstrap replicates."
+                    )
+                    container_bootstrap.dataframe(results["bootstrap"].round(3))
 
                 status_message.text("Job finished! See the results below.")
 
@@ -256,6 +448,35 @@ else:
                 )
                 container_4.col1.info(MESSAGE)
 
+                # Results of the permutation test, if it was run
+                if results["permutation_test"] is not None:
+                    perm_test = results["permutation_test"]
+                    MESSAGE = (
+                        "Permutation test (sign flips): p = "
+                        + str(perm_test["p_value"])
+                        + " ± "
+                        + str(perm_test["mc_error"])
+                        + " (Monte Carlo error) from "
+                        + str(perm_test["permutations"])
+                        + " permutations, computed in "
+                        + str(perm_test["elapsed"])
+                        + " s."
+                    )
+                    container_4.col2.info(MESSAGE)
+
+                # Differences between all pairs of coefficients
+                container_contrasts = st.container()
+                container_contrasts.col1, container_contrasts.col2 = st.columns(2)
+                container_contrasts.col1.image(
+                    results["contrasts_plot"], use_column_width=True
+                )
+                container_contrasts.col2.info(
+                    "The heatmap shows the z-scores of the differences between all "
+                    + "pairs of standardized coefficients (row minus column). An "
+                    + "asterisk marks the statistically significant differences after "
+                    + "adjusting the p-values for multiple comparisons (Holm's method)."
+                )
+
                 container_5 = st.container()
                 MESSAGE = """
                 Caution is advised when interpreting the results. Even if there's a
@@ -268,3 +489,210 @@ else:
                 container_5.warning(MESSAGE)
         except NameError:
             status_message.text("Make sure to select a date range.")
+
+
+### Run the rolling-window analysis
+if not st.session_state.games.empty:
+    st.sidebar.header("Rolling window")
+    window_unit = st.sidebar.radio(label="Window unit", options=["games", "seasons"])
+    if window_unit == "games":
+        window_size = st.sidebar.number_input(
+            label="Games per window", min_value=180, value=180, step=10
+        )
+    else:
+        window_size = st.sidebar.number_input(
+            label="Seasons per window", min_value=1, value=3, step=1
+        )
+
+    if st.sidebar.button("Run rolling window"):
+        # The windows slide across the whole history of games where both Jokic and
+        # Murray were starters
+        all_games_starters = pull_games_starters(
+            team_games=st.session_state.games,
+            date_range=(
+                st.session_state.games["game_date"].min(),
+                st.session_state.games["game_date"].max(),
+            ),
+        )
+        try:
+            trajectory = rolling_window_results_(
+                games_starters=all_games_starters,
+                window=int(window_size),
+                unit=window_unit,
+            )
+        except ValueError:
+            st.warning("The window is larger than the available games data.")
+        else:
+            status_message.text("Rolling-window analysis finished!")
+            container_6 = st.container()
+            container_6.col1, container_6.col2 = st.columns(2)
+            container_6.col1.subheader("Standardized coefficients")
+            container_6.col1.line_chart(
+                trajectory[["jokic_ast_coef", "murray_pts_coef"]]
+            )
+            container_6.col2.subheader("Mean absolute SHAP values")
+            container_6.col2.line_chart(
+                trajectory[["jokic_ast_shap", "murray_pts_shap"]]
+            )
+
+
+### Run the regularization path
+if not st.session_state.games.empty:
+    st.sidebar.header("Regularization path")
+    path_penalty = st.sidebar.radio(label="Penalty", options=["L1", "L2"])
+
+    if st.sidebar.button("Run regularization path"):
+        # The path is fitted to the games of the selected date range
+        try:
+            path_games_starters = pull_games_starters(
+                team_games=st.session_state.games,
+                date_range=(start_date_str, end_date_str),
+            )
+        except NameError:
+            status_message.text("Make sure to select a date range.")
+        else:
+            if path_games_starters.shape[0] < 180:
+                st.warning(
+                    "At least 180 games are needed to fit the model. Please revise the "
+                    + "date range and try again."
+                )
+            else:
+                status_message.text("Regularization path finished!")
+                container_7 = st.container()
+                container_7.col1, container_7.col2 = st.columns(2)
+                container_7.col1.image(
+                    regularization_path_plot_(
+                        games_starters=path_games_starters,
+                        penalty=path_penalty.lower(),
+                    ),
+                    use_column_width=True,
+                )
+
+
+### Rank the pairs of starters
+if "pairs" not in st.session_state:
+    st.session_state.pairs = pd.DataFrame()
+st.sidebar.header("Starter pairs")
+pair_seasons = st.sidebar.slider(
+    label="Seasons (first year)",
+    min_value=2000,
+    max_value=current_season(),
+    value=(current_season() - 6, current_season()),
+)
+pair_model = st.sidebar.radio(
+    label="Pairs' model", options=["Unregularized", "L2-regularized (C = 1)"]
+)
+
+if st.sidebar.button("Rank pairs"):
+    # The table is built from the lake of raw box scores, which has the stats of the
+    # whole roster, and pushed into the feature store by pair_analysis.py
+    pairs_table = player_game_table_(
+        first_season=pair_seasons[0], last_season=pair_seasons[1]
+    )
+    st.session_state.pairs = rank_pairs_(
+        table=pairs_table,
+        penalty="none" if pair_model == "Unregularized" else "l2",
+    )
+    # The seasons and model of the ranking, so the coefficients of a pair are fitted
+    # to the same games even if the sidebar changes afterwards
+    st.session_state.pair_seasons = pair_seasons
+    st.session_state.pair_penalty = "none" if pair_model == "Unregularized" else "l2"
+    if st.session_state.pairs.empty:
+        st.warning(
+            "No pair of players started at least 90 games together in the selected "
+            + "seasons (or their box scores aren't in the feature store). Please "
+            + "revise the seasons and try again."
+        )
+    else:
+        status_message.text(
+            "Ranked " + str(st.session_state.pairs.shape[0]) + " pairs of starters!"
+        )
+
+if not st.session_state.pairs.empty:
+    container_8 = st.container()
+    container_8.subheader("Pairs of starters")
+    container_8.caption(
+        "Each pair is fitted to the games where both players were starters, with the "
+        + "same 9 features as the analysis of Jokic and Murray. The importance is the "
+        + "sum of the mean absolute SHAP values (log odds) of both players' points, "
+        + "rebounds and assists. The top stat of each player is the one with the "
+        + "largest importance, with its standardized coefficient and p-value."
+    )
+    container_8.dataframe(
+        st.session_state.pairs.drop(columns=["player_1_id", "player_2_id"]).round(3),
+        hide_index=True,
+        use_container_width=True,
+    )
+
+    # Coefficients of a single pair
+    pair_labels = (
+        st.session_state.pairs["player_1"] + " & " + st.session_state.pairs["player_2"]
+    ).tolist()
+    selected_pair = container_8.selectbox(
+        label="Pair's coefficients", options=pair_labels
+    )
+    pair = st.session_state.pairs.iloc[pair_labels.index(selected_pair)]
+    selected_games = pair_games(
+        table=player_game_table_(
+            first_season=st.session_state.pair_seasons[0],
+            last_season=st.session_state.pair_seasons[1],
+        ),
+        player_1=pair["player_1_id"],
+        player_2=pair["player_2_id"],
+    )
+    if selected_games.empty:
+        container_8.warning(
+            "The games of this pair aren't available anymore. Please rank the pairs "
+            + "again."
+        )
+    else:
+        x_pair, y_pair = prepare_data(
+            selected_games,
+            features=pair_columns(pair["player_1_id"], pair["player_2_id"]),
+        )
+        pair_fit = fit_logit(
+            x_train=x_pair,
+            y_train=y_pair,
+            penalty=st.session_state.pair_penalty,
+        )
+        container_8.dataframe(pair_fit.summary.iloc[:-1, :].round(3))
+
+
+### League-wide leaderboard of duos
+# The leaderboard is precomputed by the batch job duo_leaderboard.py, which pushes it
+# into the feature store
+leaderboard = pull_leaderboard_()
+if not leaderboard.empty:
+    st.sidebar.header("League duos")
+    leaderboard_season = st.sidebar.selectbox(
+        label="Season (first year)",
+        options=["All"] + sorted(leaderboard["season"].unique().tolist(), reverse=True),
+    )
+    leaderboard_teams = st.sidebar.multiselect(
+        label="Teams", options=sorted(leaderboard["team"].unique().tolist())
+    )
+    leaderboard_sort = st.sidebar.selectbox(
+        label="Sort by", options=["importance", "win_pct", "games"]
+    )
+
+    if st.sidebar.checkbox(label="Show league duos"):
+        selected_duos = leaderboard
+        if leaderboard_season != "All":
+            selected_duos = selected_duos[selected_duos["season"] == leaderboard_season]
+        if leaderboard_teams:
+            selected_duos = selected_duos[selected_duos["team"].isin(leaderboard_teams)]
+
+        container_9 = st.container()
+        container_9.subheader("League-wide duos")
+        container_9.caption(
+            "Top duos of each team and season, ranked by the importance of both "
+            + "players' stats in an L2-regularized model fitted to the games where "
+            + "both were starters."
+        )
+        container_9.dataframe(
+            selected_duos.sort_values(leaderboard_sort, ascending=False)
+            .drop(columns=["team_id", "player_1_id", "player_2_id"])
+            .round(3),
+            hide_index=True,
+            use_container_width=True,
+        )
@@ -3,8 +3,16 @@ utils.py
     This script contains supporting functions.
 """
 
+import os
 import math
+import hashlib
 from datetime import datetime, timedelta
+import pandas as pd
+from nba_api.stats.library.http import NBAStatsHTTP
+
+# Environment variable with the base URL of the NBA stats API the nba_api calls (e.g.,
+# the replay server's, see replay_server.py)
+NBA_STATS_BASE_URL_ENV = "NBA_STATS_BASE_URL"
 
 
 def add_one_day(date_str: str) -> str:
@@ -66,3 +74,65 @@ def odds_to_prob(odds: float) -> float:
 
     prob = (1 + odds) / (1 + (1 + odds))
     return prob
+
+
+def season_id_from_game_id(game_id: str) -> str:
+    """
+    This function derives the season id of a game from its id. A game id contains the
+    game type in its third digit and the last two digits of the season's first year in
+    the fourth and fifth ones (e.g., 0022300061 is a game of the 2023-24 regular
+    season, whose season id is 22023).
+
+    Args:
+        game_id: str with the game id.
+
+    Returns:
+        str with the season id.
+    """
+
+    return game_id[2] + "20" + game_id[3:5]
+
+
+def current_season() -> int:
+    """
+    This function returns the first year of the current season. A season starts in
+    October, so the games played from January to September belong to the season that
+    started the year before.
+
+    Returns:
+        int with the first year of the current season.
+    """
+
+    today = datetime.now()
+    return today.year if today.month >= 10 else today.year - 1
+
+
+def data_fingerprint(games_data: pd.DataFrame) -> str:
+    """
+    This function computes a fingerprint of a games data set, which changes whenever
+    any value, column or the order of the games changes.
+
+    Args:
+        games_data: pd.DataFrame that contains the games data.
+
+    Returns:
+        str with the hexadecimal SHA-256 digest of the data.
+    """
+
+    digest = hashlib.sha256()
+    digest.update(",".join(map(str, games_data.columns)).encode())
+    digest.update(pd.util.hash_pandas_object(games_data, index=False).to_numpy())
+
+    return digest.hexdigest()
+
+
+def configure_nba_api() -> None:
+    """
+    This function points the nba_api's stats endpoints to the base URL set in the
+    environment variable NBA_STATS_BASE_URL (e.g., http://127.0.0.1:8765/stats for the
+    replay server), if any. Otherwise, they call stats.nba.com.
+    """
+
+    base_url = os.environ.get(NBA_STATS_BASE_URL_ENV)
+    if base_url:
+        NBAStatsHTTP.base_url = base_url.rstrip("/") + "/{endpoint}"
@@ -0,0 +1,221 @@
+"""
+warmup.py
+    This script contains the cache the app warms up in the background: it pulls the
+    games data from the feature store and precomputes the analysis of the default date
+    range, so the first interaction of a user is a cache hit. The cache warms up again
+    after new games are pushed into the feature store.
+"""
+
+import time
+import threading
+import traceback
+import pandas as pd
+from data import pull_games_starters, pull_games_feature_store
+from analysis import DEFAULT_OPTIONS
+from artifact_store import load_or_run_analysis
+from feature_store import feature_group_connection_r1
+from model_state import pull_model_state
+
+# Shortest time (seconds) between two checks for new games in the feature store
+CHECK_INTERVAL = 600
+
+
+class SilentStatus:
+    """
+    Stand-in for the app's status message used by the background warm-up, which has
+    nowhere to display messages.
+    """
+
+    def text(self, body: str) -> None:
+        """
+        Discard a status message.
+        """
+
+
+class WarmCache:
+    """
+    Games data and analysis results shared by all the app's sessions.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.thread = None
+        self.status = "cold"
+        self.games = pd.DataFrame()
+        self.games_time = None
+        # Results of the analysis keyed by the date range and the options of the
+        # analysis, together with the time they were computed
+        self.results = {}
+        # Date of the most recent game of the last successful warm-up, and time of the
+        # last check for new games
+        self.latest_game_date = None
+        self.checked_time = time.time()
+
+    def start(self, only_if_ingested: bool = False) -> None:
+        """
+        Start warming up the cache in a background thread, unless it's already warming
+        up.
+
+        Args:
+            only_if_ingested: bool that indicates whether to warm up only if new games
+                were pushed into the feature store since the last warm-up.
+        """
+
+        with self.lock:
+            if self.thread is not None and self.thread.is_alive():
+                return
+            self.thread = threading.Thread(
+                target=self._warm_up, args=(only_if_ingested,), daemon=True
+            )
+            self.thread.start()
+
+    def refresh_if_ingested(self) -> None:
+        """
+        Warm up the cache again if new games were pushed into the feature store since
+        the last warm-up, or if the last warm-up failed. The feature store is checked
+        in the background, at most once every CHECK_INTERVAL seconds.
+        """
+
+        with self.lock:
+            if time.time() - self.checked_time < CHECK_INTERVAL:
+                return
+            self.checked_time = time.time()
+        self.start(only_if_ingested=True)
+
+    def _warm_up(self, only_if_ingested: bool = False) -> None:
+        """
+        Pull the games data and precompute the analysis of the default date range, i.e.,
+        from the oldest to the most recent game, unless it's already in the artifact
+        store. The analysis takes the model of the state pushed by the cron job, if it
+        was fitted to the same games, instead of fitting it again.
+
+        Args:
+            only_if_ingested: bool that indicates whether to warm up only if new games
+                were pushed into the feature store since the last warm-up.
+        """
+
+        try:
+            # The cache is up to date if the most recent game didn't change
+            if only_if_ingested and self.latest_game_date is not None:
+                if latest_game_date() == self.latest_game_date:
+                    return
+
+            with self.lock:
+                self.status = "warming up"
+            games, _ = pull_games_feature_store(status_message=SilentStatus())
+            date_range = (games["game_date"].min(), games["game_date"].max())
+            games_starters = pull_games_starters(
+                team_games=games, date_range=date_range
+            )
+            results = None
+            if games_starters.shape[0] >= 180:
+                # The state's model is unregularized, as the default analysis
+                results = load_or_run_analysis(
+                    games_starters,
+                    date_range,
+                    DEFAULT_OPTIONS,
+                    model=pull_model_state(games_starters),
+                )
+        # The warm-up is tried again at the next check
+        except Exception:  # pylint: disable=broad-except
+            print("The warm-up of the cache failed:\n" + traceback.format_exc())
+            with self.lock:
+                self.status = "cold" if self.games.empty else "stale"
+            return
+
+        with self.lock:
+            self.games = games
+            self.games_time = time.time()
+            self.latest_game_date = date_range[1]
+            # Results computed from previous games data are no longer valid
+            self.results = {}
+            if results is not None:
+                key = analysis_key(date_range, DEFAULT_OPTIONS)
+                self.results[key] = (results, time.time())
+            self.status = "warm"
+
+    def get_results(self, date_range: tuple, options: dict) -> dict | None:
+        """
+        Return the cached results of an analysis, if any.
+
+        Args:
+            date_range: tuple that contains the start and end date of the analysis.
+            options: dict with the options of the analysis (see run_analysis()).
+
+        Returns:
+            dict with the results of the analysis, or None if they aren't cached.
+        """
+
+        with self.lock:
+            entry = self.results.get(analysis_key(date_range, options))
+        return None if entry is None else entry[0]
+
+    def describe(self) -> str:
+        """
+        Describe the status of the cache and the age of its entries.
+
+        Returns:
+            str with the description.
+        """
+
+        with self.lock:
+            if self.games_time is None:
+                return "Cache: " + self.status + "."
+            now = time.time()
+            message = "Cache: " + self.status + ". Games pulled "
+            message += format_age(now - self.games_time) + " ago"
+            if self.results:
+                oldest = min(computed for _, computed in self.results.values())
+                message += ", " + str(len(self.results)) + " analyses cached (oldest "
+                message += format_age(now - oldest) + " ago)"
+            return message + "."
+
+
+def latest_game_date() -> str:
+    """
+    This function pulls the date of the most recent game in the feature store.
+
+    Returns:
+        str with the date (yyyy-mm-dd) of the most recent game.
+    """
+
+    hsfs_connection, feature_group = feature_group_connection_r1()
+    try:
+        return feature_group.select(["game_date"]).read(online=True)["game_date"].max()
+    finally:
+        hsfs_connection.close()
+
+
+def analysis_key(date_range: tuple, options: dict) -> tuple:
+    """
+    This function builds the key of an analysis in the cache.
+
+    Args:
+        date_range: tuple that contains the start and end date of the analysis.
+        options: dict with the options of the analysis (see run_analysis()).
+
+    Returns:
+        tuple with the date range and the options, sorted by name.
+    """
+
+    return tuple(date_range) + tuple(sorted(options.items()))
+
+
+def format_age(seconds: float) -> str:
+    """
+    This function formats an age in seconds as a short human-readable string.
+
+    Args:
+        seconds: float with the age in seconds.
+
+    Returns:
+        str with the age in seconds, minutes, hours or days.
+    """
+
+    if seconds < 60:
+        return str(int(seconds)) + " s"
+    if seconds < 3600:
+        return str(int(seconds // 60)) + " min"
+    if seconds < 86400:
+        return str(int(seconds // 3600)) + " h"
+    return str(int(seconds // 86400)) + " d"